@@ -2,7 +2,7 @@ import collections
 import datetime
 import functools
 import inspect
-import math
+import os
 
 import astromodels
 import astropy.units as u
@@ -27,6 +27,18 @@ else:
 
     has_chainconsumer = True
 
+try:
+
+    import tables
+
+except ImportError:
+
+    has_tables = False
+
+else:
+
+    has_tables = True
+
 from threeML.exceptions.custom_exceptions import custom_warnings
 from threeML.io.file_utils import sanitize_filename
 from threeML.io.fits_file import fits, FITSFile, FITSExtension
@@ -35,7 +47,8 @@ from threeML.io.table import NumericMatrix
 from threeML.io.uncertainty_formatter import uncertainty_formatter
 from threeML.io.results_table import ResultsTable
 from threeML.version import __version__
-from threeML.random_variates import RandomVariates
+from threeML.random_variates import RandomVariates, equal_tail_intervals, highest_posterior_density_intervals
+from threeML.utils.statistics.stats_tools import correlation_matrix
 from threeML.io.calculate_flux import _calculate_point_source_flux
 from threeML.config.config import threeML_config
 
@@ -60,12 +73,19 @@ def _escape_back_yaml_from_fits(yaml_code):
 
 def load_analysis_results(fits_file):
     """
-    Load the results of one or more analysis from a FITS file produced by 3ML
+    Load the results of one or more analysis from a FITS or HDF5 file produced by 3ML. HDF5 files (with extension .h5,
+    .hdf5 or .hdf) are read lazily: the samples are read when they are used, and the results of a set are built
+    when they are accessed.
 
-    :param fits_file: path to the FITS file containing the results, as output by MLEResults or BayesianResults
+    :param fits_file: path to the FITS or HDF5 file containing the results, as output by MLEResults or
+    BayesianResults (or AnalysisResultsSet)
     :return: a new instance of either MLEResults or Bayesian results dending on the type of the input FITS file
     """
 
+    if _is_hdf5_file_name(fits_file):
+
+        return _load_hdf5_results(fits_file)
+
     with fits.open(fits_file) as f:
 
         n_results = map(lambda x: x.name, f).count('ANALYSIS_RESULTS')
@@ -287,6 +307,10 @@ class ANALYSIS_RESULTS(FITSExtension):
 
         measure_series = analysis_results.statistical_measures # type: pd.Series
 
+        # non-finite values (like an undefined convergence diagnostic) cannot be stored in a FITS header
+
+        measure_series = measure_series[np.isfinite(measure_series.values.astype(float))]
+
         for i, (measure, measure_value) in enumerate(measure_series.iteritems()):
             self.hdu.header.set("MEAS%i" % i, measure, comment="Measure type %i" % i)
             self.hdu.header.set("MV%i" % i, measure_value, comment="Measure value %i" % i)
@@ -335,6 +359,458 @@ class AnalysisResultsFITS(FITSFile):
         self._hdu_list[0].header.set("ORIGIN", "3ML", comment=('Multi-Mission Max. Likelihood v. %s' % __version__))
 
 
+# The HDF5 format stores a set of results in a columnar way: one row per result in the "results" table, one row per
+# free parameter in the "parameters" table and one row per statistic in the "statistics" table. The samples of all
+# the results are concatenated in one compressed array, where the samples of each parameter are contiguous, and the
+# covariance matrices are concatenated in the same way. The models are stored as yaml strings.
+
+_hdf5_extensions = ('.h5', '.hdf5', '.hdf')
+
+_hdf5_filters = tables.Filters(complevel=5, complib='blosc:lz4', shuffle=True) if has_tables else None
+
+
+def _is_hdf5_file_name(filename):
+
+    return os.path.splitext(filename)[1].lower() in _hdf5_extensions
+
+
+def _check_has_tables():
+
+    if not has_tables:
+
+        raise RuntimeError("You need to install PyTables (pip install tables) to use the HDF5 format for the results")
+
+
+def _string_dtype(strings):
+
+    return 'S%i' % max([1] + [len(x) for x in strings])
+
+
+def _write_hdf5_results(analysis_results, filename, overwrite=False, sequence_name=None, sequence_tuple=None):
+    """
+    Write one or more results to a HDF5 file
+
+    :param analysis_results: a list of results
+    :param filename: name of the output file
+    :param overwrite: True or False
+    :param sequence_name: the type of sequence (for a set of results)
+    :param sequence_tuple: the columns of the sequence (for a set of results)
+    :return: None
+    """
+
+    _check_has_tables()
+
+    filename = sanitize_filename(filename)
+
+    if os.path.exists(filename) and not overwrite:
+
+        raise IOError("The file %s already exists!" % filename)
+
+    results_rows = []
+    parameters_rows = []
+    statistics_rows = []
+    models = []
+
+    samples = []
+    covariances = []
+
+    n_samples_written = 0
+    n_covariance_written = 0
+
+    for i, this_results in enumerate(analysis_results):
+
+        optimized_model = this_results.optimized_model
+
+        models.append(my_yaml.dump(optimized_model.to_dict_with_types()))
+
+        # Get data frame with parameters (always use equal tail errors, as in the FITS format)
+
+        data_frame = this_results.get_data_frame(error_type="equal tail")
+
+        n_parameters = data_frame.shape[0]
+
+        if this_results.analysis_type == "MLE":
+
+            # the samples are generated again from the covariance matrix when loading
+
+            n_samples = 0
+
+            covariance_matrix = np.array(this_results.covariance_matrix, dtype=float).reshape(-1)
+
+            covariances.append(covariance_matrix)
+
+        else:
+
+            n_samples = this_results._samples_transposed.shape[1]
+
+            covariance_matrix = np.zeros(0)
+
+            # (n_parameters, n_samples), so that the samples of each parameter are contiguous
+
+            samples.append(this_results._samples_transposed)
+
+        results_rows.append((this_results.analysis_type, n_parameters, n_samples, len(parameters_rows),
+                             n_samples_written, n_covariance_written, len(statistics_rows)))
+
+        columns = [data_frame.index] + [data_frame[key].values for key in ['value', 'negative_error',
+                                                                          'positive_error', 'error', 'unit']]
+
+        for j, (name, value, negative_error, positive_error, error, unit) in enumerate(zip(*columns)):
+
+            parameters_rows.append((i, name, value, negative_error, positive_error, error, str(unit),
+                                    n_samples_written + j * n_samples))
+
+        for name, value in this_results.optimal_statistic_values.items():
+
+            statistics_rows.append((i, 'statistic', name, value))
+
+        for name, value in this_results.statistical_measures.items():
+
+            statistics_rows.append((i, 'measure', name, value))
+
+        n_samples_written += n_parameters * n_samples
+        n_covariance_written += covariance_matrix.shape[0]
+
+    results_array = np.array(results_rows, dtype=[('analysis_type', 'S16'),
+                                                  ('n_parameters', np.int64),
+                                                  ('n_samples', np.int64),
+                                                  ('first_parameter', np.int64),
+                                                  ('samples_offset', np.int64),
+                                                  ('covariance_offset', np.int64),
+                                                  ('first_statistic', np.int64)])
+
+    parameters_array = np.array(parameters_rows, dtype=[('result', np.int64),
+                                                        ('name', _string_dtype([x[1] for x in parameters_rows])),
+                                                        ('value', float),
+                                                        ('negative_error', float),
+                                                        ('positive_error', float),
+                                                        ('error', float),
+                                                        ('unit', _string_dtype([x[6] for x in parameters_rows])),
+                                                        ('samples_offset', np.int64)])
+
+    statistics_array = np.array(statistics_rows, dtype=[('result', np.int64),
+                                                        ('kind', 'S16'),
+                                                        ('name', _string_dtype([x[2] for x in statistics_rows])),
+                                                        ('value', float)])
+
+    with tables.open_file(filename, mode='w', title='3ML analysis results', filters=_hdf5_filters) as f:
+
+        f.root._v_attrs.ORIGIN = '3ML'
+        f.root._v_attrs.VERSION = __version__
+        f.root._v_attrs.DATE = datetime.datetime.now().isoformat()
+
+        f.create_table('/', 'results', obj=results_array)
+        f.create_table('/', 'parameters', obj=parameters_array)
+        f.create_table('/', 'statistics', obj=statistics_array)
+
+        models_array = f.create_vlarray('/', 'models', tables.VLUnicodeAtom())
+
+        for model in models:
+
+            models_array.append(model)
+
+        # one chunk for the samples of each parameter (up to a maximum size)
+
+        n_samples = max([1] + [row[2] for row in results_rows])
+
+        samples_array = f.create_earray('/', 'samples', tables.Float64Atom(), shape=(0,),
+                                        chunkshape=(min(n_samples, 2 ** 16),), expectedrows=max(n_samples_written, 1))
+
+        for these_samples in samples:
+
+            samples_array.append(np.ravel(these_samples))
+
+        covariance_array = f.create_earray('/', 'covariance', tables.Float64Atom(), shape=(0,),
+                                           expectedrows=max(n_covariance_written, 1))
+
+        for covariance_matrix in covariances:
+
+            covariance_array.append(covariance_matrix)
+
+        if sequence_name is not None:
+
+            sequence_group = f.create_group('/', 'sequence')
+
+            sequence_group._v_attrs.SEQ_TYPE = sequence_name
+            sequence_group._v_attrs.COLUMNS = [name for name, _ in sequence_tuple]
+
+            for name, column in sequence_tuple:
+
+                if isinstance(column, u.Quantity):
+
+                    column_array = f.create_array(sequence_group, name, np.array(column.value))
+
+                    column_array._v_attrs.UNIT = column.unit.to_string()
+
+                else:
+
+                    column_array = f.create_array(sequence_group, name, np.array(column))
+
+                    column_array._v_attrs.UNIT = ''
+
+
+class _HDF5Samples(object):
+
+    def __init__(self, filename, offset, n_parameters, n_samples):
+        """
+        The samples of one result in a HDF5 file, read only when needed
+
+        :param filename: the HDF5 file
+        :param offset: the position of the first sample of the result in the array of samples
+        :param n_parameters: number of parameters
+        :param n_samples: number of samples
+        """
+
+        self._filename = filename
+        self._offset = offset
+        self._n_parameters = n_parameters
+        self._n_samples = n_samples
+
+    @property
+    def shape(self):
+
+        return self._n_samples, self._n_parameters
+
+    def read_parameter(self, i):
+        """
+        :param i: the index of the parameter
+        :return: the samples of one parameter
+        """
+
+        start = self._offset + i * self._n_samples
+
+        with tables.open_file(self._filename) as f:
+
+            return f.root.samples[start: start + self._n_samples]
+
+    def read(self):
+        """
+        :return: the (n_samples, n_parameters) matrix of samples
+        """
+
+        with tables.open_file(self._filename) as f:
+
+            samples = f.root.samples[self._offset: self._offset + self._n_parameters * self._n_samples]
+
+        return samples.reshape(self._n_parameters, self._n_samples).T
+
+
+class _AnalysisResultsHDF5(object):
+
+    def __init__(self, filename):
+        """
+        Read the tables of a HDF5 file containing results. The models and the samples are read only when a result is
+        built with get_results.
+
+        :param filename: the HDF5 file
+        """
+
+        _check_has_tables()
+
+        self._filename = sanitize_filename(filename)
+
+        with tables.open_file(self._filename) as f:
+
+            self._results = f.root.results.read()
+            self._parameters = f.root.parameters.read()
+            self._statistics = f.root.statistics.read()
+
+            if '/sequence' in f:
+
+                sequence_group = f.root.sequence
+
+                self._sequence_name = str(sequence_group._v_attrs.SEQ_TYPE)
+
+                sequence_tuple = []
+
+                for name in sequence_group._v_attrs.COLUMNS:
+
+                    column = sequence_group._f_get_child(name)
+
+                    unit = column._v_attrs.UNIT
+
+                    if unit:
+
+                        sequence_tuple.append((str(name), column.read() * u.Unit(unit)))
+
+                    else:
+
+                        sequence_tuple.append((str(name), column.read()))
+
+                self._sequence_tuple = tuple(sequence_tuple)
+
+            else:
+
+                self._sequence_name = None
+                self._sequence_tuple = None
+
+    def __len__(self):
+
+        return self._results.shape[0]
+
+    @property
+    def sequence_name(self):
+
+        return self._sequence_name
+
+    @property
+    def sequence_tuple(self):
+
+        return self._sequence_tuple
+
+    def get_data_frame(self):
+        """
+        :return: a pandas DataFrame with the parameters of all the results (one row per parameter), with the columns
+        of the sequence
+        """
+
+        data_frame = pd.DataFrame({'result': self._parameters['result'],
+                                   'parameter': self._parameters['name'].astype(str),
+                                   'value': self._parameters['value'],
+                                   'negative_error': self._parameters['negative_error'],
+                                   'positive_error': self._parameters['positive_error'],
+                                   'error': self._parameters['error'],
+                                   'unit': self._parameters['unit'].astype(str)},
+                                  columns=['result', 'parameter', 'value', 'negative_error', 'positive_error', 'error',
+                                           'unit'])
+
+        if self._sequence_tuple is not None:
+
+            for k, (name, column) in enumerate(self._sequence_tuple):
+
+                column = column.value if isinstance(column, u.Quantity) else np.asarray(column)
+
+                data_frame.insert(k + 1, name, column[data_frame['result'].values])
+
+        return data_frame
+
+    def get_results(self, i):
+        """
+        Build one of the results
+
+        :param i: the index of the result
+        :return: a MLEResults or BayesianResults instance
+        """
+
+        row = self._results[i]
+
+        analysis_type = self._results['analysis_type'].astype(str)[i]
+
+        n_parameters = int(row['n_parameters'])
+
+        with tables.open_file(self._filename) as f:
+
+            model_dict = my_yaml.load(f.root.models[i])
+
+            if analysis_type == "MLE":
+
+                start = int(row['covariance_offset'])
+
+                covariance_matrix = f.root.covariance[start: start + n_parameters ** 2]
+
+        optimized_model = ModelParser(model_dict=model_dict).get_model()
+
+        # Gather statistics values
+
+        statistic_values = collections.OrderedDict()
+
+        measure_values = collections.OrderedDict()
+
+        statistics = self._statistics[self._statistics['result'] == i]
+
+        for kind, name, value in zip(statistics['kind'].astype(str), statistics['name'].astype(str),
+                                     statistics['value']):
+
+            if kind == 'statistic':
+
+                statistic_values[name] = float(value)
+
+            else:
+
+                measure_values[name] = float(value)
+
+        if analysis_type == "MLE":
+
+            covariance_matrix = covariance_matrix.reshape(n_parameters, n_parameters)
+
+            return MLEResults(optimized_model, covariance_matrix, statistic_values, statistical_measures=measure_values)
+
+        else:
+
+            samples = _HDF5Samples(self._filename, int(row['samples_offset']), n_parameters, int(row['n_samples']))
+
+            return BayesianResults(optimized_model, samples, statistic_values, statistical_measures=measure_values)
+
+
+class _LazyResultsList(collections.Sequence):
+
+    def __init__(self, hdf5_results):
+        """
+        A list of results which are built from a HDF5 file when they are accessed for the first time
+
+        :param hdf5_results: a _AnalysisResultsHDF5 instance
+        """
+
+        self._hdf5_results = hdf5_results
+
+        self._cache = {}
+
+    def __len__(self):
+
+        return len(self._hdf5_results)
+
+    def __getitem__(self, item):
+
+        if isinstance(item, slice):
+
+            return [self[i] for i in range(*item.indices(len(self)))]
+
+        if item < 0:
+
+            item += len(self)
+
+        if not 0 <= item < len(self):
+
+            raise IndexError("list index out of range")
+
+        if item not in self._cache:
+
+            self._cache[item] = self._hdf5_results.get_results(item)
+
+        return self._cache[item]
+
+
+def _load_hdf5_results(filename):
+
+    hdf5_results = _AnalysisResultsHDF5(filename)
+
+    if len(hdf5_results) == 1 and hdf5_results.sequence_name is None:
+
+        return hdf5_results.get_results(0)
+
+    this_set = AnalysisResultsSet(_LazyResultsList(hdf5_results))
+
+    if hdf5_results.sequence_name is not None:
+
+        this_set.characterize_sequence(hdf5_results.sequence_name, hdf5_results.sequence_tuple)
+
+    return this_set
+
+
+def load_analysis_results_frame(hdf5_file):
+    """
+    Read the parameters of all the results in a HDF5 file produced by 3ML, without building the results. This is much
+    faster than load_analysis_results for large sets of results (for example, a time-resolved analysis).
+
+    :param hdf5_file: path to the HDF5 file
+    :return: a pandas DataFrame with one row for each free parameter of each result, with the index of the result,
+    the value and errors (equal tail) of the parameter, and the columns of the sequence (if any)
+    """
+
+    return _AnalysisResultsHDF5(hdf5_file).get_data_frame()
+
+
+
 class _AnalysisResults(object):
     """
     A unified class to store results from a maximum likelihood or a Bayesian analysis, which provides a unique interface
@@ -367,9 +843,20 @@ class _AnalysisResults(object):
 
         self._optimized_model = astromodels.clone_model(optimized_model)
 
-        # Save a transposed version of the samples for easier access
+        # Save a transposed version of the samples for easier access (the samples of results loaded from a HDF5 file
+        # are read only when they are needed)
+
+        if isinstance(samples, _HDF5Samples):
+
+            self._lazy_samples = samples
+
+            self._samples_transposed_cache = None
+
+        else:
+
+            self._lazy_samples = None
 
-        self._samples_transposed = samples.T
+            self._samples_transposed_cache = samples.T
 
         # Store likelihood values in a pandas Series
 
@@ -389,6 +876,15 @@ class _AnalysisResults(object):
         # Set the analysis type
         self._analysis_type = analysis_type
 
+    @property
+    def _samples_transposed(self):
+
+        if self._samples_transposed_cache is None:
+
+            self._samples_transposed_cache = self._lazy_samples.read().T
+
+        return self._samples_transposed_cache
+
     @property
     def samples(self):
         """
@@ -406,13 +902,19 @@ class _AnalysisResults(object):
 
     def write_to(self, filename, overwrite=False):
         """
-        Write results to a FITS file
+        Write results to a FITS file, or to a HDF5 file if the extension of the name is .h5, .hdf5 or .hdf
 
         :param filename:
         :param overwrite:
         :return: None
         """
 
+        if _is_hdf5_file_name(filename):
+
+            _write_hdf5_results([self], filename, overwrite=overwrite)
+
+            return
+
         fits_file = AnalysisResultsFITS(self)
 
         fits_file.writeto(sanitize_filename(filename), overwrite=overwrite)
@@ -426,7 +928,15 @@ class _AnalysisResults(object):
 
         this_value = self._values[param_index]
 
-        these_samples = self._samples_transposed[param_index]
+        if self._samples_transposed_cache is None:
+
+            # read only the samples of this parameter
+
+            these_samples = self._lazy_samples.read_parameter(param_index)
+
+        else:
+
+            these_samples = self._samples_transposed[param_index]
 
         this_variate = RandomVariates(these_samples, value=this_value)
 
@@ -528,30 +1038,10 @@ class _AnalysisResults(object):
         # NOTE: we compute this on-the-fly because it is of less frequent use, and contains essentially the same
         # information of the covariance matrix.
 
-        # Compute correlation matrix
-
-        correlation_matrix = np.zeros_like(covariance)
-
-        for i in range(self._n_free_parameters):
-
-            variance_i = covariance[i, i]
+        # Compute correlation matrix (nan where a variance is not positive, which should not happen, but it might
+        # because a fit failed or the numerical differentiation failed)
 
-            for j in range(self._n_free_parameters):
-
-                variance_j = covariance[j, j]
-
-                if variance_i * variance_j > 0:
-
-                    correlation_matrix[i, j] = covariance[i, j] / (math.sqrt(variance_i * variance_j))
-
-                else:
-
-                    # This should not happen, but it might because a fit failed or the numerical differentiation
-                    # failed
-
-                    correlation_matrix[i, j] = np.nan
-
-        return correlation_matrix
+        return correlation_matrix(covariance)
 
     def get_statistic_frame(self):
 
@@ -589,11 +1079,11 @@ class _AnalysisResults(object):
 
         if error_type == "equal tail":
 
-            errors_gatherer = RandomVariates.equal_tail_interval
+            errors_gatherer = equal_tail_intervals
 
         elif error_type == "hpd":
 
-            errors_gatherer = RandomVariates.highest_posterior_density_interval
+            errors_gatherer = highest_posterior_density_intervals
 
         elif error_type == "covariance":
 
@@ -612,23 +1102,25 @@ class _AnalysisResults(object):
         positive_errors = []
         units_dict = []
 
+        if error_type != "covariance":
+
+            # compute the intervals of all the parameters at once (the samples of each parameter are in a row)
+
+            low_bounds, hi_bounds = errors_gatherer(self._samples_transposed, cl)
+
         for i, this_par in enumerate(self._free_parameters.values()):
 
             parameter_paths.append(this_par.path)
 
-            this_phys_q = self.get_variates(parameter_paths[-1])
-
-            values.append(this_phys_q.value)
+            values.append(float(self._values[i]))
 
             units_dict.append(this_par.unit)
 
             if error_type != "covariance":
 
-                low_bound, hi_bound = errors_gatherer(this_phys_q, cl)
+                negative_errors.append(low_bounds[i] - values[-1])
 
-                negative_errors.append(low_bound - values[-1])
-
-                positive_errors.append(hi_bound - values[-1])
+                positive_errors.append(hi_bounds[i] - values[-1])
 
             else:
 
@@ -1538,7 +2030,9 @@ class AnalysisResultsSet(collections.Sequence):
 
     def write_to(self, filename, overwrite=False):
         """
-        Write this set of results to a FITS file.
+        Write this set of results to a FITS file, or to a HDF5 file if the extension of the name is .h5, .hdf5 or .hdf.
+        In the HDF5 file the parameters of all the results are stored in one table, which can be read quickly
+        with load_analysis_results_frame.
 
         :param filename: name for the output file
         :param overwrite: True or False
@@ -1553,6 +2047,13 @@ class AnalysisResultsSet(collections.Sequence):
 
             self.characterize_sequence("unspecified", frame_tuple)
 
+        if _is_hdf5_file_name(filename):
+
+            _write_hdf5_results(self, filename, overwrite=overwrite, sequence_name=self._sequence_name,
+                                sequence_tuple=self._sequence_tuple)
+
+            return
+
         fits = AnalysisResultsFITS(*self, sequence_tuple=self._sequence_tuple, sequence_name=self._sequence_name)
 
         fits.writeto(sanitize_filename(filename), overwrite=overwrite)
@@ -52,21 +52,31 @@ except:
 
 import numpy as np
 import collections
-import math
+import contextlib
+import multiprocessing
 import os
-import time
+import shutil
+import tempfile
 
 import matplotlib.pyplot as plt
 
 from threeML.parallel.parallel_client import ParallelClient
 from threeML.config.config import threeML_config
+from threeML.io.file_utils import sanitize_filename
 from threeML.io.progress_bar import progress_bar
 from threeML.exceptions.custom_exceptions import LikelihoodIsInfinite, custom_warnings
 from threeML.analysis_results import BayesianResults
-from threeML.utils.statistics.stats_tools import aic, bic, dic
+from threeML.bayesian.chain_backend import ChainBackend
+from threeML.bayesian.prior_set import PriorSet
+from threeML.utils.statistics.stats_tools import aic, bic, dic, effective_sample_size, split_r_hat
 
 from astromodels import ModelAssertionViolation, use_astromodels_memoization
 
+# In adaptive mode the sampling stops only when the chain is longer than this many autocorrelation times, as the
+# estimate of the autocorrelation time is not reliable for shorter chains
+
+_MIN_STEPS_PER_AUTOCORRELATION_TIME = 50
+
 
 def sample_with_progress(title, p0, sampler, n_samples, **kwargs):
     # Loop collecting n_samples samples
@@ -92,6 +102,182 @@ def sample_without_progress(p0, sampler, n_samples, title=None, **kwargs):
     return sampler.run_mcmc(p0, n_samples, **kwargs)
 
 
+def sample_to_backend(title, p0, sampler, n_samples, backend, burn_in=False, show_progress=True, **kwargs):
+    """
+    Advance the sampler and save each step to a chain backend. The sampler does not keep the chain in memory.
+
+    :param title: the title of the progress bar
+    :param p0: the starting positions of the walkers
+    :param sampler: an emcee.EnsembleSampler instance
+    :param n_samples: the number of steps
+    :param backend: a ChainBackend instance
+    :param burn_in: whether these are steps of the burn-in (which are not stored)
+    :param show_progress: whether to show a progress bar
+    :param kwargs: other keywords for sampler.sample (lnprob0, rstate0)
+    :return: the last positions, log probabilities and random state
+    """
+
+    pos, prob, state = p0, kwargs.get('lnprob0'), kwargs.get('rstate0')
+
+    steps = sampler.sample(p0, iterations=n_samples, storechain=False, **kwargs)
+
+    if show_progress:
+
+        with progress_bar(n_samples, title=title) as progress:
+
+            for i, result in enumerate(steps):
+
+                pos, prob, state = result[:3]
+
+                backend.save_step(pos, prob, state, burn_in=burn_in)
+
+                progress.animate((i + 1))
+
+    else:
+
+        for result in steps:
+
+            pos, prob, state = result[:3]
+
+            backend.save_step(pos, prob, state, burn_in=burn_in)
+
+    return pos, prob, state
+
+
+def _get_multinest_chain_name(chain_name=None, base_directory=None):
+    """
+    Get the base name of the MULTINEST output files. If no name is given, a new temporary directory is created
+    within base_directory, so that concurrent runs never write (or resume from) the same files. When running with
+    MPI the directory is created by the rank 0 and its name is sent to all the other ranks.
+
+    :param chain_name: the base name of the files (i.e., 'chains/fit-'), or None for a new unique name
+    :param base_directory: the directory where the unique directories are created (default: the system temporary
+    directory)
+    :return: the base name of the files
+    """
+
+    if not using_mpi or rank == 0:
+
+        if chain_name is None:
+
+            if base_directory is not None:
+
+                base_directory = sanitize_filename(base_directory)
+
+                try:
+
+                    os.makedirs(base_directory)
+
+                except OSError:
+
+                    # another run might have created it in the meantime
+
+                    if not os.path.isdir(base_directory):
+
+                        raise
+
+            chain_name = os.path.join(tempfile.mkdtemp(prefix='multinest-', dir=base_directory), 'fit-')
+
+        else:
+
+            chain_directory = os.path.dirname(chain_name)
+
+            if chain_directory != '' and not os.path.exists(chain_directory):
+
+                os.makedirs(chain_directory)
+
+    if using_mpi:
+
+        chain_name = comm.bcast(chain_name, root=0)
+
+    return chain_name
+
+
+class _BatchPosterior(object):
+
+    def __init__(self, analysis):
+        """
+        A replacement for the pool of emcee.EnsembleSampler which computes the posterior of all the walkers of a step
+        as one batch, so that the priors are evaluated once for all the walkers (see BayesianAnalysis._get_posteriors).
+        It can only be used with the posterior of the analysis.
+
+        :param analysis: the BayesianAnalysis instance
+        """
+
+        self._analysis = analysis
+
+    def map(self, function, positions):
+
+        return list(self._analysis._get_posteriors(np.array(list(positions))))
+
+
+# The analysis used by the processes of a local pool. It is set once when the process starts, so that
+# each evaluation of the posterior only needs to receive the parameter values
+
+_worker_analysis = None
+
+
+def _initialize_worker(analysis):
+
+    global _worker_analysis
+
+    _worker_analysis = analysis
+
+
+def _worker_get_posterior(trial_values):
+
+    return _worker_analysis.get_posterior(trial_values)
+
+
+def _worker_get_posteriors(batch):
+
+    return _worker_analysis._get_posteriors(batch)
+
+
+def _worker_log_like(trial_values):
+
+    return _worker_analysis._log_like(trial_values)
+
+
+def _worker_log_prior(trial_values):
+
+    return _worker_analysis._log_prior(trial_values)
+
+
+@contextlib.contextmanager
+def local_pool(analysis, n_processes):
+    """
+    A context manager giving a pool of processes which can compute the posterior of the analysis. The processes
+    receive the analysis (with the data and the model) only once, when they start.
+
+    :param analysis: the BayesianAnalysis instance
+    :param n_processes: the number of processes
+    :return: a multiprocessing.Pool instance
+    """
+
+    assert int(n_processes) > 0, "The number of processes must be positive"
+
+    pool = multiprocessing.Pool(int(n_processes), initializer=_initialize_worker, initargs=(analysis,))
+
+    try:
+
+        yield pool
+
+    except:
+
+        pool.terminate()
+
+        raise
+
+    else:
+
+        pool.close()
+
+    finally:
+
+        pool.join()
+
+
 class BayesianAnalysis(object):
     def __init__(self, likelihood_model, data_list, **kwargs):
         """
@@ -154,6 +340,8 @@ class BayesianAnalysis(object):
         self._raw_samples = None
         self._sampler = None
         self._log_like_values = None
+        self._convergence_diagnostics = None
+        self._importance_weights = None
         self._results = None
 
         # Get the initial list of free parameters, useful for debugging purposes
@@ -194,6 +382,19 @@ class BayesianAnalysis(object):
 
         return self._log_probability_values
 
+    @property
+    def convergence_diagnostics(self):
+        """
+        Returns the convergence diagnostics of the last run of the ensemble sampler (number of burn-in steps, maximum
+        autocorrelation time, minimum effective sample size and maximum split-R_hat over the parameters), which are
+        also stored in the statistical measures of the results. For an analysis obtained with importance_reweight,
+        the effective sample size of the importance weights. None for the other samplers.
+
+        :return: an ordered dictionary
+        """
+
+        return self._convergence_diagnostics
+
     @property
     def log_marginal_likelihood(self):
         """
@@ -203,7 +404,9 @@ class BayesianAnalysis(object):
 
         return self._marginal_likelihood
 
-    def sample(self, n_walkers, burn_in, n_samples, quiet=False, seed=None):
+    def sample(self, n_walkers, burn_in, n_samples, quiet=False, seed=None, n_processes=None,
+               chain_directory=None, resume=False, adaptive=False, target_ess=1000, max_r_hat=1.05,
+               check_interval=100):
         """
         Sample the posterior with the Goodman & Weare's Affine Invariant Markov chain Monte Carlo
         :param n_walkers:
@@ -211,6 +414,19 @@ class BayesianAnalysis(object):
         :param n_samples:
         :param quiet: if False, do not print results
         :param seed: if provided, it is used to seed the random numbers generator before the MCMC
+        :param n_processes: if provided, the posterior is computed by a pool of this many local processes
+        (instead of the parallel client, if parallel computation is active)
+        :param chain_directory: if provided, the chain is written to this directory while sampling (see ChainBackend)
+        instead of being kept in memory, and the samples are read lazily from disk
+        :param resume: if True, continue the chain in chain_directory from the last saved state of the walkers
+        (the other parameters must be the same as in the interrupted run)
+        :param adaptive: if True, burn_in and n_samples are the maximum number of steps. The burn-in stops when the
+        split-R_hat of its second half is below max_r_hat for all parameters, and the sampling stops when the effective
+        sample size of all parameters reaches target_ess (and the chain is long enough to trust the estimate of the
+        autocorrelation time)
+        :param target_ess: (adaptive mode) the effective sample size to reach
+        :param max_r_hat: (adaptive mode) the threshold on split-R_hat to end the burn-in
+        :param check_interval: (adaptive mode) the number of steps between two checks of the convergence
 
         :return: MCMC samples
 
@@ -226,63 +442,125 @@ class BayesianAnalysis(object):
 
         sampling_procedure = sample_with_progress
 
+        backend = None
+
+        if chain_directory is not None:
+
+            backend = ChainBackend(chain_directory)
+
+            if resume and backend.exists:
+
+                backend.open(n_walkers, n_dim, burn_in, n_samples)
+
+            else:
+
+                backend.initialize(n_walkers, n_dim, burn_in, n_samples)
+
+        else:
+
+            assert not resume, "You need to provide the chain_directory of the chain to resume"
+
+        assert not (adaptive and backend is not None), "The adaptive mode cannot be used with a chain_directory"
+
+        if adaptive:
+
+            adaptive_options = {'target_ess': target_ess, 'max_r_hat': max_r_hat, 'check_interval': check_interval}
+
+        else:
+
+            adaptive_options = None
+
         # Deactivate memoization in astromodels, which is useless in this case since we will never use twice the
         # same set of parameters
         with use_astromodels_memoization(False):
 
-            if threeML_config['parallel']['use-parallel']:
+            if n_processes is not None:
+
+                # the local processes are started here, so that they inherit the current state of the analysis
 
-                c = ParallelClient()
-                view = c[:]
+                with local_pool(self, n_processes) as pool:
 
-                sampler = emcee.EnsembleSampler(n_walkers, n_dim,
-                                                self.get_posterior,
-                                                pool=view)
+                    sampler = emcee.EnsembleSampler(n_walkers, n_dim,
+                                                    _worker_get_posterior,
+                                                    pool=pool)
 
-                # Sampling with progress in parallel is super-slow, so let's
-                # use the non-interactive one
-                sampling_procedure = sample_without_progress
+                    n_burn_in = self._run_sampler(sampler, sampling_procedure, p0, burn_in, n_samples, seed,
+                                                  backend, adaptive_options)
 
             else:
 
-                sampler = emcee.EnsembleSampler(n_walkers, n_dim,
-                                                self.get_posterior)
+                if threeML_config['parallel']['use-parallel']:
 
-            # If a seed is provided, set the random number seed
-            if seed is not None:
+                    c = ParallelClient()
+                    view = c[:]
 
-                sampler._random.seed(seed)
+                    sampler = emcee.EnsembleSampler(n_walkers, n_dim,
+                                                    self.get_posterior,
+                                                    pool=view)
 
-            # Sample the burn-in
-            pos, prob, state = sampling_procedure(title="Burn-in", p0=p0, sampler=sampler, n_samples=burn_in)
+                    # Sampling with progress in parallel is super-slow, so let's
+                    # use the non-interactive one
+                    sampling_procedure = sample_without_progress
 
-            # Reset sampler
+                else:
 
-            sampler.reset()
+                    sampler = emcee.EnsembleSampler(n_walkers, n_dim,
+                                                    self.get_posterior,
+                                                    pool=_BatchPosterior(self))
+
+                n_burn_in = self._run_sampler(sampler, sampling_procedure, p0, burn_in, n_samples, seed, backend,
+                                              adaptive_options)
+
+        # the pool cannot be pickled together with the sampler
 
-            # Run the true sampling
+        sampler.pool = None
 
-            _ = sampling_procedure(title="Sampling", p0=pos, sampler=sampler, n_samples=n_samples, rstate0=state)
+        # (when resuming a complete chain the sampler did not make any step)
 
-        acc = np.mean(sampler.acceptance_fraction)
+        if sampler.iterations > 0:
 
-        print("\nMean acceptance fraction: %s\n" % acc)
+            acc = np.mean(sampler.acceptance_fraction)
+
+            print("\nMean acceptance fraction: %s\n" % acc)
 
         self._sampler = sampler
-        self._raw_samples = sampler.flatchain
+
+        if backend is not None:
+
+            # memory maps of the files in the chain directory
+
+            self._raw_samples = backend.flatchain
+
+            log_probability = backend.flatlnprobability
+
+            chain = backend.chain
+
+        else:
+
+            self._raw_samples = sampler.flatchain
+
+            log_probability = sampler.flatlnprobability
+
+            chain = sampler.chain
+
+        self._convergence_diagnostics = self._get_convergence_diagnostics(chain, n_burn_in)
+
+        if adaptive:
+
+            print("\nBurn-in steps: %i, sampling steps: %i\n" % (n_burn_in, chain.shape[1]))
 
         # Compute the corresponding values of the likelihood
 
         # First we need the prior
-        log_prior = map(lambda x: self._log_prior(x), self._raw_samples)
+        log_prior = self._prior_set.log_prior(self._raw_samples)
 
         # Now we get the log posterior and we remove the log prior
 
-        self._log_like_values = sampler.flatlnprobability - log_prior
+        self._log_like_values = log_probability - log_prior
 
         # we also want to store the log probability
 
-        self._log_probability_values = sampler.flatlnprobability
+        self._log_probability_values = log_probability
 
         self._marginal_likelihood = None
 
@@ -296,7 +574,7 @@ class BayesianAnalysis(object):
 
         return self.samples
 
-    def sample_parallel_tempering(self, n_temps, n_walkers, burn_in, n_samples, quiet=False):
+    def sample_parallel_tempering(self, n_temps, n_walkers, burn_in, n_samples, quiet=False, n_processes=None):
         """
         Sample with parallel tempering
 
@@ -304,8 +582,9 @@ class BayesianAnalysis(object):
         :param: n_walkers
         :param: burn_in
         :param: n_samples
+        :param n_processes: if provided, the posterior is computed by a pool of this many local processes
 
-        :return: MCMC samples
+        :return: MCMC samples (of the chain at temperature 1)
 
         """
 
@@ -313,8 +592,6 @@ class BayesianAnalysis(object):
 
         n_dim = len(free_parameters.keys())
 
-        sampler = emcee.PTSampler(n_temps, n_walkers, n_dim, self._log_like, self._log_prior)
-
         # Get one starting point for each temperature
 
         p0 = np.empty((n_temps, n_walkers, n_dim))
@@ -322,31 +599,43 @@ class BayesianAnalysis(object):
         for i in range(n_temps):
             p0[i, :, :] = self._get_starting_points(n_walkers)
 
-        print("Running burn-in of %s samples...\n" % burn_in)
+        if n_processes is not None:
 
-        p, lnprob, lnlike = sample_with_progress("Burn-in", p0, sampler, burn_in)
+            with local_pool(self, n_processes) as pool:
 
-        # Reset sampler
+                sampler = emcee.PTSampler(n_temps, n_walkers, n_dim, _worker_log_like, _worker_log_prior, pool=pool)
 
-        sampler.reset()
+                self._run_parallel_tempering(sampler, p0, burn_in, n_samples)
 
-        print("\nSampling\n")
+            # the pool cannot be pickled together with the sampler
 
-        _ = sample_with_progress("Sampling", p, sampler, n_samples,
-                                 lnprob0=lnprob, lnlike0=lnlike)
+            sampler.pool = None
+
+        else:
+
+            sampler = emcee.PTSampler(n_temps, n_walkers, n_dim, self._log_like, self._log_prior)
+
+            self._run_parallel_tempering(sampler, p0, burn_in, n_samples)
 
         self._sampler = sampler
 
         # Now build the _samples dictionary
 
-        self._raw_samples = sampler.flatchain.reshape(-1, sampler.flatchain.shape[-1])
+        # only the chain at temperature 1 (beta = 1) samples the posterior. The log probabilities of the other
+        # chains are tempered, and they are not kept either
 
-        self._log_probability_values = None
+        self._raw_samples = sampler.flatchain[0]
 
-        self._log_like_values = None
+        # the log probabilities and the log likelihoods are ordered as the samples (walker, step)
+
+        self._log_probability_values = sampler.lnprobability[0].reshape(-1)
+
+        self._log_like_values = sampler.lnlikelihood[0].reshape(-1)
 
         self._marginal_likelihood = None
 
+        self._convergence_diagnostics = None
+
         self._build_samples_dictionary()
 
         self._build_results()
@@ -357,12 +646,225 @@ class BayesianAnalysis(object):
 
         return self.samples
 
-    def sample_multinest(self, n_live_points, chain_name="chains/fit-", quiet=False, **kwargs):
+    @staticmethod
+    def _run_sampler(sampler, sampling_procedure, p0, burn_in, n_samples, seed=None, backend=None,
+                     adaptive_options=None):
+        """
+        Run the burn-in and the sampling
+
+        :return: the number of burn-in steps
+        """
+
+        if adaptive_options is not None:
+
+            return BayesianAnalysis._run_adaptive_sampler(sampler, sampling_procedure, p0, burn_in, n_samples, seed,
+                                                          **adaptive_options)
+
+        if backend is not None:
+
+            # Sampling in parallel with the progress bar is slow (see sample)
+
+            show_progress = sampling_procedure is sample_with_progress
+
+            BayesianAnalysis._run_sampler_with_backend(sampler, backend, p0, burn_in, n_samples, seed, show_progress)
+
+            return burn_in
+
+        # If a seed is provided, set the random number seed
+        if seed is not None:
+
+            sampler._random.seed(seed)
+
+        # Sample the burn-in
+        pos, prob, state = sampling_procedure(title="Burn-in", p0=p0, sampler=sampler, n_samples=burn_in)
+
+        # Reset sampler
+
+        sampler.reset()
+
+        # Run the true sampling
+
+        _ = sampling_procedure(title="Sampling", p0=pos, sampler=sampler, n_samples=n_samples, rstate0=state)
+
+        return burn_in
+
+    @staticmethod
+    def _run_adaptive_sampler(sampler, sampling_procedure, p0, max_burn_in, max_n_samples, seed,
+                              target_ess, max_r_hat, check_interval):
+        """
+        Run the burn-in and the sampling in blocks of check_interval steps, checking the convergence after each block
+
+        :return: the number of burn-in steps
+        """
+
+        assert check_interval > 0, "The check interval must be positive"
+
+        # If a seed is provided, set the random number seed
+        if seed is not None:
+
+            sampler._random.seed(seed)
+
+        pos, prob, state = p0, None, None
+
+        # Burn-in, until the second half of the burn-in chain is stationary
+
+        n_burn_in = 0
+
+        while n_burn_in < max_burn_in:
+
+            n_steps = min(check_interval, max_burn_in - n_burn_in)
+
+            pos, prob, state = sampling_procedure(title="Burn-in", p0=pos, sampler=sampler, n_samples=n_steps,
+                                                  lnprob0=prob, rstate0=state)
+
+            n_burn_in += n_steps
+
+            if n_burn_in >= 8 and np.max(split_r_hat(sampler.chain[:, n_burn_in // 2:, :])) < max_r_hat:
+
+                break
+
+        # Reset sampler
+
+        sampler.reset()
+
+        # Sampling, until the effective sample size is reached
+
+        n_sampled = 0
+
+        while n_sampled < max_n_samples:
+
+            n_steps = min(check_interval, max_n_samples - n_sampled)
+
+            pos, prob, state = sampling_procedure(title="Sampling", p0=pos, sampler=sampler, n_samples=n_steps,
+                                                  lnprob0=prob, rstate0=state)
+
+            n_sampled += n_steps
+
+            # a chain longer than N autocorrelation times has an effective sample size of at least N per walker
+
+            n_walkers = sampler.chain.shape[0]
+
+            min_effective_sample_size = np.min(effective_sample_size(sampler.chain))
+
+            if min_effective_sample_size >= max(target_ess, _MIN_STEPS_PER_AUTOCORRELATION_TIME * n_walkers):
+
+                break
+
+        return n_burn_in
+
+    @staticmethod
+    def _get_convergence_diagnostics(chain, n_burn_in):
+        """
+        Compute the convergence diagnostics of the chain of an ensemble sampler. The parameters are processed one
+        at a time, so that a chain stored on disk is never loaded in memory all at once. The parameters for which a
+        diagnostic is not defined (for example a parameter which never changed) are ignored for that diagnostic
+
+        :param chain: (n_walkers, n_steps, n_dim) array of samples (or a memory map)
+        :param n_burn_in: the number of burn-in steps
+        :return: an ordered dictionary with the diagnostics
+        """
+
+        diagnostics = collections.OrderedDict()
+
+        diagnostics['burn-in steps'] = n_burn_in
+
+        n_walkers, n_steps, n_dim = chain.shape
+
+        if n_steps >= 4:
+
+            effective_sample_sizes = np.zeros(n_dim)
+            r_hats = np.zeros(n_dim)
+
+            for i in range(n_dim):
+
+                parameter_chain = np.array(chain[:, :, i:i + 1], dtype=float)
+
+                effective_sample_sizes[i] = effective_sample_size(parameter_chain)[0]
+                r_hats[i] = split_r_hat(parameter_chain)[0]
+
+            defined = np.isfinite(effective_sample_sizes) & (effective_sample_sizes > 0)
+
+            if np.any(defined):
+
+                min_effective_sample_size = np.min(effective_sample_sizes[defined])
+
+                diagnostics['autocorr. time (max)'] = n_walkers * n_steps / min_effective_sample_size
+                diagnostics['ESS (min)'] = min_effective_sample_size
+
+            defined = np.isfinite(r_hats)
+
+            if np.any(defined):
+
+                diagnostics['split R_hat (max)'] = np.max(r_hats[defined])
+
+        return diagnostics
+
+    @staticmethod
+    def _run_sampler_with_backend(sampler, backend, p0, burn_in, n_samples, seed=None, show_progress=True):
+
+        # Start from the last saved state of the walkers, if any
+
+        if backend.position is not None:
+
+            p0 = backend.position
+
+        lnprob0 = backend.lnprob
+        state = backend.random_state
+
+        # a resumed chain continues with the saved state of the random number generator
+
+        if state is None and seed is not None:
+
+            sampler._random.seed(seed)
+
+        # Complete the burn-in
+
+        if backend.n_burn_in_done < burn_in:
+
+            p0, lnprob0, state = sample_to_backend("Burn-in", p0, sampler, burn_in - backend.n_burn_in_done,
+                                                   backend, burn_in=True, show_progress=show_progress,
+                                                   lnprob0=lnprob0, rstate0=state)
+
+            # Reset sampler (only the counters, as the chain is not stored by the sampler)
+
+            sampler.reset()
+
+        # Complete the sampling
+
+        if backend.n_samples_done < n_samples:
+
+            _ = sample_to_backend("Sampling", p0, sampler, n_samples - backend.n_samples_done, backend,
+                                  show_progress=show_progress, lnprob0=lnprob0, rstate0=state)
+
+    @staticmethod
+    def _run_parallel_tempering(sampler, p0, burn_in, n_samples):
+
+        print("Running burn-in of %s samples...\n" % burn_in)
+
+        p, lnprob, lnlike = sample_with_progress("Burn-in", p0, sampler, burn_in)
+
+        # Reset sampler
+
+        sampler.reset()
+
+        print("\nSampling\n")
+
+        _ = sample_with_progress("Sampling", p, sampler, n_samples,
+                                 lnprob0=lnprob, lnlike0=lnlike)
+
+    def sample_multinest(self, n_live_points, chain_name=None, quiet=False, **kwargs):
         """
         Sample the posterior with MULTINEST nested sampling (Feroz & Hobson)
 
+        To use more than one process, run the script with MPI (i.e., mpirun -np 4 python my_script.py). All the
+        processes share the computation of the likelihood, but only the rank 0 reads the output of MULTINEST and
+        builds the results: this method returns None on the other ranks.
+
         :param: n_live_points: number of MULTINEST livepoints
-        :param: chain_names: where to stor the multinest incremental output
+        :param: chain_name: base name of the multinest incremental output (i.e., 'chains/fit-'). If None, the output
+        goes to a new temporary directory for each run, so that concurrent runs do not clash, and the directory is
+        removed once the results have been read. Note that with a given chain_name MULTINEST resumes from existing
+        output files (which are kept), unless resume=False is passed
         :param: quiet: Whether or not to should results
         :param: **kwargs (pyMULTINEST kwords)
 
@@ -385,22 +887,17 @@ class BayesianAnalysis(object):
         # sampling so we construct callbakcs
         loglike, multinest_prior = self._construct_multinest_posterior()
 
-        # We need to check if the MCMC
-        # chains will have a place on
-        # the disk to write and if not,
-        # create one
+        # Get a place on the disk for the MULTINEST output (the same for all the MPI ranks). A temporary directory
+        # is removed at the end
 
-        mcmc_chains_out_dir = ""
-        tmp = chain_name.split('/')
-        for s in tmp[:-1]:
-            mcmc_chains_out_dir += s + '/'
+        remove_chain_directory = chain_name is None
 
-        if not os.path.exists(mcmc_chains_out_dir):
-            os.makedirs(mcmc_chains_out_dir)
+        chain_name = _get_multinest_chain_name(chain_name)
 
         print("\nSampling\n")
         print("MULTINEST has its own convergence criteria... you will have to wait blindly for it to finish")
         print("If INS is enabled, one can monitor the likelihood in the terminal for completion information")
+        print("Output files: %s*" % chain_name)
 
         # Multinest must be run parallel via an external method
         # see the demo in the examples folder!!
@@ -421,52 +918,48 @@ class BayesianAnalysis(object):
 
         # Use PyMULTINEST analyzer to gather parameter info
 
-        process_fit = False
-
         if using_mpi:
 
-            # if we are running in parallel and this is not the
-            # first engine, then we want to wait and let everything finish
+            # wait for all the ranks to finish, so that the output files are complete.
+            # Only the first rank reads them
 
-            if rank !=0:
+            comm.Barrier()
 
-                # let these guys take a break
-                time.sleep(5)
+            process_fit = rank == 0
 
-                # these engines do not need to read
-                process_fit = False
+        else:
 
-            else:
+            process_fit = True
 
-                # wait for a moment to allow it all to turn off
-                time.sleep(5)
+        if process_fit:
 
-                process_fit = True
+            try:
 
-        else:
+                multinest_analyzer = pymultinest.analyse.Analyzer(n_params=n_dim,
+                                                                  outputfiles_basename=chain_name)
 
-            process_fit = True
+                # Get the log. likelihood values from the chain
+                self._log_like_values = multinest_analyzer.get_equal_weighted_posterior()[:, -1]
 
+                self._sampler = sampler
 
-        if process_fit:
+                self._raw_samples = multinest_analyzer.get_equal_weighted_posterior()[:, :-1]
 
-            multinest_analyzer = pymultinest.analyse.Analyzer(n_params=n_dim,
-                                                              outputfiles_basename=chain_name)
+                self._marginal_likelihood = multinest_analyzer.get_stats()['global evidence'] / np.log(10.)
 
-            # Get the log. likelihood values from the chain
-            self._log_like_values = multinest_analyzer.get_equal_weighted_posterior()[:, -1]
+            finally:
 
-            self._sampler = sampler
+                if remove_chain_directory:
 
-            self._raw_samples = multinest_analyzer.get_equal_weighted_posterior()[:, :-1]
+                    shutil.rmtree(os.path.dirname(chain_name), ignore_errors=True)
 
             # now get the log probability
 
-            self._log_probability_values = self._log_like_values +  np.array([self._log_prior(samples) for samples in self._raw_samples])
+            self._log_probability_values = self._log_like_values + self._prior_set.log_prior(self._raw_samples)
 
             self._build_samples_dictionary()
 
-            self._marginal_likelihood = multinest_analyzer.get_stats()['global evidence'] / np.log(10.)
+            self._convergence_diagnostics = None
 
             self._build_results()
 
@@ -480,6 +973,177 @@ class BayesianAnalysis(object):
 
             return self.samples
 
+    def importance_reweight(self, data_list=None, n_processes=None, batch_size=1000, min_ess_fraction=0.1,
+                            seed=None):
+        """
+        Obtain the posterior of a modified analysis from the samples of this one, without sampling again. This works
+        when the modified posterior is not too different from this one, for example after changing the prior of
+        some parameters (modify the priors in the likelihood model before calling this method), adding a dataset with
+        little constraining power, or replacing a plugin with a different noise model.
+
+        The modified posterior is computed on the existing samples, which receive importance weights proportional to
+        the ratio between the modified and the original posterior. The samples are then resampled according to the
+        weights. If the effective sample size of the weights is below min_ess_fraction times the number of samples,
+        the posteriors are too different and a warning is issued: in that case it is better to sample again.
+
+        :param data_list: the datasets of the modified analysis (default: the same datasets). The modified analysis
+        must have the same free parameters as this one
+        :param n_processes: if provided, the posterior is computed by a pool of this many local processes (instead of
+        the parallel client, if parallel computation is active)
+        :param batch_size: the number of samples sent at once to each process
+        :param min_ess_fraction: the minimum acceptable fraction of effective samples
+        :param seed: if provided, it is used to seed the random numbers generator used for the resampling
+        :return: a new BayesianAnalysis instance with the resampled samples and their results. The importance weights
+        of the original samples are in its importance_weights property
+        """
+
+        assert self._raw_samples is not None, "You have to sample the posterior before reweighting it"
+
+        assert self._log_probability_values is not None, "The log posterior of the samples is not available"
+
+        if data_list is None:
+
+            data_list = self._data_list
+
+        new_analysis = BayesianAnalysis(self._likelihood_model, data_list, verbose=self.verbose)
+
+        if new_analysis._free_parameters.keys() != self._free_parameters.keys():
+
+            raise RuntimeError("The modified analysis must have the same free parameters as the original one")
+
+        # Compute the modified posterior on all the samples
+
+        samples = np.asarray(self._raw_samples)
+
+        log_posterior = new_analysis._get_posteriors_on_samples(samples, n_processes, batch_size)
+
+        log_weights = log_posterior - np.asarray(self._log_probability_values)
+
+        # samples outside of the support of the modified posterior have zero weight
+
+        log_weights[~np.isfinite(log_weights)] = -np.inf
+
+        if not np.any(np.isfinite(log_weights)):
+
+            raise RuntimeError("None of the samples is within the support of the modified posterior")
+
+        weights = np.exp(log_weights - np.max(log_weights))
+
+        weights /= np.sum(weights)
+
+        # Kish's effective sample size
+
+        n_samples = samples.shape[0]
+
+        effective_sample_size = 1.0 / np.sum(weights ** 2)
+
+        if effective_sample_size < min_ess_fraction * n_samples:
+
+            custom_warnings.warn("The effective sample size of the importance weights is %.1f out of %i samples. "
+                                 "The modified posterior is too different from the original one, you should sample "
+                                 "it again." % (effective_sample_size, n_samples))
+
+        # Resample according to the weights
+
+        idx = np.random.RandomState(seed).choice(n_samples, size=n_samples, replace=True, p=weights)
+
+        new_analysis._raw_samples = samples[idx]
+
+        new_analysis._log_probability_values = log_posterior[idx]
+
+        log_prior = new_analysis._prior_set.log_prior(new_analysis._raw_samples)
+
+        new_analysis._log_like_values = new_analysis._log_probability_values - log_prior
+
+        new_analysis._marginal_likelihood = None
+
+        new_analysis._importance_weights = weights
+
+        new_analysis._convergence_diagnostics = collections.OrderedDict()
+
+        new_analysis._convergence_diagnostics['importance ESS'] = effective_sample_size
+
+        new_analysis._build_samples_dictionary()
+
+        new_analysis._build_results()
+
+        return new_analysis
+
+    @property
+    def importance_weights(self):
+        """
+        For an analysis obtained with importance_reweight, the normalized importance weights of the samples of the
+        original analysis. None otherwise.
+
+        :return: a vector of weights
+        """
+
+        return self._importance_weights
+
+    def _get_posteriors_on_samples(self, samples, n_processes=None, batch_size=1000):
+        """
+        Compute the log posterior on many samples, in batches. The batches are distributed among the processes of a
+        local pool, or the engines of the parallel client if parallel computation is active.
+
+        :param samples: (n_samples, n_dim) array
+        :param n_processes: if provided, the number of local processes
+        :param batch_size: the number of samples in each batch
+        :return: a vector of log posterior values
+        """
+
+        assert batch_size > 0, "The batch size must be positive"
+
+        batches = [samples[i: i + batch_size] for i in range(0, samples.shape[0], batch_size)]
+
+        # Deactivate memoization in astromodels, which is useless in this case since we will never use twice the
+        # same set of parameters
+        with use_astromodels_memoization(False):
+
+            if n_processes is not None:
+
+                with local_pool(self, n_processes) as pool:
+
+                    results = pool.map(_worker_get_posteriors, batches)
+
+            elif threeML_config['parallel']['use-parallel']:
+
+                client = ParallelClient()
+
+                results = client.execute_with_progress_bar(self._get_posteriors, batches)
+
+            else:
+
+                results = []
+
+                with progress_bar(len(batches), title='Computing the posterior') as p:
+
+                    for batch in batches:
+
+                        results.append(self._get_posteriors(batch))
+
+                        p.increase()
+
+        return np.concatenate(results)
+
+    def _get_posteriors(self, batch):
+        """
+        Compute the log posterior on a batch of parameter vectors. The priors are evaluated once for the whole batch,
+        then the likelihood is computed for the vectors within the support of the priors.
+
+        :param batch: (n_vectors, n_parameters) array
+        :return: a vector of log posterior values
+        """
+
+        log_posterior = self._prior_set.log_prior(batch)
+
+        for i in np.flatnonzero(np.isfinite(log_posterior)):
+
+            self._prior_set.set_values(batch[i])
+
+            log_posterior[i] += self._log_like(batch[i])
+
+        return log_posterior
+
     def _build_samples_dictionary(self):
         """
         Build the dictionary to access easily the samples by parameter
@@ -551,6 +1215,10 @@ class BayesianAnalysis(object):
 
             statistical_measures['log(Z)'] = self._marginal_likelihood
 
+        if self._convergence_diagnostics is not None:
+
+            statistical_measures.update(self._convergence_diagnostics)
+
 
         #TODO: add WAIC
 
@@ -649,6 +1317,8 @@ class BayesianAnalysis(object):
 
         self._free_parameters = self._likelihood_model.free_parameters
 
+        self._prior_set = PriorSet(self._free_parameters)
+
     def get_posterior(self, trial_values):
         """Compute the posterior for the normal sampler"""
 
@@ -657,27 +1327,14 @@ class BayesianAnalysis(object):
 
         # self._update_free_parameters()
 
-        assert len(self._free_parameters) == len(trial_values), ("Something is wrong. Number of free parameters "
-                                                                 "do not match the number of trial values.")
-
-        log_prior = 0
-
-        # with use_
-
-        for i, (parameter_name, parameter) in enumerate(self._free_parameters.iteritems()):
-
-            prior_value = parameter.prior(trial_values[i])
-
-            if prior_value == 0:
-                # Outside allowed region of parameter space
+        log_prior = self._prior_set.log_prior(trial_values)
 
-                return -np.inf
+        if not np.isfinite(log_prior):
+            # Outside allowed region of parameter space
 
-            else:
-
-                parameter.value = trial_values[i]
+            return -np.inf
 
-                log_prior += math.log10(prior_value)
+        self._prior_set.set_values(trial_values)
 
         log_like = self._log_like(trial_values)
 
@@ -700,8 +1357,7 @@ class BayesianAnalysis(object):
 
             # NOTE: the _log_like function DOES NOT assign trial_values to the parameters
 
-            for i, parameter in enumerate(self._free_parameters.values()):
-                parameter.value = trial_values[i]
+            self._prior_set.set_values([trial_values[i] for i in range(ndim)])
 
             log_like = self._log_like(trial_values)
 
@@ -721,16 +1377,13 @@ class BayesianAnalysis(object):
 
         def prior(params, ndim, nparams):
 
-            for i, (parameter_name, parameter) in enumerate(self._free_parameters.iteritems()):
+            # params must be modified in place
 
-                try:
-
-                    params[i] = parameter.prior.from_unit_cube(params[i])
+            values = self._prior_set.from_unit_cube([params[i] for i in range(ndim)])
 
-                except AttributeError:
+            for i in range(ndim):
 
-                    raise RuntimeError("The prior you are trying to use for parameter %s is "
-                                       "not compatible with multinest" % parameter_name)
+                params[i] = values[i]
 
         # Give a test run to the prior to check that it is working. If it crashes while multinest is going
         # it will not stop multinest from running and generate thousands of exceptions (argh!)
@@ -762,22 +1415,16 @@ class BayesianAnalysis(object):
 
         # Compute the sum of the log-priors
 
-        log_prior = 0
+        log_prior = self._prior_set.log_prior(trial_values)
 
-        for i, (parameter_name, parameter) in enumerate(self._free_parameters.iteritems()):
+        if not np.isfinite(log_prior):
+            # Outside allowed region of parameter space
 
-            prior_value = parameter.prior(trial_values[i])
-
-            if prior_value == 0:
-                # Outside allowed region of parameter space
-
-                return -np.inf
-
-            else:
+            return -np.inf
 
-                parameter.value = trial_values[i]
+        # the log-likelihood is computed next with these values
 
-                log_prior += math.log10(prior_value)
+        self._prior_set.set_values(trial_values)
 
         return log_prior
 
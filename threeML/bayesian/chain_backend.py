@@ -0,0 +1,293 @@
+import os
+
+import numpy as np
+
+from threeML.io.file_utils import if_directory_not_existing_then_make, sanitize_filename
+
+
+class ChainBackend(object):
+
+    def __init__(self, directory):
+        """
+        An on-disk store for the chain of an emcee ensemble sampler. The samples and the log probabilities are
+        written to memory-mapped .npy files as the sampler advances, and the state of the walkers (positions,
+        log probabilities and state of the random number generator) is saved after each step, so that an
+        interrupted run can be resumed. The samples are read back lazily through memory maps.
+
+        The directory contains:
+
+        chain.npy: (n_walkers, n_samples, n_dim) array of samples
+        lnprob.npy: (n_walkers, n_samples) array of log probabilities
+        state.npz: the state of the walkers and the number of steps completed
+
+        :param directory: the directory where the chain is stored
+        """
+
+        self._directory = sanitize_filename(directory, abspath=True)
+
+        self._chain = None
+        self._lnprob = None
+        self._state = None
+
+    @property
+    def directory(self):
+
+        return self._directory
+
+    @property
+    def _chain_file(self):
+
+        return os.path.join(self._directory, 'chain.npy')
+
+    @property
+    def _lnprob_file(self):
+
+        return os.path.join(self._directory, 'lnprob.npy')
+
+    @property
+    def _state_file(self):
+
+        return os.path.join(self._directory, 'state.npz')
+
+    @property
+    def exists(self):
+        """
+        :return: True if the directory contains a chain which can be resumed
+        """
+
+        return os.path.exists(self._state_file)
+
+    def initialize(self, n_walkers, n_dim, burn_in, n_samples):
+        """
+        Create a new (empty) chain, overwriting any chain already in the directory
+
+        :param n_walkers: number of walkers
+        :param n_dim: number of free parameters
+        :param burn_in: number of burn-in steps (which are not stored)
+        :param n_samples: number of steps stored
+        :return: none
+        """
+
+        if_directory_not_existing_then_make(self._directory)
+
+        self._chain = np.lib.format.open_memmap(self._chain_file, mode='w+', dtype=float,
+                                                shape=(n_walkers, n_samples, n_dim))
+
+        self._lnprob = np.lib.format.open_memmap(self._lnprob_file, mode='w+', dtype=float,
+                                                 shape=(n_walkers, n_samples))
+
+        self._state = {'n_walkers': n_walkers,
+                       'n_dim': n_dim,
+                       'burn_in': burn_in,
+                       'n_samples': n_samples,
+                       'n_burn_in_done': 0,
+                       'n_samples_done': 0,
+                       'position': None,
+                       'lnprob': None,
+                       'random_state': None}
+
+        self._write_state()
+
+    def open(self, n_walkers, n_dim, burn_in, n_samples):
+        """
+        Open an existing chain to resume it. The chain must have been created with the same settings.
+
+        :param n_walkers: number of walkers
+        :param n_dim: number of free parameters
+        :param burn_in: number of burn-in steps
+        :param n_samples: number of steps stored
+        :return: none
+        """
+
+        self._state = self._read_state()
+
+        requested = {'n_walkers': n_walkers, 'n_dim': n_dim, 'burn_in': burn_in, 'n_samples': n_samples}
+
+        for key, value in requested.items():
+
+            if self._state[key] != value:
+
+                raise RuntimeError("Cannot resume the chain in %s: it was created with %s = %s, not %s"
+                                   % (self._directory, key, self._state[key], value))
+
+        self._chain = np.load(self._chain_file, mmap_mode='r+')
+        self._lnprob = np.load(self._lnprob_file, mmap_mode='r+')
+
+    @property
+    def n_burn_in_done(self):
+
+        return self._state['n_burn_in_done']
+
+    @property
+    def n_samples_done(self):
+
+        return self._state['n_samples_done']
+
+    @property
+    def position(self):
+        """
+        :return: the last positions of the walkers (None if no step has been done yet)
+        """
+
+        return self._state['position']
+
+    @property
+    def lnprob(self):
+        """
+        :return: the last log probabilities of the walkers (None if no step has been done yet)
+        """
+
+        return self._state['lnprob']
+
+    @property
+    def random_state(self):
+        """
+        :return: the last state of the random number generator of the sampler (None if no step has been done yet)
+        """
+
+        return self._state['random_state']
+
+    def save_step(self, position, lnprob, random_state, burn_in=False):
+        """
+        Save one step of the sampler. The samples of the burn-in are not stored, only the state of the walkers.
+
+        :param position: (n_walkers, n_dim) array of positions
+        :param lnprob: (n_walkers,) array of log probabilities
+        :param random_state: the state of the random number generator (as returned by np.random.RandomState.get_state)
+        :param burn_in: whether this is a step of the burn-in
+        :return: none
+        """
+
+        if burn_in:
+
+            self._state['n_burn_in_done'] += 1
+
+        else:
+
+            i = self._state['n_samples_done']
+
+            self._chain[:, i, :] = position
+            self._lnprob[:, i] = lnprob
+
+            # the samples must be on disk before the state refers to them
+
+            self._chain.flush()
+            self._lnprob.flush()
+
+            self._state['n_samples_done'] += 1
+
+        self._state['position'] = np.array(position, dtype=float)
+        self._state['lnprob'] = np.array(lnprob, dtype=float)
+        self._state['random_state'] = random_state
+
+        self._write_state()
+
+    @property
+    def chain(self):
+        """
+        :return: (n_walkers, n_samples_done, n_dim) array of samples, read lazily from disk
+        """
+
+        chain = np.load(self._chain_file, mmap_mode='r')
+
+        return chain[:, :self.n_samples_done, :]
+
+    @property
+    def lnprobability(self):
+        """
+        :return: (n_walkers, n_samples_done) array of log probabilities, read lazily from disk
+        """
+
+        lnprob = np.load(self._lnprob_file, mmap_mode='r')
+
+        return lnprob[:, :self.n_samples_done]
+
+    @property
+    def flatchain(self):
+        """
+        :return: the samples of all the walkers one after the other, as emcee's flatchain. If the chain is
+        complete this is a memory map of the file, otherwise the completed samples are copied in memory
+        """
+
+        chain = self.chain
+
+        return chain.reshape(-1, chain.shape[-1])
+
+    @property
+    def flatlnprobability(self):
+        """
+        :return: the log probabilities ordered as the flatchain
+        """
+
+        return self.lnprobability.reshape(-1)
+
+    def _write_state(self):
+
+        state = self._state
+
+        arrays = {}
+
+        for key in ['n_walkers', 'n_dim', 'burn_in', 'n_samples', 'n_burn_in_done', 'n_samples_done']:
+
+            arrays[key] = state[key]
+
+        if state['position'] is not None:
+
+            arrays['position'] = state['position']
+            arrays['lnprob'] = state['lnprob']
+
+        if state['random_state'] is not None:
+
+            # ('MT19937', keys, pos, has_gauss, cached_gaussian)
+
+            for i, item in enumerate(state['random_state']):
+
+                arrays['random_state_%i' % i] = item
+
+        # write to a temporary file first, so that an interruption never leaves a partial state
+
+        temporary_file_name = "%s.%d.tmp" % (self._state_file, os.getpid())
+
+        with open(temporary_file_name, 'wb') as f:
+
+            np.savez(f, **arrays)
+
+        os.rename(temporary_file_name, self._state_file)
+
+    def _read_state(self):
+
+        if not self.exists:
+
+            raise IOError("There is no chain to resume in %s" % self._directory)
+
+        with np.load(self._state_file) as data:
+
+            state = {}
+
+            for key in ['n_walkers', 'n_dim', 'burn_in', 'n_samples', 'n_burn_in_done', 'n_samples_done']:
+
+                state[key] = int(data[key])
+
+            if 'position' in data.files:
+
+                state['position'] = data['position']
+                state['lnprob'] = data['lnprob']
+
+            else:
+
+                state['position'] = None
+                state['lnprob'] = None
+
+            if 'random_state_0' in data.files:
+
+                state['random_state'] = (str(data['random_state_0']),
+                                         data['random_state_1'],
+                                         int(data['random_state_2']),
+                                         int(data['random_state_3']),
+                                         float(data['random_state_4']))
+
+            else:
+
+                state['random_state'] = None
+
+        return state
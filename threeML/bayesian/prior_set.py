@@ -0,0 +1,102 @@
+import numpy as np
+
+
+class PriorSet(object):
+
+    def __init__(self, free_parameters):
+        """
+        The (independent) priors of the free parameters of a model, evaluated together on a vector of parameter
+        values or on a batch of vectors. Each prior is called once for all the vectors of a batch, instead of once for
+        each vector and each parameter.
+
+        The priors are read from the parameters at each evaluation, so that changing the prior of a parameter
+        does not require to build a new instance.
+
+        :param free_parameters: the ordered dictionary of the free parameters (i.e., model.free_parameters)
+        """
+
+        self._names = list(free_parameters.keys())
+
+        self._parameters = list(free_parameters.values())
+
+    @property
+    def n_parameters(self):
+
+        return len(self._parameters)
+
+    def _as_batch(self, values):
+
+        values = np.asarray(values, dtype=float)
+
+        batch = np.atleast_2d(values)
+
+        assert batch.shape[1] == len(self._parameters), ("Something is wrong. Number of free parameters "
+                                                          "do not match the number of trial values.")
+
+        return values.ndim == 1, batch
+
+    def log_prior(self, values):
+        """
+        Compute the sum of the log10 of the priors (which is -inf outside of the support of any of the priors)
+
+        :param values: a vector of values of the free parameters, or a (n_vectors, n_parameters) array of them
+        :return: the log prior (a number for a vector, an array for a batch)
+        """
+
+        is_vector, batch = self._as_batch(values)
+
+        log_prior = np.zeros(batch.shape[0])
+
+        with np.errstate(divide='ignore'):
+
+            for i, parameter in enumerate(self._parameters):
+
+                log_prior += np.log10(parameter.prior(batch[:, i]))
+
+        if is_vector:
+
+            return log_prior[0]
+
+        return log_prior
+
+    def from_unit_cube(self, values):
+        """
+        Transform points of the unit cube into values of the free parameters distributed according to the priors
+        (as used by nested samplers)
+
+        :param values: a vector of coordinates in the unit cube, or a (n_vectors, n_parameters) array of them
+        :return: the values of the parameters, with the same shape as the input
+        """
+
+        is_vector, batch = self._as_batch(values)
+
+        transformed = np.empty_like(batch)
+
+        for i, (name, parameter) in enumerate(zip(self._names, self._parameters)):
+
+            try:
+
+                transformed[:, i] = parameter.prior.from_unit_cube(batch[:, i])
+
+            except AttributeError:
+
+                raise RuntimeError("The prior you are trying to use for parameter %s is "
+                                   "not compatible with multinest" % name)
+
+        if is_vector:
+
+            return transformed[0]
+
+        return transformed
+
+    def set_values(self, values):
+        """
+        Assign a vector of values to the free parameters
+
+        :param values: a vector of values, in the order of the free parameters
+        :return: none
+        """
+
+        for parameter, value in zip(self._parameters, values):
+
+            parameter.value = value
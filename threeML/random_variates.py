@@ -3,6 +3,80 @@ import numpy as np
 from threeML.io.uncertainty_formatter import uncertainty_formatter
 
 
+def highest_posterior_density_intervals(samples, cl=0.68, axis=-1):
+    """
+    Compute the Highest Posterior Density interval (HPD) of many quantities at once, with one sort of the samples
+    of each quantity. The samples of each quantity are along the given axis, so that this works both on a
+    (n_samples, n_parameters) matrix (axis=0) and on a stack of propagated quantities (axis=-1).
+
+    NOTE: the returned interval is the HPD only if the posterior is not multimodal.
+
+    :param samples: array of samples
+    :param cl: credibility level (0 < cl < 1)
+    :param axis: the axis of the samples (default: the last one)
+    :return: (low_bounds, hi_bounds), two arrays with the shape of samples without the axis of the samples
+    """
+
+    assert 0 < cl < 1, "The credibility level should be 0 < cl < 1"
+
+    # sorting a copy keeps the covariance between the samples of different quantities
+
+    ordered = np.sort(np.moveaxis(np.asarray(samples, dtype=float), axis, -1), axis=-1)
+
+    n = ordered.shape[-1]
+
+    # If all values have the same probability, then the hpd is degenerate, but its length is from 0 to
+    # the value corresponding to the (cl * n)-th sample.
+    # This is the index of the rightermost element which can be part of the interval
+
+    index_of_rightmost_possibility = int(np.floor(cl * n))
+
+    # Compute the index of the last element that is eligible to be the left bound of the interval
+
+    index_of_leftmost_possibility = n - index_of_rightmost_possibility
+
+    # Now compute the width of all intervals that might be the one we are looking for
+
+    interval_width = ordered[..., index_of_rightmost_possibility:] - ordered[..., :index_of_leftmost_possibility]
+
+    # This might happen if there are too few values
+    if interval_width.shape[-1] == 0:
+        raise RuntimeError('Too few elements for interval calculation')
+
+    # Find the index of the shortest interval for each quantity, then its extremes
+
+    ordered = ordered.reshape(-1, n)
+
+    idx_of_minimum = np.argmin(interval_width.reshape(ordered.shape[0], -1), axis=1)
+
+    rows = np.arange(ordered.shape[0])
+
+    hpd_left_bounds = ordered[rows, idx_of_minimum].reshape(interval_width.shape[:-1])
+    hpd_right_bounds = ordered[rows, idx_of_minimum + index_of_rightmost_possibility].reshape(interval_width.shape[:-1])
+
+    return hpd_left_bounds, hpd_right_bounds
+
+
+def equal_tail_intervals(samples, cl=0.68, axis=-1):
+    """
+    Compute the equal tail interval of many quantities at once (both bounds come from one partition of the
+    samples of each quantity). The samples of each quantity are along the given axis (see
+    highest_posterior_density_intervals).
+
+    :param samples: array of samples
+    :param cl: confidence level (0 < cl < 1)
+    :param axis: the axis of the samples (default: the last one)
+    :return: (low_bounds, hi_bounds), two arrays with the shape of samples without the axis of the samples
+    """
+
+    assert 0 < cl < 1, "Confidence level must be 0 < cl < 1"
+
+    half_cl = cl / 2.0 * 100.0
+
+    low_bounds, hi_bounds = np.percentile(np.asarray(samples), [50.0 - half_cl, 50.0 + half_cl], axis=axis)
+
+    return low_bounds, hi_bounds
+
 
 class RandomVariates(np.ndarray):
     """
@@ -76,47 +150,12 @@ class RandomVariates(np.ndarray):
         :return: (low_bound, hi_bound)
         """
 
-        assert 0 < cl < 1, "The credibility level should be 0 < cl < 1"
-
         # NOTE: we cannot sort the array, because we would destroy the covariance with other physical quantities,
-        # so we get a copy instead. This copy will live only for the duration of this method (but of course will be
-        # collected only whenevery the garbage collector decides to).
-
-        ordered = np.sort(np.array(self))
-
-        n = ordered.size
-
-        # This is the probability that the interval should span
-        interval_integral = cl
-
-        # If all values have the same probability, then the hpd is degenerate, but its length is from 0 to
-        # the value corresponding to the (interval_integral * n)-th sample.
-        # This is the index of the rightermost element which can be part of the interval
+        # so the function works on a copy
 
-        index_of_rightmost_possibility = int(np.floor(interval_integral * n))
+        hpd_left_bound, hpd_right_bound = highest_posterior_density_intervals(np.asarray(self), cl)
 
-        # Compute the index of the last element that is eligible to be the left bound of the interval
-
-        index_of_leftmost_possibility = n - index_of_rightmost_possibility
-
-        # Now compute the width of all intervals that might be the one we are looking for
-
-        interval_width = ordered[index_of_rightmost_possibility:] - ordered[:index_of_leftmost_possibility]
-
-        # This might happen if there are too few values
-        if len(interval_width) == 0:
-            raise RuntimeError('Too few elements for interval calculation')
-
-        # Find the index of the shortest interval
-
-        idx_of_minimum = np.argmin(interval_width)
-
-        # Find the extremes of the shortest interval
-
-        hpd_left_bound = ordered[idx_of_minimum]
-        hpd_right_bound = ordered[idx_of_minimum + index_of_rightmost_possibility]
-
-        return hpd_left_bound, hpd_right_bound
+        return hpd_left_bound[()], hpd_right_bound[()]
 
 
     def equal_tail_interval(self, cl=0.68):
@@ -131,11 +170,7 @@ class RandomVariates(np.ndarray):
         :return: (low_bound, hi_bound)
         """
 
-        assert 0 < cl < 1, "Confidence level must be 0 < cl < 1"
-
-        half_cl = cl / 2.0 * 100.0
-
-        low_bound, hi_bound = np.percentile(np.asarray(self), [50.0 - half_cl, 50.0 + half_cl])
+        low_bound, hi_bound = equal_tail_intervals(np.asarray(self), cl)
 
         return float(low_bound), float(hi_bound)
 
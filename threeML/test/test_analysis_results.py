@@ -6,7 +6,8 @@ import astropy.units as u
 from threeML.plugins.XYLike import XYLike
 from threeML import Model, DataList, JointLikelihood, PointSource
 from threeML import BayesianAnalysis, Uniform_prior, Log_uniform_prior
-from threeML.analysis_results import MLEResults, load_analysis_results, AnalysisResultsSet
+from threeML.analysis_results import MLEResults, BayesianResults, load_analysis_results, AnalysisResultsSet
+from threeML.analysis_results import load_analysis_results_frame, has_tables
 from astromodels import Line, Gaussian, Powerlaw
 
 
@@ -105,6 +106,94 @@ def test_analysis_set_input_output(xy_fitted_joint_likelihood):
         _results_are_same(res1, res2)
 
 
+@pytest.mark.skipif(not has_tables, reason="PyTables is not installed")
+def test_analysis_results_input_output_hdf5(xy_fitted_joint_likelihood, xy_completed_bayesian_analysis):
+
+    jl, _, _ = xy_fitted_joint_likelihood  # type: JointLikelihood, None, None
+
+    jl.restore_best_fit()
+
+    ar = jl.results  # type: MLEResults
+
+    bs, _ = xy_completed_bayesian_analysis
+
+    rb = bs.results
+
+    temp_file = "__test_results.h5"
+
+    ar.write_to(temp_file, overwrite=True)
+
+    ar_reloaded = load_analysis_results(temp_file)
+
+    _results_are_same(ar, ar_reloaded)
+
+    rb.write_to(temp_file, overwrite=True)
+
+    rb_reloaded = load_analysis_results(temp_file)
+
+    # The samples are read lazily, one parameter at a time or all together
+
+    for path in rb.optimized_model.free_parameters.keys():
+
+        assert np.array_equal(rb.get_variates(path), rb_reloaded.get_variates(path))
+
+    assert np.array_equal(rb.samples, rb_reloaded.samples)
+
+    _results_are_same(rb, rb_reloaded, bayes=True)
+
+    with pytest.raises(IOError):
+
+        rb.write_to(temp_file, overwrite=False)
+
+    os.remove(temp_file)
+
+
+@pytest.mark.skipif(not has_tables, reason="PyTables is not installed")
+def test_analysis_set_input_output_hdf5(xy_fitted_joint_likelihood, xy_completed_bayesian_analysis):
+
+    jl, _, _ = xy_fitted_joint_likelihood  # type: JointLikelihood, None, None
+
+    jl.restore_best_fit()
+
+    bs, _ = xy_completed_bayesian_analysis
+
+    analysis_set = AnalysisResultsSet([jl.results, bs.results, jl.results])
+
+    analysis_set.set_bins("testing", [-1, 1, 3], [1, 3, 5], unit='s')
+
+    temp_file = "__test_analysis_set.h5"
+
+    analysis_set.write_to(temp_file, overwrite=True)
+
+    analysis_set_reloaded = load_analysis_results(temp_file)
+
+    assert len(analysis_set_reloaded) == len(analysis_set)
+
+    for res1, res2 in zip(analysis_set, analysis_set_reloaded):
+
+        _results_are_same(res1, res2, bayes=res1.analysis_type == "Bayesian")
+
+    # The parameters of all the results can be read without building the results
+
+    frame = load_analysis_results_frame(temp_file)
+
+    os.remove(temp_file)
+
+    n_parameters = len(jl.results.optimized_model.free_parameters)
+
+    assert frame.shape[0] == 3 * n_parameters
+
+    assert np.all(frame['result'].values == np.repeat(np.arange(3), n_parameters))
+
+    assert np.allclose(frame['LOWER_BOUND'].values, np.repeat([-1, 1, 3], n_parameters))
+
+    for i, res in enumerate(analysis_set):
+
+        this_frame = frame[frame['result'] == i]
+
+        assert np.allclose(this_frame['value'].values, res.get_data_frame()['value'].values)
+
+
 def test_error_propagation(xy_fitted_joint_likelihood):
 
     jl, _, _ = xy_fitted_joint_likelihood  # type: JointLikelihood, None, None
@@ -185,6 +274,63 @@ def test_bayesian_input_output(xy_completed_bayesian_analysis):
     _results_are_same(rb1, rb2, bayes=True)
 
 
+def test_bayesian_output_with_undefined_measures(xy_completed_bayesian_analysis):
+
+    bs, _ = xy_completed_bayesian_analysis
+
+    rb1 = bs.results
+
+    measures = dict(rb1.statistical_measures)
+
+    measures['split R_hat (max)'] = np.nan
+
+    rb2 = BayesianResults(rb1.optimized_model, rb1.samples.T, rb1.optimal_statistic_values, measures)
+
+    temp_file = "_test_bayes_nan.fits"
+
+    # the undefined measure is not written to the header
+
+    rb2.write_to(temp_file, overwrite=True)
+
+    rb3 = load_analysis_results(temp_file)
+
+    os.remove(temp_file)
+
+    assert 'split R_hat (max)' not in rb3.statistical_measures
+
+    _results_are_same(rb1, rb3, bayes=True)
+
+
+def test_batch_intervals_and_correlation(xy_completed_bayesian_analysis):
+
+    bs, _ = xy_completed_bayesian_analysis
+
+    ar = bs.results
+
+    for error_type, method in [("equal tail", "equal_tail_interval"), ("hpd", "highest_posterior_density_interval")]:
+
+        frame = ar.get_data_frame(error_type=error_type, cl=0.9)
+
+        for path in ar.optimized_model.free_parameters.keys():
+
+            variates = ar.get_variates(path)
+
+            low_b, hi_b = getattr(variates, method)(0.9)
+
+            assert np.isclose(frame['negative_error'][path], low_b - variates.value)
+            assert np.isclose(frame['positive_error'][path], hi_b - variates.value)
+
+    covariance = ar.estimate_covariance_matrix()
+
+    correlation = ar.get_correlation_matrix()
+
+    for i in range(covariance.shape[0]):
+
+        for j in range(covariance.shape[0]):
+
+            assert np.isclose(correlation[i, j], covariance[i, j] / np.sqrt(covariance[i, i] * covariance[j, j]))
+
+
 def test_corner_plotting(xy_completed_bayesian_analysis):
 
     bs, _ = xy_completed_bayesian_analysis
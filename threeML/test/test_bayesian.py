@@ -1,5 +1,10 @@
 from threeML import BayesianAnalysis, Uniform_prior, Log_uniform_prior
+from threeML.bayesian.bayesian_analysis import _get_multinest_chain_name
+from threeML.bayesian.chain_backend import ChainBackend
+from threeML.bayesian.prior_set import PriorSet
 import numpy as np
+import os
+import tempfile
 import pytest
 
 
@@ -57,16 +62,254 @@ def test_emcee():
     pass
 
 
-def test_multinest(completed_bn090217206_bayesian_analysis):
+def test_emcee_local_pool(fitted_joint_likelihood_bn090217206_nai):
+
+    jl, _, _ = fitted_joint_likelihood_bn090217206_nai
+
+    jl.restore_best_fit()
+
+    model = jl.likelihood_model
+    datalist = jl.data_list
+
+    set_priors(model)
+
+    bayes = BayesianAnalysis(model, datalist)
+
+    samples = bayes.sample(n_walkers=20, burn_in=50, n_samples=100, seed=1234, n_processes=2, quiet=True)
+
+    assert bayes.raw_samples.shape == (20 * 100, 2)
+
+    res = bayes.results.get_data_frame()
+
+    check_results(res)
+
+    # parallel tempering with a local pool as well
+
+    bayes.sample_parallel_tempering(n_temps=2, n_walkers=10, burn_in=10, n_samples=20, quiet=True, n_processes=2)
+
+    # only the samples at temperature 1 are kept, together with their log probabilities
+
+    assert bayes.raw_samples.shape == (10 * 20, 2)
+
+    assert bayes.log_probability_values.shape == (10 * 20,)
+
+
+def test_prior_set(completed_bn090217206_bayesian_analysis):
+
+    bayes, _ = completed_bn090217206_bayesian_analysis
+
+    prior_set = PriorSet(bayes.likelihood_model.free_parameters)
+
+    samples = np.array(bayes.raw_samples[:100])
+
+    # a batch gives the same results as one vector at the time
+
+    log_priors = prior_set.log_prior(samples)
+
+    assert np.allclose(log_priors, [prior_set.log_prior(sample) for sample in samples])
+
+    assert np.allclose(log_priors, [bayes._log_prior(sample) for sample in samples])
+
+    # outside of the support of the priors (K has a log-uniform prior between 1 and 10)
+
+    assert prior_set.log_prior([100.0, -1.0]) == -np.inf
+
+    # unit cube transforms
+
+    cube = np.array([[0.5, 0.5], [0.0, 0.25]])
+
+    transformed = prior_set.from_unit_cube(cube)
+
+    assert np.allclose(transformed, [prior_set.from_unit_cube(point) for point in cube])
+
+    assert np.allclose(transformed[:, 1], [0.0, -2.5])
+
+    # the batch posterior is the same as the posterior of each vector
+
+    assert np.allclose(bayes._get_posteriors(samples), [bayes.get_posterior(sample) for sample in samples])
+
+
+def test_emcee_chain_backend(fitted_joint_likelihood_bn090217206_nai, tmpdir):
+
+    jl, _, _ = fitted_joint_likelihood_bn090217206_nai
+
+    jl.restore_best_fit()
+
+    model = jl.likelihood_model
+    datalist = jl.data_list
+
+    set_priors(model)
+
+    bayes = BayesianAnalysis(model, datalist)
+
+    chain_directory = str(tmpdir.join('chain'))
+
+    np.random.seed(1234)
+
+    bayes.sample(n_walkers=20, burn_in=50, n_samples=100, seed=1234, quiet=True, chain_directory=chain_directory)
+
+    # the samples are read from the files in the chain directory
+
+    assert isinstance(bayes.raw_samples, np.memmap)
+
+    assert bayes.raw_samples.shape == (20 * 100, 2)
+
+    check_results(bayes.results.get_data_frame())
+
+    samples = np.array(bayes.raw_samples)
+    log_probability = np.array(bayes.log_probability_values)
+
+    # resuming a complete chain only reads it
+
+    bayes.sample(n_walkers=20, burn_in=50, n_samples=100, quiet=True, chain_directory=chain_directory, resume=True)
+
+    assert np.all(bayes.raw_samples == samples)
+
+    # rewind the chain to the middle of the sampling, as if the run had been interrupted, then resume it
+
+    backend = ChainBackend(chain_directory)
+
+    backend.open(20, 2, 50, 100)
+
+    backend._state['n_samples_done'] = 60
+    backend._state['position'] = samples.reshape(20, 100, 2)[:, 59, :]
+    backend._state['lnprob'] = log_probability.reshape(20, 100)[:, 59]
+
+    backend._write_state()
+
+    bayes.sample(n_walkers=20, burn_in=50, n_samples=100, quiet=True, chain_directory=chain_directory, resume=True)
+
+    assert bayes.raw_samples.shape == (20 * 100, 2)
+
+    assert np.all(bayes.raw_samples.reshape(20, 100, 2)[:, :60, :] == samples.reshape(20, 100, 2)[:, :60, :])
+
+    # the settings of a resumed chain cannot change
+
+    with pytest.raises(RuntimeError):
+
+        bayes.sample(n_walkers=10, burn_in=50, n_samples=100, quiet=True, chain_directory=chain_directory,
+                     resume=True)
+
+
+def test_emcee_adaptive(fitted_joint_likelihood_bn090217206_nai):
+
+    jl, _, _ = fitted_joint_likelihood_bn090217206_nai
+
+    jl.restore_best_fit()
+
+    model = jl.likelihood_model
+    datalist = jl.data_list
+
+    set_priors(model)
+
+    bayes = BayesianAnalysis(model, datalist)
+
+    bayes.sample(n_walkers=20, burn_in=2000, n_samples=5000, seed=1234, quiet=True, adaptive=True, target_ess=500,
+                 check_interval=100)
+
+    diagnostics = bayes.convergence_diagnostics
+
+    # the sampling stopped before the maximum number of steps, after reaching the target
+
+    n_steps = bayes.raw_samples.shape[0] // 20
+
+    assert diagnostics['burn-in steps'] <= 2000
+    assert n_steps < 5000
+    assert diagnostics['ESS (min)'] >= 500
+
+    check_results(bayes.results.get_data_frame())
+
+    # the diagnostics are stored in the results
+
+    assert np.isclose(bayes.results.statistical_measures['ESS (min)'], diagnostics['ESS (min)'])
+
+
+def test_importance_reweight(completed_bn090217206_bayesian_analysis):
+
+    bayes, _ = completed_bn090217206_bayesian_analysis
+
+    n_samples = bayes.raw_samples.shape[0]
+
+    # with the same posterior all the weights are equal
+
+    same = bayes.importance_reweight(seed=1234)
+
+    assert np.allclose(same.importance_weights, 1.0 / n_samples)
+
+    assert np.isclose(same.convergence_diagnostics['importance ESS'], n_samples)
+
+    check_results(same.results.get_data_frame())
+
+    # a narrower prior on the index removes the samples outside of it
+
+    powerlaw = bayes.likelihood_model.bn090217206.spectrum.main.Powerlaw
+
+    powerlaw.index.prior = Uniform_prior(lower_bound=-1.18, upper_bound=5.0)
+
+    try:
+
+        narrower = bayes.importance_reweight(seed=1234, n_processes=2, batch_size=100)
+
+    finally:
+
+        set_priors(bayes.likelihood_model)
+
+    assert np.all(narrower.samples['bn090217206.spectrum.main.Powerlaw.index'] > -1.18)
+
+    assert narrower.convergence_diagnostics['importance ESS'] < n_samples
+
+    assert np.isclose(narrower.results.statistical_measures['importance ESS'],
+                      narrower.convergence_diagnostics['importance ESS'])
+
+
+def test_multinest(completed_bn090217206_bayesian_analysis, tmpdir, monkeypatch):
 
     bayes, _ = completed_bn090217206_bayesian_analysis
 
+    # the output goes to a temporary directory, which is removed after reading the results
+
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir))
+
     bayes.sample_multinest(n_live_points=400)
 
+    assert tmpdir.listdir() == []
+
     res = bayes.results.get_data_frame()
 
     check_results(res)
 
+
+def test_multinest_chain_names(tmpdir):
+
+    base_directory = str(tmpdir.join('chains'))
+
+    # each run gets its own directory
+
+    chain_name_1 = _get_multinest_chain_name(base_directory=base_directory)
+    chain_name_2 = _get_multinest_chain_name(base_directory=base_directory)
+
+    assert chain_name_1 != chain_name_2
+
+    assert os.path.isdir(os.path.dirname(chain_name_1))
+    assert os.path.isdir(os.path.dirname(chain_name_2))
+
+    # by default the directories are created in the temporary directory
+
+    chain_name_3 = _get_multinest_chain_name()
+
+    assert os.path.dirname(os.path.dirname(chain_name_3)) == tempfile.gettempdir()
+
+    os.rmdir(os.path.dirname(chain_name_3))
+
+    # a given name is used as it is
+
+    chain_name = os.path.join(str(tmpdir), 'my_chains', 'fit-')
+
+    assert _get_multinest_chain_name(chain_name) == chain_name
+
+    assert os.path.isdir(os.path.dirname(chain_name))
+
+
 # def test_parallel_temp():
 #
 #     powerlaw.index.prior = Uniform_prior(lower_bound=-5.0, upper_bound=5.0)
@@ -4,8 +4,15 @@ import numpy as np
 import pytest
 from conftest import get_test_datasets_directory
 from threeML.io.file_utils import within_directory
+from threeML.parallel.parallel_client import parallel_computation
+from threeML.utils.bayesian_blocks import bayesian_blocks, bayesian_blocks_binned
+from threeML.utils.binner import TemporalBinner
+from threeML.utils.statistics.stats_tools import Significance
 from threeML.utils.time_interval import TimeIntervalSet
-from threeML.utils.time_series.event_list import EventListWithDeadTime, EventList
+from threeML.utils.time_series import background_fit_cache, time_series
+from threeML.utils.time_series.background_fit_cache import BackgroundFitCache
+from threeML.utils.time_series.event_index import ChannelEventIndex
+from threeML.utils.time_series.event_list import EventListWithDeadTime, EventListWithLiveTime, EventList
 
 __this_dir__ = os.path.join(os.path.abspath(os.path.dirname(__file__)))
 datasets_dir = get_test_datasets_directory()
@@ -120,3 +127,406 @@ def test_binned_fit():
         evt_list.__repr__()
 
 
+
+def test_channel_event_index():
+
+    np.random.seed(1234)
+
+    arrival_times = np.random.uniform(-50, 100, 5000)
+    channels = np.random.randint(0, 5, 5000)
+
+    evt_list = EventList(arrival_times=arrival_times,
+                         measurement=channels,
+                         n_channels=4,
+                         start_time=-50,
+                         stop_time=100)
+
+    for start, stop in [(-10, 0), (3.3, 7.1), (90, 200)]:
+
+        selection = np.logical_and(arrival_times >= start, arrival_times < stop)
+
+        # the out-of-range channel is counted in the total but not per channel
+
+        assert evt_list.counts_over_interval(start, stop) == selection.sum()
+
+        brute_force = [np.logical_and(selection, channels == chan).sum() for chan in range(4)]
+
+        assert np.all(evt_list.count_per_channel_over_interval(start, stop) == brute_force)
+
+
+def test_event_on_interval_stop():
+
+    # the intervals are half-open: an event exactly on the stop belongs to the next interval
+
+    arrival_times = np.array([0., 1., 1.5, 2., 3.])
+    channels = np.array([0, 1, 0, 1, 0])
+    dead_time = np.array([0.01, 0.02, 0.03, 0.04, 0.05])
+
+    evt_list = EventListWithDeadTime(arrival_times=arrival_times,
+                                     measurement=channels,
+                                     n_channels=2,
+                                     start_time=0,
+                                     stop_time=4,
+                                     dead_time=dead_time)
+
+    assert evt_list.counts_over_interval(1., 2.) == 2
+
+    assert np.all(evt_list.count_per_channel_over_interval(1., 2.) == [1, 1])
+
+    assert np.isclose(evt_list.exposure_over_interval(1., 2.), 1. - 0.02 - 0.03)
+
+    event_index = ChannelEventIndex(arrival_times, channels, 2)
+
+    assert np.all(event_index.events_over_interval(1., 2.) == [1., 1.5])
+
+    assert np.all(event_index.events_over_intervals([0., 1.], [1., 2.]) == [0., 1., 1.5])
+
+    assert np.all(event_index.channel_events(1, [1.], [2.]) == [1.])
+
+    assert np.all(event_index.events_in_channels([True, True], 1., 2.) == [1., 1.5])
+
+
+def test_exposure_over_intervals():
+
+    np.random.seed(1234)
+
+    arrival_times = np.sort(np.random.uniform(0, 100, 1000))
+    dead_time = np.random.uniform(1E-6, 1E-5, 1000)
+
+    evt_list = EventListWithDeadTime(arrival_times=arrival_times,
+                                     measurement=np.zeros_like(arrival_times),
+                                     n_channels=1,
+                                     start_time=0,
+                                     stop_time=100,
+                                     dead_time=dead_time)
+
+    starts = np.array([0., 10., 55.5])
+    stops = np.array([5., 42.3, 100.])
+
+    exposures = evt_list.exposure_over_intervals(starts, stops)
+
+    for start, stop, exposure in zip(starts, stops, exposures):
+
+        selection = np.logical_and(arrival_times >= start, arrival_times < stop)
+
+        assert np.isclose(exposure, (stop - start) - dead_time[selection].sum())
+
+        assert np.isclose(evt_list.exposure_over_interval(start, stop), exposure)
+
+
+def test_exposure_from_live_time():
+
+    np.random.seed(1234)
+
+    arrival_times = np.sort(np.random.uniform(0, 100, 1000))
+
+    # live time bins of 1 s with a dead time fraction of 10%
+
+    live_time_starts = np.arange(0., 100.)
+    live_time_stops = live_time_starts + 1.
+
+    dead_time_fraction = 0.1
+
+    live_time = (1 - dead_time_fraction) * (live_time_stops - live_time_starts)
+
+    evt_list = EventListWithLiveTime(arrival_times=arrival_times,
+                                     measurement=np.zeros_like(arrival_times),
+                                     n_channels=1,
+                                     live_time=live_time,
+                                     live_time_starts=live_time_starts,
+                                     live_time_stops=live_time_stops,
+                                     start_time=0,
+                                     stop_time=100)
+
+    # whole bins, fractions of bins at the edges and intervals beyond the live time table
+
+    starts = np.array([0., 2.5, 10.25, -5., 95.])
+    stops = np.array([10., 7.25, 10.75, 3., 110.])
+
+    expected = (1 - dead_time_fraction) * (np.clip(stops, 0, 100) - np.clip(starts, 0, 100))
+
+    exposures = evt_list.exposure_over_intervals(starts, stops)
+
+    assert np.allclose(exposures, expected)
+
+    for start, stop, exposure in zip(starts, stops, exposures):
+
+        assert np.isclose(evt_list.exposure_over_interval(start, stop), exposure)
+
+
+def test_parallel_binned_fit():
+
+    np.random.seed(1234)
+
+    with within_directory(datasets_dir):
+
+        arrival_times = np.loadtxt('test_event_data.txt')
+
+        channels = np.random.randint(0, 4, arrival_times.shape[0])
+
+        evt_list = EventListWithDeadTime(arrival_times=arrival_times,
+                                         measurement=channels,
+                                         n_channels=4,
+                                         start_time=arrival_times[0],
+                                         stop_time=arrival_times[-1],
+                                         dead_time=np.zeros_like(arrival_times)
+                                         )
+
+        evt_list.set_polynomial_fit_interval("1-49", unbinned=False, use_cache=False)
+
+        serial_coefficients = [poly.coefficients for poly in evt_list.polynomials]
+
+        with parallel_computation(start_cluster=False):
+
+            evt_list.set_polynomial_fit_interval("1-49", unbinned=False, use_cache=False)
+
+        assert len(evt_list.polynomials) == 4
+
+        for poly, coefficients in zip(evt_list.polynomials, serial_coefficients):
+
+            assert np.allclose(poly.coefficients, coefficients)
+
+
+def test_batch_fit():
+
+    with within_directory(datasets_dir):
+
+        arrival_times = np.loadtxt('test_event_data.txt')
+
+        evt_list = EventListWithDeadTime(arrival_times=arrival_times,
+                                         measurement=np.zeros_like(arrival_times),
+                                         n_channels=1,
+                                         start_time=arrival_times[0],
+                                         stop_time=arrival_times[-1],
+                                         dead_time=np.zeros_like(arrival_times)
+                                         )
+
+        for unbinned in [True, False]:
+
+            evt_list.set_polynomial_fit_interval("1-49", unbinned=unbinned)
+
+            coefficients = evt_list.polynomials[0].coefficients
+
+            evt_list.set_polynomial_fit_interval("1-49", unbinned=unbinned, batch=True)
+
+            batch_coefficients = evt_list.polynomials[0].coefficients
+
+            assert np.allclose(batch_coefficients, coefficients, rtol=1e-2)
+
+            assert np.all(np.isfinite(evt_list.polynomials[0].error))
+
+
+def test_bin_by_significance():
+
+    np.random.seed(1234)
+
+    background_rate = 50.
+
+    arrival_times = np.sort(np.concatenate([np.random.uniform(-20, 60, 4000), np.random.exponential(3, 3000)]))
+
+    background_getter = lambda start, stop: background_rate * (np.asarray(stop) - start)
+
+    bins = TemporalBinner.bin_by_significance(arrival_times, background_getter, sigma_level=5)
+
+    for start, stop in zip(bins.start_times, bins.stop_times):
+
+        # every bin ends at the first event where the significance reaches the level
+
+        start_idx = np.searchsorted(arrival_times, start)
+        stop_idx = np.searchsorted(arrival_times, stop)
+
+        candidates = np.arange(start_idx + 1, stop_idx + 1)
+
+        sigma = Significance(candidates - start_idx + 1, background_getter(start, arrival_times[candidates])).li_and_ma()
+
+        assert sigma[-1] >= 5
+
+        assert np.all(sigma[:-1] < 5)
+
+
+def test_bayesian_blocks():
+
+    np.random.seed(1234)
+
+    arrival_times = np.sort(np.concatenate([np.random.uniform(0, 100, 3000), np.random.normal(40, 2, 1500)]))
+
+    # pruning the candidate change points must not change the result
+
+    edges = bayesian_blocks(arrival_times, 0, 100, 1e-3)
+
+    assert np.array_equal(edges, bayesian_blocks(arrival_times, 0, 100, 1e-3, prune=False))
+
+    assert edges[0] == 0 and edges[-1] == 100
+
+    assert len(edges) > 3
+
+    # the same light curve in bins
+
+    bin_edges = np.linspace(0, 100, 201)
+
+    counts, _ = np.histogram(arrival_times, bin_edges)
+
+    binned_edges = bayesian_blocks_binned(bin_edges, counts, 1e-3)
+
+    assert binned_edges[0] == 0 and binned_edges[-1] == 100
+
+    assert np.all(np.in1d(binned_edges, bin_edges))
+
+    # the burst is found in both cases
+
+    assert np.any(np.logical_and(binned_edges > 30, binned_edges < 40))
+
+
+def test_light_curve():
+
+    np.random.seed(1234)
+
+    with within_directory(datasets_dir):
+
+        arrival_times = np.loadtxt('test_event_data.txt')
+
+        channels = np.random.randint(0, 4, arrival_times.shape[0])
+
+        evt_list = EventListWithDeadTime(arrival_times=arrival_times,
+                                         measurement=channels,
+                                         n_channels=4,
+                                         start_time=arrival_times[0],
+                                         stop_time=arrival_times[-1],
+                                         dead_time=np.zeros_like(arrival_times)
+                                         )
+
+        edges = np.linspace(0, 50, 101)
+
+        light_curve = evt_list.light_curve(edges[:-1], edges[1:])
+
+        assert np.all(np.isnan(light_curve['background rate']))
+
+        histogram, _ = np.histogram(arrival_times, edges)
+
+        assert np.allclose(light_curve['counts'], histogram)
+
+        assert np.allclose(light_curve['exposure'], 0.5)
+
+        evt_list.set_polynomial_fit_interval("1-49", unbinned=False)
+
+        mask = np.array([True, False, True, False])
+
+        light_curve = evt_list.light_curve(edges[:-1], edges[1:], mask)
+
+        histogram, _ = np.histogram(arrival_times[np.logical_or(channels == 0, channels == 2)], edges)
+
+        assert np.allclose(light_curve['counts'], histogram)
+
+        assert np.allclose(light_curve['background rate'],
+                           evt_list.get_total_poly_count(edges[:-1], edges[1:], mask) / 0.5)
+
+        assert np.all(light_curve['background rate error'] > 0)
+
+
+def test_light_curve_bin_edges():
+
+    # some events fall exactly on the edges between the bins
+
+    arrival_times = np.array([0., 0.5, 1., 1., 1.7, 2., 2.5, 3.])
+    channels = np.array([0, 1, 0, 1, 0, 1, 0, 1])
+
+    evt_list = EventListWithDeadTime(arrival_times=arrival_times,
+                                     measurement=channels,
+                                     n_channels=2,
+                                     start_time=0,
+                                     stop_time=4,
+                                     dead_time=np.zeros_like(arrival_times))
+
+    edges = np.array([0., 1., 2., 3., 4.])
+
+    light_curve = evt_list.light_curve(edges[:-1], edges[1:])
+
+    # every event is counted in one bin only, as in np.histogram
+
+    assert np.all(light_curve['counts'] == [2, 3, 2, 1])
+
+    assert light_curve['counts'].sum() == arrival_times.shape[0]
+
+    counts_per_channel = evt_list.count_per_channel_over_intervals(edges[:-1], edges[1:])
+
+    assert np.all(counts_per_channel.sum(axis=0) == [4, 4])
+
+    assert np.all(counts_per_channel.sum(axis=1) == light_curve['counts'])
+
+
+def test_background_fit_cache(tmpdir):
+
+    cache = BackgroundFitCache(str(tmpdir), max_size=10 * 1024 ** 2)
+
+    coefficients = np.array([[10., 0.1], [5., -0.2]])
+    covariances = np.array([np.eye(2), 2 * np.eye(2)])
+
+    assert cache.get('group', 'key') is None
+
+    cache.put('group', 'key', coefficients, covariances, 1, 'Binned', 'Powell', np.array([-20., 50.]),
+              np.array([-5., 100.]))
+
+    fit = cache.get('group', 'key')
+
+    assert np.all(fit['coefficients'] == coefficients)
+    assert np.all(fit['covariances'] == covariances)
+    assert fit['grade'] == 1
+    assert fit['fit method'] == 'Powell'
+
+    # similar selections can be warm started, different ones cannot
+
+    assert cache.get_warm_start('group', [-20., 50.], [-5., 101.]) is not None
+
+    assert cache.get_warm_start('group', [-100., 50.], [-5., 300.]) is None
+
+    assert cache.get_warm_start('other_group', [-20., 50.], [-5., 100.]) is None
+
+    # the least recently used fits are evicted when the cache is too large
+
+    small_cache = BackgroundFitCache(str(tmpdir.mkdir('small')), max_size=1)
+
+    small_cache.put('group', 'key', coefficients, covariances, 1, 'Binned', 'Powell', np.array([-20.]),
+                    np.array([-5.]))
+
+    assert small_cache.get('group', 'key') is None
+
+
+def test_cached_background_fit(tmpdir, monkeypatch):
+
+    # use a cache in a temporary directory instead of the one in the user directory
+
+    cache_directory = str(tmpdir.mkdir('background_fits'))
+
+    monkeypatch.setattr(time_series, 'get_background_fit_cache',
+                        lambda: background_fit_cache.get_background_fit_cache(cache_directory))
+
+    with within_directory(datasets_dir):
+
+        arrival_times = np.loadtxt('test_event_data.txt')
+
+        evt_list = EventListWithDeadTime(arrival_times=arrival_times,
+                                         measurement=np.zeros_like(arrival_times),
+                                         n_channels=1,
+                                         start_time=arrival_times[0],
+                                         stop_time=arrival_times[-1],
+                                         dead_time=np.zeros_like(arrival_times)
+                                         )
+
+        evt_list.set_polynomial_fit_interval("1-49", unbinned=False, use_cache=False)
+
+        coefficients = evt_list.polynomials[0].coefficients
+
+        # the second fit with the cache comes from the cache
+
+        for _ in range(2):
+
+            evt_list.set_polynomial_fit_interval("1-49", unbinned=False, use_cache=True)
+
+            assert np.allclose(evt_list.polynomials[0].coefficients, coefficients)
+
+            assert evt_list.poly_intervals == TimeIntervalSet.from_strings("1-49")
+
+        # the fit has been stored in the temporary cache
+
+        assert len(os.listdir(cache_directory)) == 1
+
@@ -1,7 +1,10 @@
 import pytest
+import numpy as np
+import scipy.integrate as integrate
 from threeML import *
 from threeML.plugins.OGIPLike import OGIPLike
-from threeML.utils.fitted_objects.fitted_point_sources import InvalidUnitError
+from threeML.utils.fitted_objects.fitted_point_sources import InvalidUnitError, FittedPointSourceSpectralHandler
+from threeML.utils.fitted_objects.fitted_point_sources import FixedGridIntegral, IntegrationAccuracyError
 from threeML.io.calculate_flux import _calculate_point_source_flux
 import astropy.units as u
 import matplotlib.pyplot as plt
@@ -188,3 +191,110 @@ def test_units_on_energy_range(analysis_to_test):
     with pytest.raises(AssertionError):
         plot_point_source_spectra(analysis_to_test[0], ene_min=1.*u.keV, ene_max=1.)
 
+
+class _LoopFittedPointSourceSpectralHandler(FittedPointSourceSpectralHandler):
+
+    # always propagate the errors one energy at a time
+
+    def _evaluate_vectorized(self):
+
+        return None
+
+
+class _SpyFittedPointSourceSpectralHandler(FittedPointSourceSpectralHandler):
+
+    # record whether the vectorized propagation was used, or the loop was used as a fallback
+
+    def _evaluate_vectorized(self):
+
+        variates = super(_SpyFittedPointSourceSpectralHandler, self)._evaluate_vectorized()
+
+        self.used_vectorized_evaluation = variates is not None
+
+        return variates
+
+
+def test_vectorized_error_propagation(analysis_to_test):
+
+    energies = np.logspace(1, 3, 10)
+
+    for x in analysis_to_test:
+
+        for equal_tailed, is_differential_flux in [(True, True), (False, True), (True, False)]:
+
+            flux_unit = 'erg/(cm2 s keV)' if is_differential_flux else 'erg/(cm2 s)'
+
+            handlers = []
+
+            for handler_class in [_SpyFittedPointSourceSpectralHandler, _LoopFittedPointSourceSpectralHandler]:
+
+                np.random.seed(1234)
+
+                handlers.append(handler_class(x, 'bn090217206', energies, 'keV', flux_unit,
+                                              equal_tailed=equal_tailed, is_differential_flux=is_differential_flux))
+
+            vectorized, loop = handlers
+
+            assert vectorized.used_vectorized_evaluation
+
+            assert vectorized.samples.shape == loop.samples.shape
+            assert np.allclose(vectorized.samples.value, loop.samples.value)
+
+            assert np.allclose(vectorized.median.value, loop.median.value)
+
+            # the variates carry their median as value
+
+            variates = vectorized.values.values
+
+            assert np.allclose([variate.value for variate in variates], [variate.median for variate in variates])
+            assert np.allclose(vectorized.average.value, loop.average.value)
+            assert np.allclose(vectorized.upper_error.value, loop.upper_error.value)
+            assert np.allclose(vectorized.lower_error.value, loop.lower_error.value)
+
+
+def test_fixed_grid_integral():
+
+    def cutoff_powerlaw(x, K, index, xc):
+
+        return K * np.power(x / 100.0, index) * np.exp(-x / xc)
+
+    integral = FixedGridIntegral(cutoff_powerlaw)
+
+    K = np.array([1.0, 2.0, 3.0])
+    index = np.array([-1.5, -1.0, -0.5])
+    xc = np.array([100.0, 300.0, 1000.0])
+
+    fluxes = integral(10.0, 1e4, K=K, index=index, xc=xc)
+
+    assert fluxes.shape == (3,)
+
+    for i in range(3):
+
+        expected = integrate.quad(cutoff_powerlaw, 10.0, 1e4, args=(K[i], index[i], xc[i]), epsabs=0, epsrel=1e-10)[0]
+
+        assert np.isclose(fluxes[i], expected, rtol=1e-6)
+
+    # samples as columns and intervals as rows, as used in the propagation of the errors
+
+    e1 = np.array([[10.0, 100.0]])
+    e2 = np.array([[100.0, 1000.0]])
+
+    fluxes = integral(e1, e2, K=K.reshape(-1, 1), index=index.reshape(-1, 1), xc=xc.reshape(-1, 1))
+
+    assert fluxes.shape == (3, 2)
+
+    assert np.allclose(fluxes.sum(axis=1), integral(10.0, 1000.0, K=K, index=index, xc=xc))
+
+    # a refinement needed for one call does not change the grid of the following ones
+
+    sharp_integral = FixedGridIntegral(cutoff_powerlaw, n_intervals=1)
+
+    sharp_integral(10.0, 1e4, K=1.0, index=-1.0, xc=30.0)
+
+    assert sharp_integral.n_intervals == 1
+
+    # a step cannot be integrated accurately on a fixed grid
+
+    with pytest.raises(IntegrationAccuracyError):
+
+        FixedGridIntegral(lambda x: np.where(x > 123.4567, 1.0, 0.0), max_refinements=1)(10.0, 1e3)
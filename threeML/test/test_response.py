@@ -400,4 +400,34 @@ def test_response_set_weighting_with_disjoint_intervals():
 
     factor = 1.0 / (w1 + w2 + w3) * (w1 + w2 / 2.0 + w3 / 2.0)
 
-    assert np.allclose(weighted_matrix.matrix, factor * rsp_a.matrix)
\ No newline at end of file
+    assert np.allclose(weighted_matrix.matrix, factor * rsp_a.matrix)
+
+def test_response_set_weighting_many_intervals():
+
+    [rsp_a, rsp_b], exposure_getter, counts_getter = get_matrix_set_elements_with_coverage()
+
+    # the getters also work with arrays of start and stop times
+
+    rsp_set = InstrumentResponseSet([rsp_a, rsp_b], exposure_getter, counts_getter, vectorized_getters=True)
+
+    weighted_matrices = rsp_set.weight_intervals_by_exposure([0.0, 12.0, 2.0, 5.0], [5.0, 20.0, 8.0, 25.0])
+
+    assert len(weighted_matrices) == 4
+
+    assert np.allclose(weighted_matrices[0].matrix, rsp_a.matrix)
+    assert np.allclose(weighted_matrices[1].matrix, rsp_b.matrix)
+    assert np.allclose(weighted_matrices[2].matrix, rsp_a.matrix)
+    assert np.allclose(weighted_matrices[3].matrix, 0.625 * rsp_a.matrix)
+
+    # the same as weighting one interval at a time
+
+    weighted_matrices = rsp_set.weight_intervals_by_counts([0.0, 5.0], [30.0, 25.0])
+
+    assert np.allclose(weighted_matrices[0].matrix, rsp_set.weight_by_counts("0.0 - 30.0").matrix)
+    assert np.allclose(weighted_matrices[1].matrix, rsp_set.weight_by_counts("5.0 - 25.0").matrix)
+
+    with pytest.raises(RuntimeError):
+
+        # not covered by the matrices
+
+        _ = rsp_set.weight_intervals_by_exposure([0.0, 25.0], [5.0, 35.0])
@@ -1,6 +1,7 @@
+import numpy as np
 import pytest
 
-from threeML.utils.time_interval import TimeInterval, TimeIntervalSet
+from threeML.utils.time_interval import TimeInterval, TimeIntervalSet, GoodTimeIntervals
 from threeML.utils.interval import IntervalsDoNotOverlap, IntervalsNotContiguous
 
 
@@ -420,6 +421,77 @@ def test_merging_set_intervals():
     assert len(ts1) == 1
     assert TimeInterval(-10.0, 25.0) == ts1[0]
 
+    # intervals sharing the stop are merged, even if one of them only touches the others
+
+    ts1 = TimeIntervalSet([TimeInterval(4., 7.), TimeInterval(6., 7.), TimeInterval(7., 7.)])
+
+    ts2 = ts1.merge_intersecting_intervals(in_place=False)
+
+    assert len(ts2) == 1
+    assert TimeInterval(4.0, 7.0) == ts2[0]
+
+    # while intervals which only touch are not
+
+    ts1 = TimeIntervalSet([TimeInterval(4., 7.), TimeInterval(7., 9.)])
+
+    ts2 = ts1.merge_intersecting_intervals(in_place=False)
+
+    assert len(ts2) == 2
+
+
+
+def test_interval_set_from_arrays():
+
+    starts = np.arange(10000, dtype=float)
+    stops = starts + 1.5
+
+    ts1 = TimeIntervalSet.from_starts_and_stops(starts, stops)
+
+    assert len(ts1) == 10000
+    assert np.all(ts1.start_times == starts)
+
+    # the starts and the stops are returned as lists
+
+    assert isinstance(ts1.start_times, list)
+    assert isinstance(ts1.stop_times, list)
+    assert np.allclose(ts1.widths, 1.5)
+    assert np.allclose(ts1.mid_points, starts + 0.75)
+
+    # the interval objects are created when accessed
+
+    assert ts1[5] == TimeInterval(5.0, 6.5)
+
+    # all the intervals intersect with the next one
+
+    ts2 = ts1.merge_intersecting_intervals()
+
+    assert len(ts2) == 1
+    assert ts2[0] == TimeInterval(0.0, 10000.5)
+
+    with pytest.raises(RuntimeError):
+
+        TimeIntervalSet.from_starts_and_stops([0., 10.], [1., 5.])
+
+
+def test_interval_set_intersect():
+
+    ts1 = TimeIntervalSet.from_starts_and_stops([-10., 5., 30.], [0., 20., 40.])
+    ts2 = TimeIntervalSet.from_starts_and_stops([-5., 10., 15.], [7., 12., 35.])
+
+    ts3 = ts1.intersect(ts2)
+
+    assert len(ts3) == 5
+    assert ts3[0] == TimeInterval(-5., 0.)
+    assert ts3[1] == TimeInterval(5., 7.)
+    assert ts3[2] == TimeInterval(10., 12.)
+    assert ts3[3] == TimeInterval(15., 20.)
+    assert ts3[4] == TimeInterval(30., 35.)
+
+    # intervals which only touch do not intersect
+
+    ts4 = ts1.intersect(TimeIntervalSet.from_starts_and_stops([0.], [5.]))
+
+    assert len(ts4) == 0
 
 
 def test_interval_set_to_string():
@@ -481,10 +553,29 @@ def test_time_edges():
         _ = ts1.time_edges
 
 
+def test_good_time_intervals():
+
+    # unsorted and overlapping GTIs
+
+    gti = GoodTimeIntervals([20., 0., 5., 40.], [30., 10., 12., 40.])
+
+    assert len(gti) == 3
+
+    assert np.all(gti.starts == [0., 20., 40.])
+    assert np.all(gti.stops == [12., 30., 40.])
+
+    assert gti.contains(3.)
+    assert not gti.contains(15.)
 
+    times = np.array([-1., 0., 12., 12.5, 25., 40., 41.])
 
+    assert np.all(gti.contains(times) == [False, True, True, False, True, True, False])
 
+    assert np.all(gti.contains_intervals([1., 10., 29.], [2., 21., 30.]) == [True, False, True])
 
+    assert np.allclose(gti.duration_within([-5., 11., 0.], [5., 25., 100.]), [5., 6., 22.])
 
+    shifted = gti - 10.
 
+    assert np.all(shifted.starts == [-10., 10., 30.])
 
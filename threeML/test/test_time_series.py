@@ -4,7 +4,12 @@ import pytest
 from threeML.io.file_utils import within_directory
 from threeML.utils.time_interval import TimeIntervalSet
 from threeML.utils.time_series.event_list import EventListWithDeadTime, EventList
+from threeML.utils.time_series.polynomial import Polynomial, PolynomialSet, polyfit, unbinned_polyfit
+from threeML.utils.time_series.polynomial import batch_polyfit, batch_unbinned_polyfit
+from threeML.utils.time_series import time_series
 from threeML.utils.data_builders.time_series_builder import TimeSeriesBuilder
+from threeML.utils.data_builders.time_series_builder_set import TimeSeriesBuilderSet
+from threeML.utils.data_builders.fermi.gbm_data import GBMTTEFile
 from threeML.io.file_utils import within_directory
 from threeML.plugins.DispersionSpectrumLike import DispersionSpectrumLike
 from threeML.plugins.OGIPLike import OGIPLike
@@ -138,6 +143,76 @@ def test_read_gbm_cspec():
         nai3.write_pha_from_binner('test_from_nai3', start=0, stop=2, overwrite=True)
 
 
+def test_binned_spectrum_series_queries(monkeypatch):
+    with within_directory(datasets_directory):
+        data_dir = os.path.join('gbm', 'bn080916009')
+
+        nai3 = TimeSeriesBuilder.from_gbm_cspec_or_ctime('NAI3',
+                                                         os.path.join(data_dir, "glg_cspec_n3_bn080916009_v01.pha"),
+                                                         rsp_file=os.path.join(data_dir,
+                                                                               "glg_cspec_n3_bn080916009_v00.rsp2"),
+                                                         poly_order=-1)
+
+        series = nai3._time_series
+
+        time_intervals = series._binned_spectrum_set.time_intervals
+
+        counts_per_bin = series._binned_spectrum_set.counts_per_bin
+        exposure_per_bin = series._binned_spectrum_set.exposure_per_bin
+
+        starts = np.array([-100., -10.3, 0., 5.5, 60.])
+        stops = np.array([-50., 10.2, 0., 30., 300.])
+
+        counts = series.count_per_channel_over_intervals(starts, stops)
+        exposures = series.exposure_over_intervals(starts, stops)
+
+        for i, (start, stop) in enumerate(zip(starts, stops)):
+
+            # compare with a selection of the bins one by one
+
+            mask = time_intervals.containing_interval(start, stop, as_mask=True)
+
+            assert np.allclose(counts[i], counts_per_bin[mask].sum(axis=0))
+            assert np.isclose(exposures[i], exposure_per_bin[mask].sum())
+
+            assert np.isclose(series.counts_over_interval(start, stop), counts_per_bin[mask].sum())
+            assert np.array_equal(series._select_bins(start, stop), mask)
+
+        # the selections are moved to the closest bin edges
+
+        adjusted = series._adjust_to_true_intervals(TimeIntervalSet.from_starts_and_stops([-10.3], [10.2]))
+
+        true_starts = np.array(time_intervals.start_times)
+        true_stops = np.array(time_intervals.stop_times)
+
+        assert adjusted[0].start_time == true_starts[np.abs(true_starts + 10.3).argmin()]
+        assert adjusted[0].stop_time == true_stops[np.abs(true_stops - 10.2).argmin()]
+
+        # intersecting intervals count the bins only once
+
+        nai3.set_active_time_interval('0-10', '5-20')
+
+        mask = time_intervals.containing_interval(series.time_intervals[0].start_time,
+                                                  series.time_intervals[0].stop_time,
+                                                  as_mask=True)
+
+        assert np.allclose(series._counts, counts_per_bin[mask].sum(axis=0))
+        assert np.isclose(series._exposure, exposure_per_bin[mask].sum())
+
+        # the light curve of binned data is plotted with the duration of the bins as width
+
+        plotted = {}
+
+        monkeypatch.setattr(time_series, 'binned_light_curve_plot', lambda **kwargs: plotted.update(kwargs))
+
+        series.view_lightcurve(-10., 20.)
+
+        bins = time_intervals.containing_interval(-10., 20.)
+
+        assert np.allclose(plotted['width'], np.array(bins.stop_times) - np.array(bins.start_times))
+        assert np.allclose(plotted['cnts'], series.counts_over_intervals(bins.start_times, bins.stop_times))
+
+
 def test_read_gbm_tte():
     with within_directory(datasets_directory):
         data_dir = os.path.join('gbm', 'bn080916009')
@@ -231,6 +306,76 @@ def test_read_gbm_tte():
         nai3.write_pha_from_binner('test_from_nai3', overwrite=True)
 
 
+def test_read_gbm_tte_time_window():
+    with within_directory(datasets_directory):
+        data_dir = os.path.join('gbm', 'bn080916009')
+
+        tte_file = os.path.join(data_dir, "glg_tte_n3_bn080916009_v01.fit.gz")
+
+        full = GBMTTEFile(tte_file)
+
+        windowed = GBMTTEFile(tte_file, time_window=(full.trigger_time - 20, full.trigger_time + 50))
+
+        selection = np.logical_and(full.arrival_times >= full.trigger_time - 20,
+                                   full.arrival_times <= full.trigger_time + 50)
+
+        assert np.all(windowed.arrival_times == full.arrival_times[selection])
+
+        assert np.all(windowed.energies == full.energies[selection])
+
+        assert np.all(windowed.deadtime == full.deadtime[selection])
+
+        nai3 = TimeSeriesBuilder.from_gbm_tte('NAI3',
+                                              tte_file,
+                                              rsp_file=os.path.join(data_dir, "glg_cspec_n3_bn080916009_v00.rsp2"),
+                                              poly_order=-1,
+                                              time_window=(-20, 50))
+
+        assert np.isclose(nai3._time_series._start_time, -20)
+
+        assert np.isclose(nai3._time_series._stop_time, 50)
+
+
+def test_time_series_builder_set():
+    with within_directory(datasets_directory):
+        data_dir = os.path.join('gbm', 'bn080916009')
+
+        tte_file = os.path.join(data_dir, "glg_tte_n3_bn080916009_v01.fit.gz")
+        rsp_file = os.path.join(data_dir, "glg_cspec_n3_bn080916009_v00.rsp2")
+
+        # the same detector twice, as if it were two detectors
+
+        builders = TimeSeriesBuilderSet.from_gbm_tte(['NAI3', 'NAI3b'], [tte_file] * 2, [rsp_file] * 2,
+                                                     poly_order=-1, verbose=False)
+
+        assert builders.names == ['NAI3', 'NAI3b']
+
+        builders.set_background_interval('-200--10', '100-200')
+        builders.set_active_time_interval('0-10')
+
+        plugins = builders.to_spectrumlike()
+
+        assert len(plugins) == 2
+
+        assert [plugin.name for plugin in plugins] == ['NAI3', 'NAI3b']
+
+        # the bins are created on the reference detector and used for all the detectors
+
+        builders.create_time_bins(0, 10, method='significance', sigma=10, reference='NAI3')
+
+        reference = builders.get_builder('NAI3')
+
+        n_bins = len(reference.bins)
+
+        assert n_bins > 0
+
+        plugins = builders.to_spectrumlike(from_bins=True)
+
+        assert len(plugins) == 2 * n_bins
+
+        assert np.allclose(builders.get_builder('NAI3b').bins.bin_stack, reference.bins.bin_stack)
+
+
 def test_reading_of_written_pha():
     with within_directory(datasets_directory):
         # check the number of items written
@@ -289,3 +434,77 @@ def test_read_lle():
         assert new_errors == old_errors
 
         assert old_tmin_list == new_tmin_list
+
+
+def test_polynomial_set():
+
+    np.random.seed(1234)
+
+    polynomials = []
+
+    for degree in [0, 2, 1]:
+
+        coefficients = np.random.uniform(0.1, 1, degree + 1)
+
+        covariance = np.random.normal(size=(degree + 1, degree + 1))
+
+        polynomials.append(Polynomial.from_previous_fit(coefficients, covariance.dot(covariance.T)))
+
+    polynomial_set = PolynomialSet(polynomials)
+
+    assert len(polynomial_set) == 3
+
+    starts = np.array([-5., 0., 10.])
+    stops = np.array([-1., 2.5, 30.])
+
+    integrals = polynomial_set.integral(starts, stops)
+    integral_errors = polynomial_set.integral_error(starts, stops)
+    values = polynomial_set(starts)
+
+    for j, poly in enumerate(polynomials):
+
+        for i, (start, stop) in enumerate(zip(starts, stops)):
+
+            assert np.isclose(integrals[i, j], poly.integral(start, stop))
+            assert np.isclose(integral_errors[i, j], poly.integral_error(start, stop))
+            assert np.isclose(values[i, j], poly(start))
+
+
+def test_batch_fit_reduced_grade():
+
+    np.random.seed(1234)
+
+    # a well sampled channel and sparse channels, which have too few degrees of freedom for the grade
+
+    x = np.linspace(-10., 50., 60)
+    exposure = np.ones_like(x)
+
+    counts = np.vstack([np.random.poisson(20 + 0.1 * x),
+                        np.append(np.zeros(57), [1, 2, 1]),
+                        np.zeros(60)])
+
+    coefficients, covariances, _ = batch_polyfit(x, counts, 2, exposure)
+
+    polynomial, _ = polyfit(x, counts[1], 2, exposure)
+
+    # the sparse channel gets the constant of the scalar fit
+
+    assert polynomial.degree == 0
+    assert np.isclose(coefficients[1, 0], polynomial.coefficients[0], rtol=1e-2)
+    assert np.all(coefficients[1, 1:] == 0)
+    assert np.all(covariances[1, 1:, :] == 0)
+
+    # while the others are fitted as before
+
+    assert np.all(coefficients[0, 1:] != 0)
+    assert np.all(coefficients[2] == 0)
+
+    events = [np.sort(np.random.uniform(0, 10, 200)), np.array([3., 4., 5., 6.])]
+
+    coefficients, covariances, _ = batch_unbinned_polyfit(events, 3, np.array([0.]), np.array([10.]), 10.)
+
+    polynomial, _ = unbinned_polyfit(events[1], 3, np.array([0.]), np.array([10.]), 10.)
+
+    assert polynomial.degree == 0
+    assert np.isclose(coefficients[1, 0], polynomial.coefficients[0], rtol=1e-2)
+    assert np.all(coefficients[1, 1:] == 0)
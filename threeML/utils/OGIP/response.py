@@ -4,7 +4,8 @@ import warnings
 import matplotlib.cm as cm
 from matplotlib.colors import SymLogNorm
 import matplotlib.pyplot as plt
-from operator import itemgetter, attrgetter
+from operator import itemgetter
+import collections
 import copy
 
 import astropy.units as u
@@ -29,6 +30,10 @@ class IntervalOfInterestNotCovered(RuntimeError):
 class GapInCoverageIntervals(RuntimeError):
     pass
 
+# Maximum number of weighted matrices kept by an InstrumentResponseSet
+
+_WEIGHTED_MATRIX_CACHE_SIZE = 100
+
 class InstrumentResponse(object):
 
     def __init__(self, matrix, ebounds, monte_carlo_energies, coverage_interval=None):
@@ -597,7 +602,7 @@ class InstrumentResponseSet(object):
     A set of responses
 
     """
-    def __init__(self, matrix_list, exposure_getter, counts_getter, reference_time=0.0):
+    def __init__(self, matrix_list, exposure_getter, counts_getter, reference_time=0.0, vectorized_getters=False):
         """
 
         :param matrix_list:
@@ -608,23 +613,26 @@ class InstrumentResponseSet(object):
         weight_by_* methods. Use this if you want to express the time intervals in time units from the reference_time,
         instead of "absolute" time. For GRBs, this is the trigger time. NOTE: if you use a reference time, the
         counts_getter and the exposure_getter must accept times relative to the reference time.
+        :param vectorized_getters : (default: False) if True, the exposure_getter and the counts_getter accept arrays
+        of start and stop times and return an array with the exposure (or counts) of each interval
         """
 
         # Store list of matrices
 
         self._matrix_list = list(matrix_list)  # type: list[InstrumentResponse]
 
-        # Create the corresponding list of coverage intervals
-
-        self._coverage_intervals = TimeIntervalSet(map(lambda x: x.coverage_interval,
-                                                       self._matrix_list))
-
         # Make sure that all matrices have coverage interval set
 
-        if None in self._coverage_intervals:
+        coverage_intervals = map(lambda x: x.coverage_interval, self._matrix_list)
+
+        if None in coverage_intervals:
 
             raise NoCoverageIntervals("You need to specify the coverage interval for all matrices in the matrix_list")
 
+        # Create the corresponding list of coverage intervals
+
+        self._coverage_intervals = TimeIntervalSet(coverage_intervals)
+
         # Remove from the list matrices that cover intervals of zero duration (yes, the GBM publishes those too,
         # one example is in data/ogip_test_gbm_b0.rsp2)
         to_be_removed = []
@@ -665,12 +673,27 @@ class InstrumentResponseSet(object):
         # Apply the reference time shift, if any
         self._coverage_intervals -= reference_time
 
+        # Store the edges of the coverage intervals, to find the matrices covering many intervals at once
+
+        self._coverage_starts = np.array(self._coverage_intervals.start_times)
+        self._coverage_stops = np.array(self._coverage_intervals.stop_times)
+
+        # Stack the matrices once, so that weighting them is a single tensor product
+
+        self._matrix_stack = np.array([matrix.matrix for matrix in self._matrix_list])
+
+        # Weighted matrices already computed, by (normalized) weights
+
+        self._weighted_matrix_cache = collections.OrderedDict()
+
         # Store callable
 
         self._exposure_getter = exposure_getter  # type: callable
 
         self._counts_getter = counts_getter  # type: callable
 
+        self._vectorized_getters = bool(vectorized_getters)
+
         # Store reference time
 
         self._reference_time = float(reference_time)
@@ -689,7 +712,8 @@ class InstrumentResponseSet(object):
         return len(self._matrix_list)
 
     @classmethod
-    def from_rsp2_file(cls, rsp2_file, exposure_getter, counts_getter, reference_time=0.0, half_shifted=True):
+    def from_rsp2_file(cls, rsp2_file, exposure_getter, counts_getter, reference_time=0.0, half_shifted=True,
+                       vectorized_getters=False):
 
         # This assumes the Fermi/GBM rsp2 file format
 
@@ -742,7 +766,8 @@ class InstrumentResponseSet(object):
                                                                       this_matrix.coverage_interval.half_time)
 
 
-        return InstrumentResponseSet(list_of_matrices, exposure_getter, counts_getter, reference_time)
+        return InstrumentResponseSet(list_of_matrices, exposure_getter, counts_getter, reference_time,
+                                     vectorized_getters=vectorized_getters)
 
     # I didn't re-implement this at the moment
     # def _display_response_weighting(self, weights, tstarts, tstops):
@@ -771,26 +796,88 @@ class InstrumentResponseSet(object):
 
         return self._get_weighted_matrix("counts", *intervals)
 
+    def weight_intervals_by_exposure(self, starts, stops):
+        """
+        Get one response for each of the given intervals, weighting the matrices by exposure
+
+        :param starts: the start times of the intervals
+        :param stops: the stop times of the intervals
+        :return: a list of InstrumentResponse instances
+        """
+
+        return self._get_weighted_matrices("exposure", starts, stops)
+
+    def weight_intervals_by_counts(self, starts, stops):
+        """
+        Get one response for each of the given intervals, weighting the matrices by counts
+
+        :param starts: the start times of the intervals
+        :param stops: the stop times of the intervals
+        :return: a list of InstrumentResponse instances
+        """
+
+        return self._get_weighted_matrices("counts", starts, stops)
+
     def _get_weighted_matrix(self, switch, *intervals):
 
         assert len(intervals) > 0, "You have to provide at least one interval"
 
         intervals_set = TimeIntervalSet.from_strings(*intervals)
 
-        # Compute a set of weights for each interval
-        weights = np.zeros(len(self._matrix_list))
+        # Compute a set of weights for each interval and sum them
+
+        weights = self._weight_responses(intervals_set.start_times, intervals_set.stop_times, switch).sum(axis=0)
+
+        return self._weighted_responses(weights[np.newaxis, :])[0]
+
+    def _get_weighted_matrices(self, switch, starts, stops):
+
+        starts = np.atleast_1d(np.asarray(starts, dtype=float))
+        stops = np.atleast_1d(np.asarray(stops, dtype=float))
 
-        for interval in intervals_set:
+        assert starts.shape == stops.shape, "starts and stops must have the same length"
 
-            weights += self._weight_response(interval, switch)
+        assert starts.shape[0] > 0, "You have to provide at least one interval"
+
+        return self._weighted_responses(self._weight_responses(starts, stops, switch))
+
+    def _weighted_responses(self, weights):
+        """
+        Build the responses for a set of weights
+
+        :param weights: (n_responses x n_matrices) array of weights (not normalized)
+        :return: a list of InstrumentResponse instances
+        """
 
         # Normalize to 1
-        weights /= np.sum(weights)
+        weights = weights / weights.sum(axis=1)[:, np.newaxis]
+
+        keys = [row.tobytes() for row in weights]
+
+        # compute only the matrices for weights we have not seen before (intervals within the same
+        # matrix all have the same weights), all at once
+
+        new_rows = []
+        new_keys = set()
+
+        for i, key in enumerate(keys):
+
+            if key not in self._weighted_matrix_cache and key not in new_keys:
 
-        # Weight matrices
-        matrix = np.dot(np.array(map(attrgetter("matrix"), self._matrix_list)).T, weights.T).T
+                new_rows.append(i)
+                new_keys.add(key)
 
-        # Now generate the instance of the response
+        new_matrices = {}
+
+        if new_rows:
+
+            # (n_new, n_matrices) x (n_matrices, n_channels, n_mc_energies)
+
+            matrices = np.tensordot(weights[new_rows], self._matrix_stack, axes=(1, 0))
+
+            for i, matrix in zip(new_rows, matrices):
+
+                new_matrices[keys[i]] = matrix
 
         # get EBOUNDS from the first matrix
         ebounds = self._matrix_list[0].ebounds
@@ -798,17 +885,51 @@ class InstrumentResponseSet(object):
         # Get mc channels from the first matrix
         mc_channels = self._matrix_list[0].monte_carlo_energies
 
-        matrix_instance = InstrumentResponse(matrix, ebounds, mc_channels)
+        responses = []
+
+        for key in keys:
+
+            if key in new_matrices:
+
+                matrix = new_matrices[key]
+
+            else:
+
+                matrix = self._weighted_matrix_cache.pop(key)
+
+            # (re)insert as the most recently used
+
+            self._weighted_matrix_cache[key] = matrix
+
+            # Now generate the instance of the response (which copies the matrix)
+
+            responses.append(InstrumentResponse(matrix, ebounds, mc_channels))
 
-        return matrix_instance
+        while len(self._weighted_matrix_cache) > _WEIGHTED_MATRIX_CACHE_SIZE:
+
+            self._weighted_matrix_cache.popitem(last=False)
+
+        return responses
 
     def _weight_response(self, interval_of_interest, switch):
 
         """
 
-        :param interval_start : start time of the interval
-        :param interval_stop : stop time of the interval
+        :param interval_of_interest : the interval of interest
+        :param switch: either 'counts' or 'exposure'
+
+        """
+
+        return self._weight_responses([interval_of_interest.start_time], [interval_of_interest.stop_time], switch)[0]
+
+    def _weight_responses(self, starts, stops, switch):
+
+        """
+
+        :param starts : start times of the intervals
+        :param stops : stop times of the intervals
         :param switch: either 'counts' or 'exposure'
+        :return: (n_intervals x n_matrices) array of weights
 
         """
 
@@ -817,85 +938,96 @@ class InstrumentResponseSet(object):
         # more than one interval
         #######################
 
-        # Now mark all responses which overlap with the interval of interest
-        # NOTE: this is a mask of the same length as _matrix_list and _coverage_intervals
+        starts = np.asarray(starts, dtype=float)
+        stops = np.asarray(stops, dtype=float)
 
-        matrices_mask = map(lambda c_i: c_i.overlaps_with(interval_of_interest), self._coverage_intervals)
+        n_intervals = starts.shape[0]
+
+        # The coverage intervals are sorted and contiguous, so the matrices overlapping with each interval of
+        # interest are a range: the ones stopping after its start and starting before its stop
+
+        lows = np.searchsorted(self._coverage_stops, starts, side='right')
+        highs = np.searchsorted(self._coverage_starts, stops, side='left')
+
+        n_matrices = np.maximum(highs - lows, 0)
 
         # Check that we have at least one matrix
 
-        if not np.any(matrices_mask):
+        no_matrix = n_matrices == 0
+
+        if np.any(no_matrix):
+
+            interval_of_interest = TimeInterval(starts[no_matrix][0], stops[no_matrix][0])
 
             raise NoMatrixForInterval("Could not find any matrix applicable to %s\n Have intervals:%s" % (interval_of_interest,', '.join([str(interval) for interval in self._coverage_intervals]) ))
 
-        # Compute the weights
+        # List all the (interval, matrix) pairs. For each of them, the "effective interval" is how much of the
+        # coverage interval is really used for the interval of interest
 
-        weights = np.empty_like(self._matrix_list, float)
+        interval_idx = np.repeat(np.arange(n_intervals), n_matrices)
 
-        # These "effective intervals" are how much of the coverage interval is really used for each matrix
-        # NOTE: the length of effective_intervals list *will not be* the same as the weight mask or the matrix_list.
-        # There are as many effective intervals as matrices with weight > 0
+        first_pair = np.cumsum(n_matrices) - n_matrices
 
-        effective_intervals = []
+        matrix_idx = lows[interval_idx] + np.arange(interval_idx.shape[0]) - first_pair[interval_idx]
 
-        for i, matrix in enumerate(self._matrix_list):
+        effective_starts = np.maximum(self._coverage_starts[matrix_idx], starts[interval_idx])
+        effective_stops = np.minimum(self._coverage_stops[matrix_idx], stops[interval_idx])
 
-            if matrices_mask[i]:
+        # Check that the first matrix has an effective interval starting at the beginning of the interval of
+        # interest and the last one has an effective interval stopping at its end (otherwise it means that part of
+        # the interval of interest is not covered!)
 
-                # A matrix of interest
-                this_coverage_interval = self._coverage_intervals[i]
+        last_pair = first_pair + n_matrices - 1
 
-                # See how much it overlaps with the interval of interest
-                this_effective_interval = this_coverage_interval.intersect(interval_of_interest)
+        not_covered = (effective_starts[first_pair] != starts) | (effective_stops[last_pair] != stops)
 
-                effective_intervals.append(this_effective_interval)
+        if np.any(not_covered):
 
-                # Now compute the weight
+            i = np.argmax(not_covered)
 
-                if switch == 'counts':
+            raise IntervalOfInterestNotCovered('The interval of interest (%s) is not covered by %s' %
+                                               (TimeInterval(starts[i], stops[i]),
+                                                TimeInterval(effective_starts[first_pair[i]],
+                                                             effective_stops[first_pair[i]])))
 
-                    # Weight according to the number of events
-                    weights[i] = self._counts_getter(this_effective_interval.start_time,
-                                                     this_effective_interval.stop_time)
+        # Lastly, check that there is no interruption in coverage (bad time intervals are *not* supported)
 
-                elif switch == 'exposure':
+        same_interval = interval_idx[1:] == interval_idx[:-1]
 
-                    # Weight according to the exposure
-                    weights[i] = self._exposure_getter(this_effective_interval.start_time,
-                                                       this_effective_interval.stop_time)
+        if not np.all(effective_stops[:-1][same_interval] == effective_starts[1:][same_interval]):
 
-            else:
+            raise GapInCoverageIntervals("Gap in coverage! Bad time intervals are not supported!")
 
-                # Uninteresting matrix
-                weights[i] = 0.0
+        # Now compute the weights
 
-        # if all weights are zero, there is something clearly wrong with the exposure or the counts computation
-        assert np.sum(weights) > 0, "All weights are zero. There must be a bug in the exposure or counts computation"
+        if switch == 'counts':
+
+            # Weight according to the number of events
+            getter = self._counts_getter
 
-        # Check that the first matrix with weight > 0 has an effective interval starting at the beginning of
-        # the interval of interest (otherwise it means that part of the interval of interest is not covered!)
+        elif switch == 'exposure':
 
-        if effective_intervals[0].start_time != interval_of_interest.start_time:
+            # Weight according to the exposure
+            getter = self._exposure_getter
 
-            raise IntervalOfInterestNotCovered('The interval of interest (%s) is not covered by %s'% (interval_of_interest,effective_intervals[0]))
+        else:
 
-        # Check that the last matrix with weight > 0 has an effective interval starting at the beginning of
-        # the interval of interest (otherwise it means that part of the interval of interest is not covered!)
+            raise ValueError("switch must be either 'counts' or 'exposure'")
 
-        if effective_intervals[-1].stop_time != interval_of_interest.stop_time:
-            raise IntervalOfInterestNotCovered(
-                'The interval of interest (%s) is not covered by %s' % (interval_of_interest, effective_intervals[0]))
+        if self._vectorized_getters:
 
+            pair_weights = np.asarray(getter(effective_starts, effective_stops), dtype=float)
 
-        # Lastly, check that there is no interruption in coverage (bad time intervals are *not* supported)
-        all_tstarts = np.array(map(lambda x:x.start_time, effective_intervals))
-        all_tstops = np.array(map(lambda x:x.stop_time, effective_intervals))
+        else:
 
-        if not np.all((all_tstops[:-1] == all_tstarts[1:])):
+            pair_weights = np.array([getter(t1, t2) for t1, t2 in zip(effective_starts, effective_stops)], dtype=float)
 
-            raise GapInCoverageIntervals("Gap in coverage! Bad time intervals are not supported!")
+        weights = np.zeros((n_intervals, len(self._matrix_list)))
 
+        weights[interval_idx, matrix_idx] = pair_weights
 
+        # if all weights are zero, there is something clearly wrong with the exposure or the counts computation
+        assert np.all(weights.sum(axis=1) > 0), "All weights are zero. There must be a bug in the exposure or counts computation"
 
         return weights
 
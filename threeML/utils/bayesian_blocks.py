@@ -3,145 +3,277 @@
 import logging
 import sys
 
-import numexpr
 import numpy as np
 
-from threeML.io.progress_bar import progress_bar
+# The optimal partition can be computed by a compiled kernel if numba is available,
+# otherwise a (slower) numpy version is used
+
+try:
+
+    from numba import njit
+
+except ImportError:
+
+    has_numba = False
+
+else:
+
+    has_numba = True
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("bayesian_blocks")
 
-__all__ = ['bayesian_blocks', 'bayesian_blocks_not_unique']
+__all__ = ['bayesian_blocks', 'bayesian_blocks_not_unique', 'bayesian_blocks_binned']
 
 
-def bayesian_blocks_not_unique(tt, ttstart, ttstop, p0):
-    # Verify that the input array is one-dimensional
-    tt = np.asarray(tt, dtype=float)
+def _optimal_partition_loop(block_length, cumulative_counts, priors, prune):
+    """
+    The Scargle et al. 2012 recursion written as explicit loops, so that it can be compiled by numba.
+
+    The candidate start cells are kept in an array. If prune is True, the candidates which can never
+    start the last block of the optimal partition are removed at each step (this is the pruning of
+    Killick et al. 2012, which is exact because the fitness of a block is never larger than the sum of
+    the fitness of two sub-blocks), so that the cost of each step is proportional to the number of
+    surviving candidates instead of to the number of cells.
+
+    :param block_length: distance of each cell edge from the stop time (n_cells + 1)
+    :param cumulative_counts: cumulative counts of the cells with a leading zero (n_cells + 1)
+    :param priors: the prior for each step (n_cells)
+    :param prune: whether to prune the candidates
+    :return: the start cell of the last block of the optimal partition ending at each cell
+    """
 
-    assert tt.ndim == 1
+    n_cells = block_length.shape[0] - 1
 
-    # Now create the array of unique times
+    best = np.zeros(n_cells + 1)
+    last = np.zeros(n_cells, dtype=np.int64)
 
-    unique_t = np.unique(tt)
+    candidates = np.zeros(n_cells, dtype=np.int64)
+    values = np.zeros(n_cells)
 
-    t = tt
-    tstart = ttstart
-    tstop = ttstop
+    n_candidates = 0
 
-    # Create initial cell edges (Voronoi tessellation) using the unique time stamps
+    for R in range(n_cells):
 
-    edges = np.concatenate([[tstart],
-                            0.5 * (unique_t[1:] + unique_t[:-1]),
-                            [tstop]])
+        candidates[n_candidates] = R
+        n_candidates += 1
 
-    # The last block length is 0 by definition
-    block_length = tstop - edges
+        br = block_length[R + 1]
+        cr = cumulative_counts[R + 1]
 
-    if np.sum((block_length <= 0)) > 1:
-        raise RuntimeError("Events appears to be out of order! Check for order, or duplicated events.")
+        best_value = -np.inf
+        best_k = 0
 
-    N = unique_t.shape[0]
+        for c in range(n_candidates):
 
-    # arrays to store the best configuration
-    best = np.zeros(N, dtype=float)
-    last = np.zeros(N, dtype=int)
+            k = candidates[c]
 
-    # Pre-computed priors (for speed)
-    # eq. 21 from Scargle 2012
+            N_k = cr - cumulative_counts[k]
+            T_k = block_length[k] - br
 
-    priors = 4 - np.log(73.53 * p0 * np.power(np.arange(1, N + 1), -0.478))
+            if N_k > 0:
 
-    # Count how many events are in each Voronoi cell
+                fitness = N_k * np.log(N_k / T_k)
 
-    x, _ = np.histogram(t, edges)
+            else:
+
+                fitness = 0.
+
+            # best[k] is the value of the optimal partition of the cells before k
+
+            value = fitness + best[k]
+
+            values[c] = value
+
+            if value > best_value:
+
+                best_value = value
+                best_k = k
+
+        best[R + 1] = best_value - priors[R]
+        last[R] = best_k
+
+        if prune:
+
+            # a candidate which is already worse than the optimal partition
+            # (without the penalty of the new block) can never recover
+
+            threshold = best[R + 1]
+
+            n_kept = 0
+
+            for c in range(n_candidates):
+
+                if values[c] > threshold:
+
+                    candidates[n_kept] = candidates[c]
+                    n_kept += 1
+
+            n_candidates = n_kept
+
+    return last
+
+
+def _optimal_partition_numpy(block_length, cumulative_counts, priors, prune):
+    """
+    Same as _optimal_partition_loop, with the inner loop over the candidates
+    replaced by array operations.
+    """
+
+    n_cells = block_length.shape[0] - 1
+
+    best = np.zeros(n_cells + 1)
+    last = np.zeros(n_cells, dtype=np.int64)
+
+    all_cells = np.arange(n_cells, dtype=np.int64)
+
+    candidates = all_cells[:0]
 
     # Speed tricks: resolve once for all the functions which will be used
     # in the loop
-    cumsum = np.cumsum
     log = np.log
-    argmax = np.argmax
-    numexpr_evaluate = numexpr.evaluate
-    arange = np.arange
+    where = np.where
+    append = np.append
 
-    # Decide the step for reporting progress
-    incr = max(int(float(N) / 100.0 * 10), 1)
+    for R in range(n_cells):
 
-    logger.debug("Finding blocks...")
+        if prune:
+
+            candidates = append(candidates, R)
+
+        else:
+
+            candidates = all_cells[:R + 1]
+
+        N_k = cumulative_counts[R + 1] - cumulative_counts[candidates]
+        T_k = block_length[candidates] - block_length[R + 1]
+
+        # blocks without counts have zero fitness
+
+        with np.errstate(divide='ignore', invalid='ignore'):
 
-    # This is where the computation happens. Following Scargle et al. 2012.
-    # This loop has been optimized for speed:
-    # * the expression for the fitness function has been rewritten to
-    #  avoid multiple log computations, and to avoid power computations
-    # * the use of scipy.weave and numexpr has been evaluated. The latter
-    #  gives a big gain (~40%) if used for the fitness function. No other
-    #  gain is obtained by using it anywhere else
+            fitness = where(N_k > 0, N_k * log(N_k / T_k), 0.)
 
-    # Set numexpr precision to low (more than enough for us), which is
-    # faster than high
-    oldaccuracy = numexpr.set_vml_accuracy_mode('low')
-    numexpr.set_num_threads(1)
-    numexpr.set_vml_num_threads(1)
+        values = fitness + best[candidates]
 
-    with progress_bar(N) as progress:
+        i_max = values.argmax()
 
-        for R in range(N):
-            br = block_length[R + 1]
-            T_k = block_length[:R + 1] - br
+        last[R] = candidates[i_max]
+        best[R + 1] = values[i_max] - priors[R]
 
-            # N_k: number of elements in each block
-            # This expression has been simplified for the case of
-            # unbinned events (i.e., one element in each block)
-            # It was:
-            N_k = cumsum(x[:R + 1][::-1])[::-1]
-            # Now it is:
-            # N_k = arange(R + 1, 0, -1)
+        if prune:
 
-            # Evaluate fitness function
-            # This is the slowest part, which I'm speeding up by using
-            # numexpr. It provides a ~40% gain in execution speed.
+            candidates = candidates[values > best[R + 1]]
 
-            fit_vec = numexpr_evaluate('''N_k * log(N_k/ T_k) ''',
-                                       optimization='aggressive',
-                                       local_dict={'N_k': N_k, 'T_k': T_k})
+    return last
 
-            p = priors[R]
 
-            A_R = fit_vec - p
+if has_numba:
 
-            A_R[1:] += best[:R]
+    _optimal_partition_compiled = njit(_optimal_partition_loop)
 
-            i_max = argmax(A_R)
 
-            last[R] = i_max
-            best[R] = A_R[i_max]
+def _find_change_points(cell_edges, cell_counts, tstop, priors, prune=True):
+    """
+    Find the optimal partition of a set of cells in blocks of constant rate.
+
+    This needs O(n_cells) memory. The time is O(n_cells^2) in the worst case, but with pruning it is
+    much less when there are many blocks.
+
+    :param cell_edges: the edges of the cells (n_cells + 1)
+    :param cell_counts: the counts in each cell (n_cells)
+    :param tstop: the stop time
+    :param priors: the prior (a number, or an array with one prior for each step)
+    :param prune: whether to prune the candidate change points
+    :return: the indices of the edges of the blocks in cell_edges
+    """
+
+    n_cells = cell_counts.shape[0]
+
+    block_length = np.asarray(tstop - cell_edges, dtype=float)
 
-            progress.increase()
+    cumulative_counts = np.zeros(n_cells + 1)
+    np.cumsum(cell_counts, out=cumulative_counts[1:])
 
-    numexpr.set_vml_accuracy_mode(oldaccuracy)
+    priors = np.ones(n_cells) * priors
+
+    logger.debug("Finding blocks...")
+
+    if has_numba:
+
+        last = _optimal_partition_compiled(block_length, cumulative_counts, priors, prune)
+
+    else:
+
+        last = _optimal_partition_numpy(block_length, cumulative_counts, priors, prune)
 
     logger.debug("Done\n")
 
-    # Now find blocks
-    change_points = np.zeros(N, dtype=int)
-    i_cp = N
-    ind = N
+    # Now peel off and find the blocks (see the algorithm in Scargle et al.)
+    change_points = np.zeros(n_cells + 1, dtype=int)
+    i_cp = n_cells + 1
+    ind = n_cells
+
     while True:
+
         i_cp -= 1
+
         change_points[i_cp] = ind
 
         if ind == 0:
+
             break
 
         ind = last[ind - 1]
 
-    change_points = change_points[i_cp:]
+    return change_points[i_cp:]
+
+
+def bayesian_blocks_not_unique(tt, ttstart, ttstop, p0, prune=True):
+    # Verify that the input array is one-dimensional
+    tt = np.asarray(tt, dtype=float)
+
+    assert tt.ndim == 1
+
+    # Now create the array of unique times
+
+    unique_t = np.unique(tt)
+
+    t = tt
+    tstart = ttstart
+    tstop = ttstop
+
+    # Create initial cell edges (Voronoi tessellation) using the unique time stamps
+
+    edges = np.concatenate([[tstart],
+                            0.5 * (unique_t[1:] + unique_t[:-1]),
+                            [tstop]])
+
+    # The last block length is 0 by definition
+    block_length = tstop - edges
+
+    if np.sum((block_length <= 0)) > 1:
+        raise RuntimeError("Events appears to be out of order! Check for order, or duplicated events.")
+
+    N = unique_t.shape[0]
+
+    # Pre-computed priors (for speed)
+    # eq. 21 from Scargle 2012
+
+    priors = 4 - np.log(73.53 * p0 * np.power(np.arange(1, N + 1), -0.478))
+
+    # Count how many events are in each Voronoi cell
+
+    x, _ = np.histogram(t, edges)
+
+    change_points = _find_change_points(edges, x, tstop, priors, prune)
 
     finalEdges = edges[change_points]
 
     return np.asarray(finalEdges)
 
 
-def bayesian_blocks(tt, ttstart, ttstop, p0, bkg_integral_distribution=None):
+def bayesian_blocks(tt, ttstart, ttstop, p0, bkg_integral_distribution=None, prune=True):
     """
     Divide a series of events characterized by their arrival time in blocks
     of perceptibly constant count rate. If the background integral distribution
@@ -155,6 +287,8 @@ def bayesian_blocks(tt, ttstart, ttstop, p0, bkg_integral_distribution=None):
     parameter affects the number of blocks
     :param bkg_integral_distribution: (default: None) If given, the algorithm account for the presence of the background and
     finds changes in rate with respect to the background
+    :param prune: (default: True) prune the candidate change points during the search. This gives the same blocks
+    but is much faster for long event lists
     :return: the np.array containing the edges of the blocks
     """
 
@@ -191,11 +325,6 @@ def bayesian_blocks(tt, ttstart, ttstop, p0, bkg_integral_distribution=None):
                              0.5 * (tt[1:] + tt[:-1]),
                              [tt[-1]]])
 
-
-    # Create a lookup table to be able to transform back from the transformed system
-    # to the original one
-    lookup_table = {key: value for (key, value) in zip(edges, edges_)}
-
     # The last block length is 0 by definition
     block_length = tstop - edges
 
@@ -205,117 +334,72 @@ def bayesian_blocks(tt, ttstart, ttstop, p0, bkg_integral_distribution=None):
 
     N = t.shape[0]
 
-    # arrays to store the best configuration
-    best = np.zeros(N, dtype=float)
-    last = np.zeros(N, dtype=int)
-
     # eq. 21 from Scargle 2012
     prior = 4 - np.log(73.53 * p0 * (N**-0.478))
 
-    logger.debug("Finding blocks...")
-
-    # This is where the computation happens. Following Scargle et al. 2012.
-    # This loop has been optimized for speed:
-    # * the expression for the fitness function has been rewritten to
-    #  avoid multiple log computations, and to avoid power computations
-    # * the use of scipy.weave and numexpr has been evaluated. The latter
-    #  gives a big gain (~40%) if used for the fitness function. No other
-    #  gain is obtained by using it anywhere else
+    # each cell contains one event
 
-    # Set numexpr precision to low (more than enough for us), which is
-    # faster than high
-    oldaccuracy = numexpr.set_vml_accuracy_mode('low')
-    numexpr.set_num_threads(1)
-    numexpr.set_vml_num_threads(1)
+    change_points = _find_change_points(edges, np.ones(N), tstop, prior, prune)
 
-    # Speed tricks: resolve once for all the functions which will be used
-    # in the loop
-    numexpr_evaluate = numexpr.evaluate
-    numexpr_re_evaluate = numexpr.re_evaluate
+    # Transform the found edges back into the original time system. The edges
+    # correspond one to one, so we can simply use the same indices
 
-    # Pre-compute this
+    final_edges = edges_[change_points]
 
-    aranges = np.arange(N+1, 0, -1)
-
-    for R in range(N):
-        br = block_length[R + 1]
-        T_k = block_length[:R + 1] - br  # this looks like it is not used, but it actually is,
-                                         # inside the numexpr expression
-
-        # N_k: number of elements in each block
-        # This expression has been simplified for the case of
-        # unbinned events (i.e., one element in each block)
-        # It was:
-        #N_k = cumsum(x[:R + 1][::-1])[::-1]
-        # Now it is:
-        N_k = aranges[N - R:]
-        # where aranges has been pre-computed
-
-        # Evaluate fitness function
-        # This is the slowest part, which I'm speeding up by using
-        # numexpr. It provides a ~40% gain in execution speed.
-
-        # The first time we need to "compile" the expression in numexpr,
-        # all the other times we can reuse it
-
-        if R == 0:
-
-            fit_vec = numexpr_evaluate('''N_k * log(N_k/ T_k) ''',
-                                       optimization='aggressive', local_dict={'N_k': N_k, 'T_k': T_k})
-
-        else:
-
-            fit_vec = numexpr_re_evaluate(local_dict={'N_k': N_k, 'T_k': T_k})
-
-        A_R = fit_vec - prior  # type: np.ndarray
-
-        A_R[1:] += best[:R]
-
-        i_max = A_R.argmax()
-
-        last[R] = i_max
-        best[R] = A_R[i_max]
+    # Now fix the first and last edge so that they are tstart and tstop
+    final_edges[0] = ttstart
+    final_edges[-1] = ttstop
 
-    numexpr.set_vml_accuracy_mode(oldaccuracy)
+    return np.asarray(final_edges)
 
-    logger.debug("Done\n")
 
-    # Now peel off and find the blocks (see the algorithm in Scargle et al.)
-    change_points = np.zeros(N, dtype=int)
-    i_cp = N
-    ind = N
+def bayesian_blocks_binned(edges, counts, p0, bkg_integral_distribution=None, prune=True):
+    """
+    Divide binned counts (for example the light curve of a pre-binned time series) in blocks of perceptibly
+    constant count rate. The blocks are made of whole bins. If the background integral distribution
+    is given, divide the series in blocks where the difference with respect to the background is
+    perceptibly constant.
 
-    while True:
+    :param edges: the edges of the bins (n_bins + 1)
+    :param counts: the counts in each bin (n_bins)
+    :param p0: the false positive probability. This is used to decide the penalization on the likelihood, so this
+    parameter affects the number of blocks
+    :param bkg_integral_distribution: (default: None) If given, the algorithm account for the presence of the background and
+    finds changes in rate with respect to the background
+    :param prune: (default: True) prune the candidate change points during the search
+    :return: the np.array containing the edges of the blocks
+    """
 
-        i_cp -= 1
+    edges = np.asarray(edges, dtype=float)
+    counts = np.asarray(counts, dtype=float)
 
-        change_points[i_cp] = ind
+    assert edges.ndim == 1 and counts.ndim == 1
 
-        if ind == 0:
+    assert edges.shape[0] == counts.shape[0] + 1, "there must be one more edge than bins"
 
-            break
+    if bkg_integral_distribution is not None:
 
-        ind = last[ind - 1]
+        # transform the time axis as for the unbinned case
+        t = np.array(bkg_integral_distribution(edges), dtype=float)
 
-    change_points = change_points[i_cp:]
+    else:
 
-    edg = edges[change_points]
+        t = edges
 
-    # Transform the found edges back into the original time system
+    if np.any(np.diff(t) <= 0):
 
-    if (bkg_integral_distribution is not None):
+        raise RuntimeError("The bin edges must be increasing!")
 
-        final_edges = map(lambda x: lookup_table[x], edg)
+    N = counts.shape[0]
 
-    else:
+    # eq. 21 from Scargle 2012
+    prior = 4 - np.log(73.53 * p0 * (N ** -0.478))
 
-        final_edges = edg
+    change_points = _find_change_points(t, counts, t[-1], prior, prune)
 
-    # Now fix the first and last edge so that they are tstart and tstop
-    final_edges[0] = ttstart
-    final_edges[-1] = ttstop
+    # the edges in the transformed system correspond one to one to the original ones
 
-    return np.asarray(final_edges)
+    return edges[change_points]
 
 
 # To be run with a profiler
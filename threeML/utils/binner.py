@@ -1,7 +1,7 @@
 import numpy as np
 
 from threeML.io.progress_bar import progress_bar
-from threeML.utils.bayesian_blocks import bayesian_blocks, bayesian_blocks_not_unique
+from threeML.utils.bayesian_blocks import bayesian_blocks, bayesian_blocks_not_unique, bayesian_blocks_binned
 from threeML.utils.statistics.stats_tools import Significance
 from threeML.utils.time_interval import TimeIntervalSet
 from threeML.exceptions.custom_exceptions import custom_warnings
@@ -265,6 +265,10 @@ class TemporalBinner(TimeIntervalSet):
         method. If a background error function is given then it is assumed that the error distribution
         is gaussian. Otherwise, the error distribution is assumed to be Poisson.
 
+        Each bin ends at the first event where the significance reaches the requested level. The significance of
+        all the candidate stops is evaluated at once from the cumulative counts and background at the event times.
+
+        :param arrival_times: the sorted arrival times of the events
         :param background_getter: function of a start and stop time that returns background counts
         :param background_error_getter: function of a start and stop time that returns background count errors
         :param sigma_level: the sigma level of the intervals
@@ -295,179 +299,121 @@ class TemporalBinner(TimeIntervalSet):
 
         stops = []
 
-        # Switching to a fast search
-        # Idea inspired by Damien Begue
-
-        # these factors change the time steps
-        # in the fast search. should experiment
-        if sigma_level > 25:
-
-            increase_factor = 0.5
-            decrease_factor = 0.5
-
-        else:
-
-            increase_factor = 0.25
-            decrease_factor = 0.25
+        n_events = arrival_times.shape[0]
 
         current_start = arrival_times[0]
 
         # first we need to see if the interval provided has enough counts
 
-        _, counts = TemporalBinner._select_events(arrival_times,current_start, arrival_times[-1])
+        _, counts = TemporalBinner._select_events(arrival_times, current_start, arrival_times[-1])
 
-        # if it does not, the flag for the big loop never gets set
+        # if it does not, we never start the search
         end_all_search = not TemporalBinner._check_exceeds_sigma_interval(current_start,
-                                                                arrival_times[-1],
-                                                                counts,
-                                                                sigma_level,
-                                                                background_getter,
-                                                                background_error_getter)
-
-        # We will start the search at the mid point of the whole interval
+                                                                          arrival_times[-1],
+                                                                          counts,
+                                                                          sigma_level,
+                                                                          background_getter,
+                                                                          background_error_getter)
 
-        mid_point = 0.5 * (arrival_times[-1] + current_start)
+        if not end_all_search:
 
-        current_stop = mid_point
+            # the background counts are additive, so we compute once the cumulative
+            # background at each event time. The background between two events is
+            # then a difference of two entries
 
-        # initialize the fast search flag
-
-        end_fast_search = False
+            cumulative_background = TemporalBinner._evaluate_getter(background_getter, arrival_times[0],
+                                                                    arrival_times)
 
         # resolve once for functions used in the loop
         searchsorted = np.searchsorted
 
+        start_idx = 0
+
         # this is the main loop
         # as long as we have not reached the end of the interval
         # the loop will run
-        with progress_bar(arrival_times.shape[0]) as pbar:
-            while (not end_all_search):
-
-                # start of the fast search
-                # we reset the flag for the interval
-                # having been decreased in the last pass
-                decreased_interval = False
-
-                while (not end_fast_search):
-
-                    # we calculate the sigma of the current region
-                    _, counts = TemporalBinner._select_events(arrival_times,current_start, current_stop)
-
-                    sigma_exceeded = TemporalBinner._check_exceeds_sigma_interval(current_start,
-                                                                        current_stop,
-                                                                        counts,
-                                                                        sigma_level,
-                                                                        background_getter,
-                                                                        background_error_getter)
-
-                    time_step = abs(current_stop - current_start)
+        with progress_bar(n_events) as pbar:
 
-                    # if we do not exceed the sigma
-                    # we need to increase the time interval
-                    if not sigma_exceeded:
+            while not end_all_search:
 
-                        # however, if in the last pass we had to decrease
-                        # the interval, it means we have found where we
-                        # we need to start the slow search
-                        if decreased_interval:
+                # the events at the start of the interval are counted as well
 
-                            # mark where we are in the list
-                            start_idx = searchsorted(arrival_times, current_stop)
+                first_idx = searchsorted(arrival_times, current_start, side='left')
 
-                            # end the fast search
-                            end_fast_search = True
+                # we evaluate the significance of all the candidate stops (the following events)
+                # at once, in windows of increasing size so that short bins stay cheap
 
-                        # otherwise we increase the interval
-                        else:
-
-                            # unless, we would increase it too far
-                            if (current_stop + time_step * increase_factor) >= arrival_times[-1]:
+                window_start = start_idx + 1
 
-                                # mark where we are in the interval
-                                start_idx = searchsorted(arrival_times, current_stop)
+                window_size = max(1024, int(min_counts))
 
-                                # then we also want to go ahead and get out of the fast search
-                                end_fast_search = True
+                crossing_idx = None
 
-                            else:
+                while window_start < n_events:
 
-                                # increase the interval
-                                current_stop += time_step * increase_factor
+                    window_stop = min(window_start + window_size, n_events)
 
-                    # if we did exceede the sigma level we will need to step
-                    # back in time to find where it was NOT exceeded
-                    else:
+                    candidate_stops = arrival_times[window_start:window_stop]
 
-                        # decrease the interval
-                        current_stop -= time_step * decrease_factor
+                    total_counts = np.arange(window_start, window_stop) - first_idx + 1
 
-                        # inform the loop that we have been back stepping
-                        decreased_interval = True
+                    bkg = cumulative_background[window_start:window_stop] - cumulative_background[start_idx]
 
-                # Now we are ready for the slow forward search
-                # where we count up all the photons
+                    sig = Significance(total_counts, bkg)
 
-                # we have already counted up the photons to this point
-                total_counts = counts
+                    with np.errstate(divide='ignore', invalid='ignore'):
 
-                # start searching from where the fast search ended
-                pbar.increase(counts)
-
-                for time in arrival_times[start_idx:]:
+                        if background_error_getter is not None:
 
-                    total_counts += 1
-                    pbar.increase()
-                    if total_counts < min_counts:
+                            bkg_error = TemporalBinner._evaluate_getter(background_error_getter, current_start,
+                                                                        candidate_stops)
 
-                        continue
+                            sigma = sig.li_and_ma_equivalent_for_gaussian_background(bkg_error)
 
-                    else:
+                        else:
 
-                        # first use the background function to know the number of background counts
-                        bkg = background_getter(current_start, time)
+                            sigma = sig.li_and_ma()
 
-                        sig = Significance(total_counts, bkg)
+                        # now test if we have enough sigma
 
-                        if background_error_getter is not None:
+                        exceeded = np.logical_and(sigma >= sigma_level, total_counts >= min_counts)
 
-                            bkg_error = background_error_getter(current_start, time)
+                    if np.any(exceeded):
 
-                            sigma = sig.li_and_ma_equivalent_for_gaussian_background(bkg_error)[0]
+                        # jump to the first crossing
 
+                        crossing_idx = window_start + np.argmax(exceeded)
 
-                        else:
+                        break
 
-                            sigma = sig.li_and_ma()[0]
+                    window_start = window_stop
 
-                            # now test if we have enough sigma
+                    window_size *= 2
 
-                        if sigma >= sigma_level:
+                # if we never exceeded the sigma level by the
+                # end of the events, we never will
 
-                            # if we succeeded we want to mark the time bins
-                            stops.append(time)
+                if crossing_idx is None:
 
-                            starts.append(current_start)
+                    end_all_search = True
 
-                            # set up the next fast search
-                            # by looking past this interval
-                            current_start = time
+                else:
 
-                            current_stop = 0.5 * (arrival_times[-1] + time)
+                    # if we succeeded we want to mark the time bins
 
-                            end_fast_search = False
+                    time = arrival_times[crossing_idx]
 
-                            # get out of the for loop
-                            break
+                    stops.append(time)
 
-                # if we never exceeded the sigma level by the
-                # end of the search, we never will
-                if end_fast_search:
+                    starts.append(current_start)
 
-                    # so lets kill the main search
-                    end_all_search = True
+                    pbar.increase(crossing_idx - start_idx)
 
+                    # and start the next interval from here
 
+                    current_start = time
 
+                    start_idx = crossing_idx
 
         if not starts:
 
@@ -538,6 +484,31 @@ class TemporalBinner(TimeIntervalSet):
 
         return  cls.from_starts_and_stops(starts, stops)
 
+    @classmethod
+    def bin_by_binned_bayesian_blocks(cls, edges, counts, p0, bkg_integral_distribution=None):
+        """Divide binned counts (i.e., a light curve) in blocks of perceptibly constant count
+        rate. The blocks are made of whole bins. If the background integral distribution
+        is given, divide the light curve in blocks where the difference with respect to
+        the background is perceptibly constant.
+
+        :param edges: the edges of the bins (one more than the number of bins)
+        :param counts: the counts in each bin
+        :param p0: The probability of finding a variations (i.e., creating a new
+                      block) when there is none.
+        :param bkg_integral_distribution : the integral distribution for the
+                      background counts. It must be a function of the form f(x),
+                      which must return the integral number of counts expected from
+                      the background component between time 0 and x.
+
+        """
+
+        final_edges = bayesian_blocks_binned(edges, counts, p0, bkg_integral_distribution)
+
+        starts = np.asarray(final_edges)[:-1]
+        stops = np.asarray(final_edges)[1:]
+
+        return cls.from_starts_and_stops(starts, stops)
+
 
     @classmethod
     def bin_by_custom(cls, starts, stops):
@@ -596,6 +567,32 @@ class TemporalBinner(TimeIntervalSet):
 
             return False
 
+    @staticmethod
+    def _evaluate_getter(getter, start, stops):
+        """
+        evaluate a background (or background error) getter from start to each of the stops. The getter is
+        called once with the array of stops and, if it does not support arrays, once per stop
+
+        :param getter: function of a start and stop time
+        :param start: the start time
+        :param stops: array of stop times
+        :return: array with one value per stop
+        """
+
+        try:
+
+            values = np.asarray(getter(start, stops), dtype=float)
+
+        except (TypeError, ValueError):
+
+            values = None
+
+        if values is None or values.shape != stops.shape:
+
+            values = np.array([getter(start, stop) for stop in stops], dtype=float)
+
+        return values
+
     @staticmethod
     def _select_events(arrival_times, start, stop ):
         """
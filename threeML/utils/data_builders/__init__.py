@@ -1,3 +1,4 @@
 from time_series_builder import TimeSeriesBuilder
+from time_series_builder_set import TimeSeriesBuilderSet
 
-__all__ = ['TimeSeriesBuilder']
\ No newline at end of file
+__all__ = ['TimeSeriesBuilder', 'TimeSeriesBuilderSet']
@@ -0,0 +1,103 @@
+import numpy as np
+
+# Number of rows of the event table which are read at once when scanning the time column.
+# 2**20 double precision times are 8 MB
+
+_CHUNK_SIZE = 2 ** 20
+
+
+def read_events_in_window(events_data, columns, tmin=None, tmax=None, time_column='TIME', chunk_size=_CHUNK_SIZE):
+    """
+    Read the events falling within [tmin, tmax] from the data of a FITS event extension. If the
+    file was opened with memmap=True, the time column is scanned in chunks, so that only the
+    selected events are ever loaded in memory. This allows to open event files which are much
+    larger than the available memory.
+
+    The scan also checks whether the events are sorted in time. If they are not, the selected
+    events are sorted.
+
+    :param events_data: the data of the event extension (i.e., fits_file['EVENTS'].data)
+    :param columns: list of the names of the columns to read (in addition to the time column)
+    :param tmin: (default: None) minimum time to read. If None, read from the first event
+    :param tmax: (default: None) maximum time to read. If None, read up to the last event
+    :param time_column: (default: 'TIME') the name of the time column
+    :param chunk_size: number of rows to read at once
+    :return: (times, dictionary column name -> array, a boolean which is True if the file was sorted in time)
+    """
+
+    if tmin is None:
+
+        tmin = -np.inf
+
+    if tmax is None:
+
+        tmax = np.inf
+
+    assert tmin <= tmax, "The start of the time window must be before its stop"
+
+    times = events_data.field(time_column)
+
+    n_events = times.shape[0]
+
+    is_sorted = True
+
+    last_time = -np.inf
+
+    selections = []
+
+    for chunk_start in range(0, n_events, chunk_size):
+
+        chunk = np.array(times[chunk_start: chunk_start + chunk_size], dtype=float)
+
+        if is_sorted:
+
+            if chunk[0] < last_time or np.any(chunk[1:] < chunk[:-1]):
+
+                is_sorted = False
+
+            last_time = chunk[-1]
+
+        in_window = np.flatnonzero((chunk >= tmin) & (chunk <= tmax))
+
+        selections.append(in_window + chunk_start)
+
+    if selections:
+
+        idx = np.concatenate(selections)
+
+    else:
+
+        idx = np.zeros(0, dtype=int)
+
+    # If the events are sorted the selected rows are contiguous, and a slice
+    # avoids a fancy-indexing pass over the memory map
+
+    if is_sorted and idx.shape[0] > 0:
+
+        idx = slice(idx[0], idx[-1] + 1)
+
+    selected_times = np.array(times[idx], dtype=float)
+
+    selected_columns = {}
+
+    for column in columns:
+
+        data = events_data.field(column)[idx]
+
+        # native byte order for fast computations
+
+        selected_columns[column] = np.array(data, dtype=data.dtype.newbyteorder('='))
+
+    if not is_sorted:
+
+        # a stable sort keeps the original order of events with the same time
+
+        sort_idx = selected_times.argsort(kind='mergesort')
+
+        selected_times = selected_times[sort_idx]
+
+        for column in columns:
+
+            selected_columns[column] = selected_columns[column][sort_idx]
+
+    return selected_times, selected_columns, is_sorted
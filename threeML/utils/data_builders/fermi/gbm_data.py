@@ -7,77 +7,121 @@ import re
 import requests
 import warnings
 
+from threeML.utils.data_builders.fermi.fits_events import read_events_in_window
 from threeML.utils.fermi_relative_mission_time import compute_fermi_relative_mission_times
 from threeML.utils.spectrum.pha_spectrum import PHASpectrumSet
 
 
 class GBMTTEFile(object):
-    def __init__(self, ttefile):
+    def __init__(self, ttefile, time_window=None):
         """
 
         A simple class for opening and easily accessing Fermi GBM
         TTE Files.
 
+        The file is memory-mapped and the events are read only when they are first accessed. If a time
+        window is given (or set later with set_time_window) only the events within that window are loaded,
+        so that very long files (like the continuous TTE data) can be opened without loading all of the
+        events in memory.
+
         :param ttefile: The filename of the TTE file to be stored
+        :param time_window: (default: None) a (tmin, tmax) tuple in MET. Only the events within this
+        window are loaded. Remember to include the background intervals!
 
         """
 
-        tte = fits.open(ttefile)
+        self._tte_file = ttefile
 
-        self._events = tte['EVENTS'].data['TIME']
-        self._pha = tte['EVENTS'].data['PHA']
+        # only read the headers for now
 
-        # the GBM TTE data are not always sorted in TIME.
-        # we will now do this for you. We should at some
-        # point check with NASA if this is on purpose.
+        with fits.open(ttefile, memmap=True) as tte:
 
+            try:
+                self._trigger_time = tte['PRIMARY'].header['TRIGTIME']
 
-        # but first we must check that there are NO duplicated events
-        # and then warn the user
 
-        if not len(self._events) == len(np.unique(self._events)):
+            except:
 
+                # For continuous data
+                warnings.warn("There is no trigger time in the TTE file. Must be set manually or using MET relative times.")
 
-            warnings.warn('The TTE file %s contains duplicate time tags and is thus invalid. Contact the FSSC ' % ttefile)
+                self._trigger_time = 0
 
-        
-        
-        # sorting in time
-        sort_idx = self._events.argsort()
+            self._start_events = tte['PRIMARY'].header['TSTART']
+            self._stop_events = tte['PRIMARY'].header['TSTOP']
 
+            self._utc_start = tte['PRIMARY'].header['DATE-OBS']
+            self._utc_stop = tte['PRIMARY'].header['DATE-END']
 
-        if not np.alltrue(self._events[sort_idx] == self._events):
-        
-            # now sort both time and energy
-            warnings.warn('The TTE file %s was not sorted in time but contains no duplicate events. We will sort the times, but use caution with this file. Contact the FSSC.')
-            self._events = self._events[sort_idx]
-            self._pha = self._pha[sort_idx]
-        
-        
-        try:
-            self._trigger_time = tte['PRIMARY'].header['TRIGTIME']
+            self._n_channels = tte['EBOUNDS'].header['NAXIS2']
 
+            self._det_name = "%s_%s" % (tte['PRIMARY'].header['INSTRUME'], tte['PRIMARY'].header['DETNAM'])
 
-        except:
+            self._telescope = tte['PRIMARY'].header['TELESCOP']
 
-            # For continuous data
-            warnings.warn("There is no trigger time in the TTE file. Must be set manually or using MET relative times.")
+        self._events = None
+        self._pha = None
 
-            self._trigger_time = 0
+        self._time_window = None
+
+        if time_window is not None:
+
+            self.set_time_window(*time_window)
+
+    def set_time_window(self, tmin, tmax):
+        """
+        Select the time window (in MET) of the events to load. The events are (re)loaded
+        at the next access.
 
-        self._start_events = tte['PRIMARY'].header['TSTART']
-        self._stop_events = tte['PRIMARY'].header['TSTOP']
+        :param tmin: start of the window
+        :param tmax: stop of the window
+        :return: none
+        """
+
+        assert tmin < tmax, "The start of the time window must be before its stop"
+
+        assert tmin < self._stop_events and tmax > self._start_events, \
+            "The time window (%f,%f) does not overlap the data (%f,%f)" % (tmin, tmax,
+                                                                           self._start_events, self._stop_events)
+
+        self._time_window = (tmin, tmax)
+
+        # force a new read
+
+        self._events = None
+        self._pha = None
 
-        self._utc_start = tte['PRIMARY'].header['DATE-OBS']
-        self._utc_stop = tte['PRIMARY'].header['DATE-END']
+    def _read_events(self):
 
-        self._n_channels = tte['EBOUNDS'].header['NAXIS2']
+        if self._time_window is None:
 
-        self._det_name = "%s_%s" % (tte['PRIMARY'].header['INSTRUME'], tte['PRIMARY'].header['DETNAM'])
+            tmin, tmax = None, None
 
-        self._telescope = tte['PRIMARY'].header['TELESCOP']
+        else:
 
-        self._calculate_deadtime()
+            tmin, tmax = self._time_window
+
+        with fits.open(self._tte_file, memmap=True) as tte:
+
+            self._events, columns, is_sorted = read_events_in_window(tte['EVENTS'].data, ['PHA'], tmin, tmax)
+
+        self._pha = columns['PHA']
+
+        # the GBM TTE data are not always sorted in TIME.
+        # the reader sorted them for you. We should at some
+        # point check with NASA if this is on purpose.
+
+        if not is_sorted:
+
+            warnings.warn('The TTE file %s was not sorted in time. We sorted the times, but use caution with this '
+                          'file. Contact the FSSC.' % self._tte_file)
+
+        # but we must check that there are NO duplicated events
+        # and then warn the user (the events are sorted, so duplicates are neighbors)
+
+        if np.any(self._events[1:] == self._events[:-1]):
+
+            warnings.warn('The TTE file %s contains duplicate time tags and is thus invalid. Contact the FSSC ' % self._tte_file)
 
     @property
     def trigger_time(self):
@@ -100,8 +144,28 @@ class GBMTTEFile(object):
     def tstop(self):
         return self._stop_events
 
+    @property
+    def time_window(self):
+        """
+        The interval (in MET) covered by the loaded events, i.e., the time window
+        (if any) clipped to the start and stop of the observation
+
+        :return: (start, stop)
+        """
+
+        if self._time_window is None:
+
+            return self._start_events, self._stop_events
+
+        return max(self._time_window[0], self._start_events), min(self._time_window[1], self._stop_events)
+
     @property
     def arrival_times(self):
+
+        if self._events is None:
+
+            self._read_events()
+
         return self._events
 
     @property
@@ -110,6 +174,11 @@ class GBMTTEFile(object):
 
     @property
     def energies(self):
+
+        if self._pha is None:
+
+            self._read_events()
+
         return self._pha
 
     @property
@@ -132,7 +201,12 @@ class GBMTTEFile(object):
 
     @property
     def deadtime(self):
-        return self._deadtime
+        """
+        The dead time of each loaded event. This is computed when requested and not stored.
+
+        :return: array of dead times
+        """
+        return self._calculate_deadtime()
 
     def _calculate_deadtime(self):
         """
@@ -141,15 +215,14 @@ class GBMTTEFile(object):
         The array can be summed over to obtain the total dead time
 
         """
-        self._deadtime = np.zeros_like(self._events)
-        overflow_mask = self._pha == self._n_channels  # specific to gbm! should work for CTTE
+
+        overflow_mask = self.energies == self._n_channels  # specific to gbm! should work for CTTE
 
         # From Meegan et al. (2009)
-        # Dead time for overflow (note, overflow sometimes changes)
-        self._deadtime[overflow_mask] = 10.E-6  # s
+        # Dead time for overflow (note, overflow sometimes changes): 10 us
+        # Normal dead time: 2 us
 
-        # Normal dead time
-        self._deadtime[~overflow_mask] = 2.E-6  # s
+        return np.where(overflow_mask, 10.E-6, 2.E-6)  # s
 
     def _compute_mission_times(self):
 
@@ -5,20 +5,25 @@ import astropy.io.fits as fits
 import numpy as np
 import pandas as pd
 
+from threeML.utils.data_builders.fermi.fits_events import read_events_in_window
 from threeML.utils.fermi_relative_mission_time import compute_fermi_relative_mission_times
+from threeML.utils.time_interval import GoodTimeIntervals
 
 
 class LLEFile(object):
-    def __init__(self, lle_file, ft2_file, rsp_file):
+    def __init__(self, lle_file, ft2_file, rsp_file, time_window=None):
         """
         Class to read the LLE and FT2 files
 
         Inspired heavily by G. Vianello
 
-
+        The LLE and FT2 files are memory-mapped and, if a time window is given,
+        only the events and the FT2 entries within the window are loaded.
 
         :param lle_file:
         :param ft2_file:
+        :param time_window: (default: None) a (tmin, tmax) tuple in MET. Only the events within this
+        window are loaded. Remember to include the background intervals!
         """
 
         with fits.open(rsp_file) as rsp_:
@@ -29,12 +34,19 @@ class LLEFile(object):
             self._emax = data.E_MAX
             self._channels = data.CHANNEL
 
-        with fits.open(lle_file) as ft1_:
+        if time_window is None:
+
+            tmin, tmax = None, None
+
+        else:
+
+            tmin, tmax = time_window
+
+        with fits.open(lle_file, memmap=True) as ft1_:
 
-            data = ft1_['EVENTS'].data
+            self._events, columns, _ = read_events_in_window(ft1_['EVENTS'].data, ['ENERGY'], tmin, tmax)
 
-            self._events = data.TIME  # - trigger_time
-            self._energy = data.ENERGY * 1E3  # keV
+            self._energy = columns['ENERGY'] * 1E3  # keV
 
             self._tstart = ft1_['PRIMARY'].header['TSTART']
             self._tstop = ft1_['PRIMARY'].header['TSTOP']
@@ -42,8 +54,7 @@ class LLEFile(object):
             self._utc_stop = ft1_['PRIMARY'].header['DATE-END']
             self._instrument = ft1_['PRIMARY'].header['INSTRUME']
             self._telescope = ft1_['PRIMARY'].header['TELESCOP'] + "_LLE"
-            self._gti_start = ft1_['GTI'].data['START']
-            self._gti_stop = ft1_['GTI'].data['STOP']
+            self._gti = GoodTimeIntervals(ft1_['GTI'].data['START'], ft1_['GTI'].data['STOP'])
 
             try:
                 self._trigger_time = ft1_['EVENTS'].header['TRIGTIME']
@@ -57,6 +68,13 @@ class LLEFile(object):
 
                 self._trigger_time = 0
 
+        # the interval covered by the loaded events
+
+        self._window_start = self._tstart if tmin is None else max(tmin, self._tstart)
+        self._window_stop = self._tstop if tmax is None else min(tmax, self._tstop)
+
+        assert self._window_start < self._window_stop, "The time window does not overlap the data"
+
         # bin the energies into PHA channels
         # and filter out over/underflow
         self._bin_energies_into_pha()
@@ -65,11 +83,18 @@ class LLEFile(object):
 
         self._apply_gti_to_events()
 
-        with fits.open(ft2_file) as ft2_:
+        # read only the FT2 entries around the loaded events (the padding covers
+        # the one applied below for both 1 s and 30 s FT2 files)
+
+        with fits.open(ft2_file, memmap=True) as ft2_:
 
-            ft2_tstart = ft2_['SC_DATA'].data.field("START")  # - trigger_time
-            ft2_tstop = ft2_['SC_DATA'].data.field("STOP")  # - trigger_time
-            ft2_livetime = ft2_['SC_DATA'].data.field("LIVETIME")
+            ft2_tstart, columns, _ = read_events_in_window(ft2_['SC_DATA'].data, ['STOP', 'LIVETIME'],
+                                                           self._window_start - 11 * 30.0,
+                                                           self._window_stop + 11 * 30.0,
+                                                           time_column='START')  # - trigger_time
+
+            ft2_tstop = columns['STOP']  # - trigger_time
+            ft2_livetime = columns['LIVETIME']
 
         ft2_bin_size = 1.0  # seconds
 
@@ -81,8 +106,8 @@ class LLEFile(object):
             ft2_bin_size = 30.0  # s
 
         # Keep only the needed entries (plus a padding)
-        idx = (ft2_tstart >= self._tstart - 10 * ft2_bin_size) & (
-            ft2_tstop <= self._tstop + 10 * ft2_bin_size)
+        idx = (ft2_tstart >= self._window_start - 10 * ft2_bin_size) & (
+            ft2_tstop <= self._window_stop + 10 * ft2_bin_size)
 
         self._ft2_tstart = ft2_tstart[idx]
         self._ft2_tstop = ft2_tstop[idx]
@@ -116,20 +141,9 @@ class LLEFile(object):
         :return: none
         """
 
-        # First negate all FT2 entries
-
-        filter_idx = np.zeros_like(self._livetime, dtype=bool)
-
-        # now loop through each GTI interval
-
-        for start, stop in zip(self._gti_start, self._gti_stop):
+        # keep the FT2 bins which are completely within a GTI
 
-            # create an index of all the FT2 bins falling within this interval
-
-            tmp_idx = np.logical_and(start <= self._ft2_tstart, self._ft2_tstop <= stop)
-
-            # add them to the already selected idx
-            filter_idx = np.logical_or(filter_idx, tmp_idx)
+        filter_idx = self._gti.contains_intervals(self._ft2_tstart, self._ft2_tstop)
 
         # Now filter the whole list
         self._ft2_tstart = self._ft2_tstart[filter_idx]
@@ -147,17 +161,9 @@ class LLEFile(object):
         :return: none
         """
 
-        # initial filter
-        filter_idx = np.zeros_like(self._events, dtype=bool)
-
-        # loop throught the GTI intervals
-        for start, stop in zip(self._gti_start, self._gti_stop):
-
-            # capture all the events within that interval
-            tmp_idx = np.logical_and(start <= self._events, self._events <= stop)
+        # capture all the events within a GTI
 
-            # combine with the already selected events
-            filter_idx = np.logical_or(filter_idx, tmp_idx)
+        filter_idx = self._gti.contains(self._events)
 
         # filter from the energy selection
         self._filter_idx = np.logical_and(self._filter_idx, filter_idx)
@@ -168,22 +174,11 @@ class LLEFile(object):
         Checks if a time falls within
         a GTI
 
-        :param time: time in MET
-        :return: bool
+        :param time: time in MET (a single time or an array of times)
+        :return: bool (or array of bool)
         """
 
-        in_gti = False
-
-        for start, stop in zip(self._gti_start, self._gti_stop):
-
-            if (start <= time) and (time <= stop):
-
-                in_gti = True
-
-        return in_gti
-
-
-
+        return self._gti.contains(time)
 
     def _bin_energies_into_pha(self):
         """
@@ -230,6 +225,16 @@ class LLEFile(object):
     def tstop(self):
         return self._tstop
 
+    @property
+    def time_window(self):
+        """
+        The interval (in MET) covered by the loaded events, i.e., the time window
+        (if any) clipped to the start and stop of the observation
+
+        :return: (start, stop)
+        """
+        return self._window_start, self._window_stop
+
     @property
     def arrival_times(self):
         """
@@ -273,6 +278,14 @@ class LLEFile(object):
 
         return self._telescope
 
+    @property
+    def gti(self):
+        """
+        The good time intervals (in MET)
+        :return: a GoodTimeIntervals instance
+        """
+        return self._gti
+
     @property
     def livetime(self):
         return self._livetime
@@ -232,7 +232,11 @@ class TimeSeriesBuilder(object):
 
             unbinned = self._default_unbinned
 
-        self._time_series.set_polynomial_fit_interval(*intervals, unbinned=unbinned)
+        batch = options.pop('batch', False)
+
+        # any other option (e.g., use_cache) is passed on to the time series
+
+        self._time_series.set_polynomial_fit_interval(*intervals, unbinned=unbinned, batch=batch, **options)
 
         # In theory this will automatically get the poly counts if a
         # time interval already exists
@@ -324,7 +328,7 @@ class TimeSeriesBuilder(object):
 
         self._time_series.save_background(filename, overwrite)
 
-    def view_lightcurve(self, start=-10, stop=20., dt=1., use_binner=False):
+    def view_lightcurve(self, start=-10, stop=20., dt=1., use_binner=False, mask=None):
         # type: (float, float, float, bool) -> None
 
         """
@@ -332,10 +336,23 @@ class TimeSeriesBuilder(object):
         :param stop:
         :param dt:
         :param use_binner:
+        :param mask: (optional) boolean mask of the channels to plot
+
+        """
+
+        return self._time_series.view_lightcurve(start, stop, dt, use_binner, mask)
 
+    def get_light_curve(self, starts, stops, mask=None):
         """
+        Compute the light curve over arbitrary time bins without plotting it
 
-        return self._time_series.view_lightcurve(start, stop, dt, use_binner)
+        :param starts: array of the start times of the bins
+        :param stops: array of the stop times of the bins
+        :param mask: (optional) boolean mask of the channels to use. By default all the counts are used
+        :return: a pandas DataFrame with the counts, exposure, rate, background rate and its error in each bin
+        """
+
+        return self._time_series.light_curve(starts, stops, mask)
 
     @property
     def tstart(self):
@@ -441,7 +458,10 @@ class TimeSeriesBuilder(object):
         :return:
         """
 
-        assert isinstance(self._time_series, EventList), 'can only bin event lists currently'
+        # pre-binned data can only be grouped in Bayesian blocks of native bins
+
+        assert isinstance(self._time_series, EventList) or method == 'bayesblocks', \
+            'can only bin event lists currently (binned data can only use bayesblocks)'
 
 
         # if 'use_energy_mask' in options:
@@ -709,7 +729,7 @@ class TimeSeriesBuilder(object):
     @classmethod
     def from_gbm_tte(cls, name, tte_file, rsp_file, restore_background=None,
                      trigger_time=None,
-                     poly_order=-1, unbinned=True, verbose=True):
+                     poly_order=-1, unbinned=True, verbose=True, time_window=None):
         """
            A plugin to natively bin, view, and handle Fermi GBM TTE data.
            A TTE event file are required as well as the associated response
@@ -731,6 +751,9 @@ class TimeSeriesBuilder(object):
            :param poly_order: 0-4 or -1 for auto
            :param unbinned: unbinned likelihood fit (bool)
            :param verbose: verbose (bool)
+           :param time_window: (default: None) a (tmin, tmax) tuple of times relative to the trigger time. Only the
+           events within this window are read from the file, which is needed for very long files (like continuous
+           TTE data). It must include the background intervals!
 
 
 
@@ -738,7 +761,7 @@ class TimeSeriesBuilder(object):
 
         # self._default_unbinned = unbinned
 
-        # Load the relevant information from the TTE file
+        # Load the relevant information from the TTE file (the events are read only when needed)
 
         gbm_tte_file = GBMTTEFile(tte_file)
 
@@ -747,13 +770,20 @@ class TimeSeriesBuilder(object):
         if trigger_time is not None:
             gbm_tte_file.trigger_time = trigger_time
 
+        if time_window is not None:
+
+            gbm_tte_file.set_time_window(gbm_tte_file.trigger_time + time_window[0],
+                                         gbm_tte_file.trigger_time + time_window[1])
+
+        start_time, stop_time = gbm_tte_file.time_window
+
         # Create the the event list
 
         event_list = EventListWithDeadTime(arrival_times=gbm_tte_file.arrival_times - gbm_tte_file.trigger_time,
                                            measurement=gbm_tte_file.energies,
                                            n_channels=gbm_tte_file.n_channels,
-                                           start_time=gbm_tte_file.tstart - gbm_tte_file.trigger_time,
-                                           stop_time=gbm_tte_file.tstop - gbm_tte_file.trigger_time,
+                                           start_time=start_time - gbm_tte_file.trigger_time,
+                                           stop_time=stop_time - gbm_tte_file.trigger_time,
                                            dead_time=gbm_tte_file.deadtime,
                                            first_channel=0,
                                            instrument=gbm_tte_file.det_name,
@@ -792,9 +822,10 @@ class TimeSeriesBuilder(object):
             if test is not None:
 
                 rsp = InstrumentResponseSet.from_rsp2_file(rsp2_file=rsp_file,
-                                                           counts_getter=event_list.counts_over_interval,
-                                                           exposure_getter=event_list.exposure_over_interval,
-                                                           reference_time=gbm_tte_file.trigger_time)
+                                                           counts_getter=event_list.counts_over_intervals,
+                                                           exposure_getter=event_list.exposure_over_intervals,
+                                                           reference_time=gbm_tte_file.trigger_time,
+                                                           vectorized_getters=True)
 
 
 
@@ -896,9 +927,10 @@ class TimeSeriesBuilder(object):
             if test is not None:
 
                 rsp = InstrumentResponseSet.from_rsp2_file(rsp2_file=rsp_file,
-                                                           counts_getter=event_list.counts_over_interval,
-                                                           exposure_getter=event_list.exposure_over_interval,
-                                                           reference_time=cdata.trigger_time)
+                                                           counts_getter=event_list.counts_over_intervals,
+                                                           exposure_getter=event_list.exposure_over_intervals,
+                                                           reference_time=cdata.trigger_time,
+                                                           vectorized_getters=True)
 
 
 
@@ -927,7 +959,7 @@ class TimeSeriesBuilder(object):
 
     @classmethod
     def from_lat_lle(cls, name, lle_file, ft2_file, rsp_file, restore_background=None,
-                     trigger_time=None, poly_order=-1, unbinned=False, verbose=True):
+                     trigger_time=None, poly_order=-1, unbinned=False, verbose=True, time_window=None):
 
         """
                A plugin to natively bin, view, and handle Fermi LAT LLE data.
@@ -951,15 +983,33 @@ class TimeSeriesBuilder(object):
                :param poly_order: 0-4 or -1 for auto
                :param unbinned: unbinned likelihood fit (bool)
                :param verbose: verbose (bool)
+               :param time_window: (default: None) a (tmin, tmax) tuple of times relative to the trigger time. Only
+               the events within this window are read from the file. It must include the background intervals!
 
 
                """
 
-        lat_lle_file = LLEFile(lle_file, ft2_file, rsp_file)
+        if time_window is not None:
+
+            # the window is relative to the trigger time, which we need before reading the events
+
+            if trigger_time is not None:
+
+                reference_time = trigger_time
+
+            else:
+
+                reference_time = fits.getheader(lle_file, 'EVENTS').get('TRIGTIME', 0)
+
+            time_window = (reference_time + time_window[0], reference_time + time_window[1])
+
+        lat_lle_file = LLEFile(lle_file, ft2_file, rsp_file, time_window=time_window)
 
         if trigger_time is not None:
             lat_lle_file.trigger_time = trigger_time
 
+        start_time, stop_time = lat_lle_file.time_window
+
         # Mark channels less than 50 MeV as bad
 
         channel_30MeV = np.searchsorted(lat_lle_file.energy_edges[0], 30000.) - 1
@@ -977,14 +1027,15 @@ class TimeSeriesBuilder(object):
             live_time=lat_lle_file.livetime,
             live_time_starts=lat_lle_file.livetime_start - lat_lle_file.trigger_time,
             live_time_stops=lat_lle_file.livetime_stop - lat_lle_file.trigger_time,
-            start_time=lat_lle_file.tstart - lat_lle_file.trigger_time,
-            stop_time=lat_lle_file.tstop - lat_lle_file.trigger_time,
+            start_time=start_time - lat_lle_file.trigger_time,
+            stop_time=stop_time - lat_lle_file.trigger_time,
             quality=native_quality,
             first_channel=1,
             # rsp_file=rsp_file,
             instrument=lat_lle_file.instrument,
             mission=lat_lle_file.mission,
-            verbose=verbose)
+            verbose=verbose,
+            gti=lat_lle_file.gti - lat_lle_file.trigger_time)
 
         # pass to the super class
 
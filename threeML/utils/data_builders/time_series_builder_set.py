@@ -0,0 +1,334 @@
+import collections
+
+from threeML.config.config import threeML_config
+from threeML.io.progress_bar import progress_bar
+from threeML.parallel.parallel_client import ParallelClient
+from threeML.utils.data_builders.time_series_builder import TimeSeriesBuilder
+
+
+def _build_builder(constructor, args, kwargs, operations):
+    """
+    Build a TimeSeriesBuilder and apply a list of operations to it
+
+    :param constructor: the name of the TimeSeriesBuilder class method building the detector (i.e., 'from_gbm_tte')
+    :param args: the positional arguments of the constructor
+    :param kwargs: the keyword arguments of the constructor
+    :param operations: a list of (method name, args, kwargs) to be called on the builder, in order
+    :return: the TimeSeriesBuilder instance
+    """
+
+    builder = getattr(TimeSeriesBuilder, constructor)(*args, **kwargs)  # type: TimeSeriesBuilder
+
+    for method, method_args, method_kwargs in operations:
+
+        getattr(builder, method)(*method_args, **method_kwargs)
+
+    return builder
+
+
+def _build_plugins(task):
+    """
+    Build the plugins of one detector. This is the function executed by the engines,
+    so that each detector loads its files, fits its background and creates its plugins
+    independently.
+
+    :param task: a tuple (constructor, args, kwargs, operations, plugin options)
+    :return: a list of plugins
+    """
+
+    constructor, args, kwargs, operations, plugin_options = task
+
+    builder = _build_builder(constructor, args, kwargs, operations)
+
+    return _to_list(builder.to_spectrumlike(**plugin_options))
+
+
+def _to_list(plugins):
+
+    if isinstance(plugins, list):
+
+        return plugins
+
+    return [plugins]
+
+
+class TimeSeriesBuilderSet(object):
+
+    def __init__(self):
+        """
+        A set of TimeSeriesBuilder (for example, the detectors of GBM triggered by a burst) to which the same
+        background intervals, source intervals and binning are applied.
+
+        The operations are recorded and executed when the plugins are created, with each detector built in a separate
+        task. If parallel computation is active, the tasks are distributed among the engines of the parallel client,
+        otherwise they are executed one after the other.
+
+        Example:
+
+        builders = TimeSeriesBuilderSet.from_gbm_tte(['n3', 'n4', 'b0'], tte_files, rsp_files, poly_order=-1)
+
+        builders.set_background_interval('-50--10', '100-200')
+        builders.set_active_time_interval('0-10')
+        builders.create_time_bins(0, 10, method='significance', sigma=20, reference='n3')
+
+        with parallel_computation():
+
+            plugins = builders.to_spectrumlike(from_bins=True)
+
+        """
+
+        # name -> (constructor, args, kwargs)
+
+        self._builder_specs = collections.OrderedDict()
+
+        # list of (method name, args, kwargs, reference)
+
+        self._operations = []
+
+    def add_builder(self, constructor, name, *args, **kwargs):
+        """
+        Add a detector to the set
+
+        :param constructor: the name of the TimeSeriesBuilder class method used to build it (i.e., 'from_gbm_tte')
+        :param name: the name of the detector (also used as the name of the plugins)
+        :param args: the other positional arguments of the constructor
+        :param kwargs: the keyword arguments of the constructor
+        :return: none
+        """
+
+        assert constructor.startswith('from_') and hasattr(TimeSeriesBuilder, constructor), \
+            '%s is not a constructor of TimeSeriesBuilder' % constructor
+
+        assert name not in self._builder_specs, 'there is already a detector named %s' % name
+
+        self._builder_specs[name] = (constructor, (name,) + args, kwargs)
+
+    @classmethod
+    def from_gbm_tte(cls, names, tte_files, rsp_files, **kwargs):
+        """
+        A set of GBM TTE detectors
+
+        :param names: the names of the detectors
+        :param tte_files: the TTE file of each detector
+        :param rsp_files: the response file of each detector
+        :param kwargs: other keywords of TimeSeriesBuilder.from_gbm_tte, used for all the detectors
+        :return: a TimeSeriesBuilderSet
+        """
+
+        return cls._from_files('from_gbm_tte', names, tte_files, rsp_files, **kwargs)
+
+    @classmethod
+    def from_gbm_cspec_or_ctime(cls, names, cspec_or_ctime_files, rsp_files, **kwargs):
+        """
+        A set of GBM CSPEC or CTIME detectors
+
+        :param names: the names of the detectors
+        :param cspec_or_ctime_files: the CSPEC or CTIME file of each detector
+        :param rsp_files: the response file of each detector
+        :param kwargs: other keywords of TimeSeriesBuilder.from_gbm_cspec_or_ctime, used for all the detectors
+        :return: a TimeSeriesBuilderSet
+        """
+
+        return cls._from_files('from_gbm_cspec_or_ctime', names, cspec_or_ctime_files, rsp_files, **kwargs)
+
+    @classmethod
+    def _from_files(cls, constructor, names, data_files, rsp_files, **kwargs):
+
+        assert len(names) == len(data_files) == len(rsp_files), \
+            'there must be one data file and one response file for each name'
+
+        new_set = cls()
+
+        for name, data_file, rsp_file in zip(names, data_files, rsp_files):
+
+            new_set.add_builder(constructor, name, data_file, rsp_file, **kwargs)
+
+        return new_set
+
+    @property
+    def names(self):
+
+        return list(self._builder_specs.keys())
+
+    def __len__(self):
+
+        return len(self._builder_specs)
+
+    def set_background_interval(self, *intervals, **options):
+        """
+        Set the background interval(s) of all the detectors (see TimeSeriesBuilder.set_background_interval)
+
+        :param intervals:
+        :param options:
+        :return: none
+        """
+
+        self._operations.append(('set_background_interval', intervals, options, None))
+
+    def set_active_time_interval(self, *intervals, **kwargs):
+        """
+        Set the active time interval(s) of all the detectors (see TimeSeriesBuilder.set_active_time_interval)
+
+        :param intervals:
+        :param kwargs:
+        :return: none
+        """
+
+        self._operations.append(('set_active_time_interval', intervals, kwargs, None))
+
+    def create_time_bins(self, start, stop, method='constant', reference=None, **options):
+        """
+        Create the same time bins for all the detectors (see TimeSeriesBuilder.create_time_bins).
+
+        If a reference detector is given, the bins are created only for the reference detector and
+        then used for all the others. This is the only way to have the same bins for all the detectors
+        with the data driven methods (significance and bayesblocks).
+
+        :param start: start of the bins or array of start times for custom mode
+        :param stop: stop of the bins or array of stop times for custom mode
+        :param method: constant, significance, bayesblocks, custom
+        :param reference: (default: None) the name of the detector used to create the bins
+        :param options: the options of the binning method
+        :return: none
+        """
+
+        if reference is not None:
+
+            assert reference in self._builder_specs, 'there is no detector named %s' % reference
+
+        options['method'] = method
+
+        self._operations.append(('create_time_bins', (start, stop), options, reference))
+
+    def get_builder(self, name):
+        """
+        Build one of the detectors in this process, applying all the operations
+
+        :param name: the name of the detector
+        :return: a TimeSeriesBuilder
+        """
+
+        operations, local_builders = self._resolve_operations()
+
+        if name in local_builders:
+
+            return local_builders[name]
+
+        constructor, args, kwargs = self._builder_specs[name]
+
+        return _build_builder(constructor, args, kwargs, operations)
+
+    def _resolve_operations(self):
+        """
+        Replace the binning with a reference detector with custom bins, creating the bins on the reference detector.
+
+        :return: (list of (method name, args, kwargs), dictionary of the detectors which have been built to create the
+        bins, with all the operations applied)
+        """
+
+        operations = []
+
+        # the reference detectors which have been built and the number of operations applied to them
+
+        local_builders = collections.OrderedDict()
+        n_applied = {}
+
+        for method, args, kwargs, reference in self._operations:
+
+            if reference is not None:
+
+                if reference not in local_builders:
+
+                    constructor, builder_args, builder_kwargs = self._builder_specs[reference]
+
+                    local_builders[reference] = _build_builder(constructor, builder_args, builder_kwargs, [])
+
+                    n_applied[reference] = 0
+
+                builder = local_builders[reference]
+
+                # bring the reference detector up to date, then create the bins on it
+
+                for operation in operations[n_applied[reference]:]:
+
+                    getattr(builder, operation[0])(*operation[1], **operation[2])
+
+                getattr(builder, method)(*args, **kwargs)
+
+                bins = builder.bins.bin_stack
+
+                operations.append(('create_time_bins', (bins[:, 0], bins[:, 1]), {'method': 'custom'}))
+
+                n_applied[reference] = len(operations)
+
+            else:
+
+                operations.append((method, args, kwargs))
+
+        # apply the remaining operations to the detectors built here
+
+        for name, builder in local_builders.items():
+
+            for operation in operations[n_applied[name]:]:
+
+                getattr(builder, operation[0])(*operation[1], **operation[2])
+
+        return operations, local_builders
+
+    def to_spectrumlike(self, from_bins=False, start=None, stop=None, interval_name='_interval',
+                        extract_measured_background=False):
+        """
+        Create the plugins of all the detectors (see TimeSeriesBuilder.to_spectrumlike). If parallel computation is
+        active, the detectors are processed in parallel.
+
+        :param from_bins: create plugins from the time bins
+        :param start: if from_bins, the start of the bins to use
+        :param stop: if from_bins, the stop of the bins to use
+        :param interval_name: the name of the interval (appended to the name of the detector)
+        :param extract_measured_background: use the measured background instead of the polynomial fit
+        :return: the list of the plugins of all the detectors, in the order of the detectors
+        """
+
+        plugin_options = {'from_bins': from_bins,
+                          'start': start,
+                          'stop': stop,
+                          'interval_name': interval_name,
+                          'extract_measured_background': extract_measured_background}
+
+        operations, local_builders = self._resolve_operations()
+
+        plugins = collections.OrderedDict()
+
+        # the detectors already built to create the bins are not built again
+
+        for name, builder in local_builders.items():
+
+            plugins[name] = _to_list(builder.to_spectrumlike(**plugin_options))
+
+        names = [name for name in self._builder_specs if name not in local_builders]
+
+        tasks = [self._builder_specs[name] + (operations, plugin_options) for name in names]
+
+        if threeML_config['parallel']['use-parallel']:
+
+            client = ParallelClient()
+
+            results = client.execute_with_progress_bar(_build_plugins, tasks)
+
+        else:
+
+            results = []
+
+            with progress_bar(len(tasks), title='Building detectors') as p:
+
+                for task in tasks:
+
+                    results.append(_build_plugins(task))
+
+                    p.increase()
+
+        for name, these_plugins in zip(names, results):
+
+            plugins[name] = these_plugins
+
+        return [plugin for name in self._builder_specs for plugin in plugins[name]]
@@ -17,6 +17,10 @@ class InvalidUnitError(RuntimeError):
     pass
 
 
+class IntegrationAccuracyError(RuntimeError):
+    pass
+
+
 class FluxConversion(object):
 
     def __init__(self, flux_unit, energy_unit, flux_model):
@@ -179,6 +183,10 @@ class IntegralFluxConversion(FluxConversion):
          def nufnu_integrand(x, param_specification):
              return x * x * flux_model(x, **param_specification)
 
+         self._integrand_builder = {"photon_flux": flux_model,
+                                    "energy_flux": lambda x, **param_specification: x * flux_model(x, **param_specification),
+                                    "nufnu_flux": lambda x, **param_specification: x * x * flux_model(x, **param_specification)}
+
          self._model_builder = {"photon_flux": lambda e1, e2, **param_specification: integrate.quad(photon_integrand, e1, e2,args=(param_specification))[0],
                                "energy_flux": lambda e1, e2, **param_specification: integrate.quad(energy_integrand, e1, e2,args=(param_specification))[0],
                                "nufnu_flux": lambda e1, e2, **param_specification: integrate.quad(nufnu_integrand, e1, e2,args=(param_specification))[0]}
@@ -188,6 +196,151 @@ class IntegralFluxConversion(FluxConversion):
                                                      energy_unit,
                                                      flux_model)
 
+    @property
+    def integrand(self):
+        """
+        the function integrated over the energy to obtain the flux
+
+        :return: a function integrand(x, **param_specification)
+        """
+
+        return self._integrand_builder[self._flux_type]
+
+
+class FixedGridIntegral(object):
+
+    def __init__(self, integrand, n_intervals=32, n_nodes=8, rtol=1e-6, max_refinements=4):
+        """
+        Integrates a function of the energy between e1 and e2 for many values of its parameters at once. The range
+        is divided into intervals of equal width in log(energy), and each interval is integrated with a Gauss-Legendre
+        rule, so that the integrand is evaluated only once on the same grid of energies for all the values of the
+        parameters. The integrand must therefore accept arrays of parameters (like the evaluate method of the
+        astromodels functions).
+
+        At each call the accuracy is checked against an adaptive quadrature (scipy.integrate.quad) for the median
+        of the parameters, and the grid is refined for that call if needed.
+
+        :param integrand: the function to integrate, integrand(x, **param_specification)
+        :param n_intervals: the initial number of intervals in log(energy)
+        :param n_nodes: the number of Gauss-Legendre nodes in each interval
+        :param rtol: the relative accuracy required with respect to the adaptive quadrature
+        :param max_refinements: how many times the number of intervals can be doubled to reach the accuracy
+        """
+
+        self._integrand = integrand
+
+        self._n_intervals = int(n_intervals)
+
+        self._nodes, self._weights = np.polynomial.legendre.leggauss(int(n_nodes))
+
+        self._rtol = rtol
+
+        self._max_refinements = int(max_refinements)
+
+    @property
+    def n_intervals(self):
+
+        return self._n_intervals
+
+    def _grid(self, e1, e2, n_intervals):
+        """
+        :return: the energies and the weights of the grid, with shape e1.shape + (n_intervals * n_nodes,)
+        """
+
+        log_e1 = np.log(e1)[..., np.newaxis]
+
+        log_e2 = np.log(e2)[..., np.newaxis]
+
+        width = (log_e2 - log_e1) / n_intervals
+
+        # position of the nodes in units of the width of the intervals
+
+        position = (np.arange(n_intervals)[:, np.newaxis] + (self._nodes + 1.) / 2.).reshape(-1)
+
+        energies = np.exp(log_e1 + width * position)
+
+        # dE = E dlog(E)
+
+        weights = np.tile(self._weights, n_intervals) * width / 2. * energies
+
+        return energies, weights
+
+    def integrate(self, e1, e2, n_intervals=None, **param_specification):
+        """
+        Integrate on a fixed grid, without checking the accuracy
+
+        :param e1: lower bound(s) of the integral
+        :param e2: upper bound(s) of the integral
+        :param n_intervals: (optional) the number of intervals in log(energy). By default the one given in the
+        constructor is used
+        :param param_specification: the values of the parameters (numbers or arrays)
+        :return: the integral(s), with the shape of the bounds and the parameters broadcast together
+        """
+
+        e1 = np.asarray(e1, dtype=float)
+        e2 = np.asarray(e2, dtype=float)
+
+        assert np.all(e1 > 0) and np.all(e2 > 0), "The bounds of the integral must be positive energies"
+
+        if n_intervals is None:
+
+            n_intervals = self._n_intervals
+
+        energies, weights = self._grid(e1, e2, int(n_intervals))
+
+        # add an axis to the parameters for the energies of the grid
+
+        parameters = {}
+
+        for name, value in param_specification.items():
+
+            parameters[name] = np.asarray(value)[..., np.newaxis] if np.ndim(value) > 0 else value
+
+        return np.sum(self._integrand(energies, **parameters) * weights, axis=-1)
+
+    def __call__(self, e1, e2, **param_specification):
+        """
+        Integrate checking the accuracy against scipy.integrate.quad for the median of the parameters
+
+        :param e1: lower bound(s) of the integral
+        :param e2: upper bound(s) of the integral
+        :param param_specification: the values of the parameters (numbers or arrays)
+        :return: the integral(s), with the shape of the bounds and the parameters broadcast together
+        """
+
+        median_parameters = {}
+
+        for name, value in param_specification.items():
+
+            median_parameters[name] = np.median(value) if np.ndim(value) > 0 else value
+
+        lower_bounds, upper_bounds = np.broadcast_arrays(np.asarray(e1, dtype=float), np.asarray(e2, dtype=float))
+
+        bounds = np.array(sorted(set(zip(lower_bounds.reshape(-1), upper_bounds.reshape(-1)))))
+
+        reference = np.array([integrate.quad(lambda x: self._integrand(x, **median_parameters), lo, hi,
+                                             epsabs=0., epsrel=self._rtol / 100., limit=200)[0]
+                              for lo, hi in bounds])
+
+        # the grid is refined only for this call, so that the result does not depend on the previous calls
+
+        n_intervals = self._n_intervals
+
+        for i in range(self._max_refinements + 1):
+
+            if i > 0:
+
+                n_intervals *= 2
+
+            approximation = self.integrate(bounds[:, 0], bounds[:, 1], n_intervals, **median_parameters)
+
+            if np.allclose(approximation, reference, rtol=self._rtol, atol=0.):
+
+                return self.integrate(e1, e2, n_intervals, **param_specification)
+
+        raise IntegrationAccuracyError("Could not reach a relative accuracy of %g with %i intervals"
+                                       % (self._rtol, n_intervals))
+
 
 class FittedPointSourceSpectralHandler(GenericFittedSourceHandler):
     def __init__(self, analysis_result, source, energy_range, energy_unit, flux_unit, confidence_level=0.68, equal_tailed=True, component=None, is_differential_flux=True):
@@ -281,8 +434,18 @@ class FittedPointSourceSpectralHandler(GenericFittedSourceHandler):
 
             self._conversion = converter.conversion_factor
 
+            # the evaluate method of the function works on arrays of parameters, while evaluate_at sets
+            # the values of the parameters, so it is used for the vectorized propagation
+
+            try:
+
+                vectorized_converter = DifferentialFluxConversion(flux_unit, energy_unit, test_model.evaluate, test_model)
 
+                self._vectorized_flux_function = vectorized_converter.model
 
+            except AttributeError:
+
+                self._vectorized_flux_function = flux_function
 
             super(FittedPointSourceSpectralHandler, self).__init__(analysis_result,
                                                                    flux_function,
@@ -300,6 +463,18 @@ class FittedPointSourceSpectralHandler(GenericFittedSourceHandler):
 
             self._conversion = converter.conversion_factor
 
+            # integrate all the samples at once on a fixed grid of energies (with the evaluate method of the
+            # function, which works on arrays of parameters)
+
+            try:
+
+                vectorized_converter = IntegralFluxConversion(flux_unit, energy_unit, test_model.evaluate, test_model)
+
+                self._vectorized_flux_function = FixedGridIntegral(vectorized_converter.integrand)
+
+            except AttributeError:
+
+                self._vectorized_flux_function = flux_function
 
             # we treat the energy range as the range we want to integrate over
 
@@ -327,6 +502,10 @@ class FittedPointSourceSpectralHandler(GenericFittedSourceHandler):
 
         return self._is_dimensionless
 
+    def _get_vectorized_function(self):
+
+        return self._vectorized_flux_function
+
     @property
     def components(self):
         """
@@ -5,6 +5,7 @@ import functools
 import numpy as np
 
 from threeML.io.progress_bar import progress_bar
+from threeML.random_variates import RandomVariates, equal_tail_intervals, highest_posterior_density_intervals
 from astromodels import use_astromodels_memoization
 
 
@@ -122,6 +123,10 @@ class GenericFittedSourceHandler(object):
 
                 arguments[name] = par.value
 
+        # keep the arguments for the vectorized evaluation
+
+        self._arguments = arguments
+
         # create the propagtor
 
         self._propagated_function = self._analysis_results.propagate(self._function, **arguments)
@@ -137,19 +142,25 @@ class GenericFittedSourceHandler(object):
         # if there are independent variables
         if self._independent_variable_range:
 
-            variates = []
+            # first try to evaluate the function on all the samples and all the values at once
+
+            variates = self._evaluate_vectorized()
+
+            if variates is None:
 
-            # scroll through the independent variables
-            n_iterations = np.product(self._out_shape)
+                variates = []
 
-            with progress_bar(n_iterations, title="Propagating errors") as p:
+                # scroll through the independent variables
+                n_iterations = np.product(self._out_shape)
 
-                with use_astromodels_memoization(False):
+                with progress_bar(n_iterations, title="Propagating errors") as p:
 
-                    for variables in itertools.product(*self._independent_variable_range):
-                        variates.append(self._propagated_function(*variables))
+                    with use_astromodels_memoization(False):
 
-                        p.increase()
+                        for variables in itertools.product(*self._independent_variable_range):
+                            variates.append(self._propagated_function(*variables))
+
+                            p.increase()
 
 
         # otherwise just evaluate
@@ -161,6 +172,86 @@ class GenericFittedSourceHandler(object):
 
         self._propagated_variates = VariatesContainer(variates, self._out_shape, self._cl, self._transform, self._equal_tailed)
 
+    def _get_vectorized_function(self):
+        """
+        The function used to evaluate all the samples at once. By default it is the function itself, sub-classes can
+        override this to provide a version of the function which accepts arrays of parameters.
+
+        :return: a function with the same arguments as the function
+        """
+
+        return self._function
+
+    def _evaluate_vectorized(self):
+        """
+        Evaluate the function with one call on the whole grid of samples and values of the independent variables,
+        by passing the samples of the parameters as columns and the independent variables as rows. This works if
+        the function broadcasts its arguments like a numpy ufunc, which is verified by comparing the first and
+        the last samples at the first and the last values with the function evaluated on single values.
+
+        :return: a (n_values, n_samples) array, or None if the function cannot be evaluated in this way
+        """
+
+        arguments = {}
+
+        n_samples = None
+
+        for name, argument in self._arguments.items():
+
+            if np.ndim(argument) > 0:
+
+                arguments[name] = np.asarray(argument).reshape(-1, 1)
+
+                n_samples = arguments[name].shape[0]
+
+            else:
+
+                arguments[name] = argument
+
+        if n_samples is None:
+
+            # nothing to propagate
+
+            return None
+
+        # the values of the independent variables in the same order as itertools.product
+
+        grids = np.meshgrid(*self._independent_variable_range, indexing='ij')
+
+        variables = [grid.reshape(1, -1) for grid in grids]
+
+        n_values = variables[0].shape[1]
+
+        with use_astromodels_memoization(False):
+
+            try:
+
+                values = np.asarray(self._get_vectorized_function()(*variables, **arguments), dtype=float)
+
+            except Exception:
+
+                return None
+
+            if values.shape != (n_samples, n_values):
+
+                return None
+
+            for i, j in itertools.product(set([0, n_values - 1]), set([0, n_samples - 1])):
+
+                these_arguments = {}
+
+                for name, argument in arguments.items():
+
+                    these_arguments[name] = argument[j, 0] if np.ndim(argument) > 0 else argument
+
+                expected = self._function(*[variable[0, i] for variable in variables], **these_arguments)
+
+                if not np.allclose(values[j, i], expected, equal_nan=True):
+
+                    return None
+
+        return values.T
+
     @property
     def values(self):
         """
@@ -247,18 +338,19 @@ class VariatesContainer(object):
         properties. Therefore, the transform method is used which applies a function to the output properties,
         e.g., a unit association and or conversion.
 
+        The samples are stored as a (n_values, n_samples) array, and the properties of all the values are computed
+        at once along the samples axis.
 
-
-        :param values: a flat List of RandomVariates
+        :param values: a flat List of RandomVariates, or a (n_values, n_samples) array of samples
         :param out_shape: the array shape for the output variables
         :param cl: the confidence level to calculate error intervals on
         :param transform: a method to transform the outputs
         :param equal_tailed: whether to use equal-tailed error intervals or not
         """
 
+        # (n_values, n_samples)
 
-
-        self._values = values # type: list
+        self._samples_matrix = np.atleast_2d(np.array(values, dtype=float))
 
         self._out_shape = out_shape #type: tuple
 
@@ -271,66 +363,43 @@ class VariatesContainer(object):
         # calculate mean and median and transform them into the provided
         # output shape
 
-        self._average = np.array([val.average for val in self._values])
+        self._average = self._samples_matrix.mean(axis=1).reshape(self._out_shape)
 
-        self._average = self._average.reshape(self._out_shape)
-
-        self._median = np.array([val.median for val in self._values])
-
-        self._median = self._median.reshape(self._out_shape)
+        self._median = np.median(self._samples_matrix, axis=1).reshape(self._out_shape)
 
         # construct the error intervals
 
-        upper_error = []
-        lower_error = []
-
         # if equal tailed errors requested
         if equal_tailed:
 
-            for val in self._values:
-
-                error = val.equal_tail_interval(self._cl)
-                upper_error.append(error[1])
-                lower_error.append(error[0])
+            lower_error, upper_error = equal_tail_intervals(self._samples_matrix, self._cl)
 
         else:
 
             # else use the hdp
 
-            for val in self._values:
-
-                error = val.highest_posterior_density_interval(self._cl)
-                upper_error.append(error[1])
-                lower_error.append(error[0])
+            lower_error, upper_error = highest_posterior_density_intervals(self._samples_matrix, self._cl)
 
         # reshape the errors into the output shape
 
-        self._upper_error = np.array(upper_error).reshape(self._out_shape)
-        self._lower_error = np.array(lower_error).reshape(self._out_shape)
-
-
-
-        samples = []
+        self._upper_error = upper_error.reshape(self._out_shape)
+        self._lower_error = lower_error.reshape(self._out_shape)
 
-        for val in self._values:
-
-            samples.append(val.samples)
-
-        n_samples = len(samples[0])
+        n_samples = self._samples_matrix.shape[1]
 
         samples_shape = list(self._out_shape) + [n_samples]
 
         self._samples_shape = tuple(samples_shape)
 
-        self._samples = np.array(samples).reshape(samples_shape)
+        self._samples = self._samples_matrix.reshape(samples_shape)
 
     @property
     def values(self):
         """
-        :return: the list of of RandomVariates
+        :return: the list of of RandomVariates (with the median as their value)
         """
 
-        return self._values
+        return [RandomVariates(samples, value=np.median(samples)) for samples in self._samples_matrix]
 
     @property
     @transform
@@ -392,12 +461,7 @@ class VariatesContainer(object):
 
         assert other._out_shape == self._out_shape, 'cannot sum together arrays with different shapes!'
 
-        # this will get the value container for the other values
-
-        other_values = other.values
-
-
-        summed_values = [v+vo for v,vo in zip(self._values, other_values)]
+        summed_values = self._samples_matrix + other._samples_matrix
 
         return VariatesContainer(summed_values, self._out_shape, self._cl, self._transform, self._equal_tailed)
 
@@ -409,9 +473,7 @@ class VariatesContainer(object):
 
         else:
 
-            other_values = other.values
-
-            summed_values = [v + vo for v, vo in zip(self._values, other_values)]
+            summed_values = self._samples_matrix + other._samples_matrix
 
             return VariatesContainer(summed_values, self._out_shape, self._cl, self._transform, self._equal_tailed)
 
@@ -1,6 +1,5 @@
 import re
 import copy
-from operator import itemgetter, attrgetter
 import numpy as np
 
 
@@ -151,17 +150,80 @@ class Interval(object):
             return self.start == other.start and self.stop == other.stop
 
 
+class _IntervalArrays(object):
+    """
+    The starts and stops of a set of intervals, used to build an IntervalSet
+    (or a subclass) from arrays without creating the Interval objects
+    """
+
+    def __init__(self, starts, stops):
+
+        self.starts = starts
+        self.stops = stops
+
+    def __len__(self):
+
+        return self.starts.shape[0]
+
+
 class IntervalSet(object):
     """
     A set of intervals
 
+    The starts and stops of the intervals are stored as arrays, so that the operations
+    on the whole set are vectorized. The Interval objects are created only when they are
+    accessed (by iterating or indexing the set).
+
     """
 
     INTERVAL_TYPE = Interval
 
     def __init__(self, list_of_intervals=()):
 
-        self._intervals = list(list_of_intervals)
+        if isinstance(list_of_intervals, _IntervalArrays):
+
+            self._set_arrays(list_of_intervals.starts, list_of_intervals.stops)
+
+        elif isinstance(list_of_intervals, IntervalSet):
+
+            self._set_arrays(list_of_intervals._starts.copy(), list_of_intervals._stops.copy())
+
+        else:
+
+            intervals = list(list_of_intervals)
+
+            if None in intervals:
+
+                raise RuntimeError("Cannot create an interval set with undefined (None) intervals")
+
+            self._set_arrays(np.array([interval.start for interval in intervals], dtype=float),
+                             np.array([interval.stop for interval in intervals], dtype=float))
+
+            # keep the objects we were given
+
+            self._interval_list = intervals
+
+    def _set_arrays(self, starts, stops):
+
+        self._starts = np.ascontiguousarray(starts, dtype=float)
+        self._stops = np.ascontiguousarray(stops, dtype=float)
+
+        # the Interval objects are created when needed
+
+        self._interval_list = None
+
+    @property
+    def _intervals(self):
+        """
+        the list of Interval objects of the set (created at the first access)
+        """
+
+        if self._interval_list is None:
+
+            self._interval_list = [self.new_interval(start, stop)
+                                   for start, stop in zip(self._starts.tolist(), self._stops.tolist())]
+
+        return self._interval_list
 
     @classmethod
     def new(cls, *args, **kwargs):
@@ -185,6 +247,16 @@ class IntervalSet(object):
 
         return cls.INTERVAL_TYPE(*args, **kwargs)
 
+    def _new_from_arrays(self, starts, stops):
+        """
+        Create a new interval set of this type from arrays of starts and stops
+        :param starts:
+        :param stops:
+        :return: interval set
+        """
+
+        return self.new(_IntervalArrays(starts, stops))
+
     @classmethod
     def from_strings(cls, *intervals):
         """
@@ -228,12 +300,19 @@ class IntervalSet(object):
         assert len(starts) == len(stops), 'starts length: %d and stops length: %d must have same length' % (
         len(starts), len(stops))
 
-        list_of_intervals = []
+        starts = np.array(starts, dtype=float).reshape(-1)
+        stops = np.array(stops, dtype=float).reshape(-1)
 
-        for imin, imax in zip(starts, stops):
-            list_of_intervals.append(cls.new_interval(imin, imax))
+        inverted = stops < starts
 
-        return cls(list_of_intervals)
+        if np.any(inverted):
+
+            idx = np.argmax(inverted)
+
+            raise RuntimeError("Invalid time interval! TSTART must be before TSTOP and TSTOP-TSTART >0. "
+                               "Got tstart = %s and tstop = %s" % (starts[idx], stops[idx]))
+
+        return cls(_IntervalArrays(starts, stops))
 
     @classmethod
     def from_list_of_edges(cls, edges):
@@ -250,97 +329,118 @@ class IntervalSet(object):
 
         edges.sort()
 
-        list_of_intervals = []
+        edges = np.array(edges, dtype=float)
 
-        for imin, imax in zip(edges[:-1], edges[1:]):
-            list_of_intervals.append(cls.new_interval(imin, imax))
+        return cls(_IntervalArrays(edges[:-1], edges[1:]))
 
-        return cls(list_of_intervals)
+    def _merged_arrays(self):
+        """
+        the starts and stops of the set after sorting it and merging the intersecting intervals
 
-    def merge_intersecting_intervals(self, in_place=False):
+        :return: (starts, stops)
         """
 
-        merges intersecting intervals into a contiguous intervals
+        idx = np.argsort(self._starts, kind='mergesort')
 
+        starts = self._starts[idx]
+        stops = self._stops[idx]
 
-        :return:
-        """
+        if starts.shape[0] == 0:
 
-        # get a copy of the sorted intervals
+            return starts, stops
 
-        sorted_intervals = self.sort()
+        # an interval starts a new group if it starts after (or exactly at) the stops of
+        # all the intervals before it. Intervals which only touch are not merged, unless
+        # they also share the start or the stop (as in Interval.overlaps_with)
 
-        new_intervals = []
+        previous_stops = np.maximum.accumulate(stops)
 
-        while (len(sorted_intervals) > 1):
+        new_group = np.ones(starts.shape[0], dtype=bool)
+        new_group[1:] = ((starts[1:] >= previous_stops[:-1]) &
+                         (starts[1:] != starts[:-1]) &
+                         (stops[1:] != previous_stops[:-1]))
 
-            # pop the first interval off the stack
+        first = np.flatnonzero(new_group)
+        last = np.append(first[1:], starts.shape[0]) - 1
 
-            this_interval = sorted_intervals.pop(0)
+        return starts[first], previous_stops[last]
 
-            # see if that interval overlaps with the the next one
+    def merge_intersecting_intervals(self, in_place=False):
+        """
 
-            if this_interval.overlaps_with(sorted_intervals[0]):
+        merges intersecting intervals into a contiguous intervals
 
-                # if so, pop the next one
 
-                next_interval = sorted_intervals.pop(0)
+        :return:
+        """
+
+        starts, stops = self._merged_arrays()
 
-                # and merge the two, appending them to the new intervals
+        if in_place:
 
-                new_intervals.append(this_interval.merge(next_interval))
+            self._set_arrays(starts, stops)
 
-            else:
+        else:
 
-                # otherwise just append this interval
+            return self._new_from_arrays(starts, stops)
 
-                new_intervals.append(this_interval)
+    def intersect(self, interval_set):
+        """
+        Returns a new set with the intersection of this set with the provided one, i.e., the
+        parts covered by both sets. The intersecting intervals of each set are merged first.
 
-                # now if there is only one interval left
-                # it should not overlap with any other interval
-                # and the loop will stop
-                # otherwise, we continue
+        :param interval_set: an IntervalSet instance
+        :return: a new (sorted) interval set
+        """
 
-        # if there was only one interval
-        # or a leftover from the merge
-        # we append it
-        if sorted_intervals:
+        starts_1, stops_1 = self._merged_arrays()
+        starts_2, stops_2 = interval_set._merged_arrays()
 
-            assert len(
-                sorted_intervals) == 1, "there should only be one interval left over, this is a bug"  # pragma: no cover
+        # for each interval of this set, the range of intervals of the other set overlapping with it
 
-            # we want to make sure that the last new interval did not
-            # overlap with the final interval
-            if new_intervals:
+        lows = np.searchsorted(stops_2, starts_1, side='right')
+        highs = np.searchsorted(starts_2, stops_1, side='left')
 
-                if new_intervals[-1].overlaps_with(sorted_intervals[0]):
+        n_overlaps = np.maximum(highs - lows, 0)
 
-                    new_intervals[-1] = new_intervals[-1].merge(sorted_intervals[0])
+        # list all the overlapping pairs
 
-                else:
+        idx_1 = np.repeat(np.arange(starts_1.shape[0]), n_overlaps)
 
-                    new_intervals.append(sorted_intervals[0])
+        offsets = np.arange(idx_1.shape[0]) - np.repeat(np.cumsum(n_overlaps) - n_overlaps, n_overlaps)
 
+        idx_2 = lows[idx_1] + offsets
 
-            else:
+        return self._new_from_arrays(np.maximum(starts_1[idx_1], starts_2[idx_2]),
+                                     np.minimum(stops_1[idx_1], stops_2[idx_2]))
 
-                new_intervals.append(sorted_intervals[0])
+    def extend(self, list_of_intervals):
 
-        if in_place:
+        if isinstance(list_of_intervals, IntervalSet):
 
-            self.__init__(new_intervals)
+            new_starts = list_of_intervals._starts
+            new_stops = list_of_intervals._stops
 
         else:
 
-            return self.new(new_intervals)
+            list_of_intervals = list(list_of_intervals)
 
-    def extend(self, list_of_intervals):
+            new_starts = np.array([interval.start for interval in list_of_intervals], dtype=float)
+            new_stops = np.array([interval.stop for interval in list_of_intervals], dtype=float)
+
+        interval_list = self._interval_list
 
-        self._intervals.extend(list_of_intervals)
+        self._set_arrays(np.append(self._starts, new_starts), np.append(self._stops, new_stops))
+
+        if interval_list is not None:
+
+            interval_list.extend(list_of_intervals)
+
+            self._interval_list = interval_list
 
     def __len__(self):
 
-        return len(self._intervals)
+        return self._starts.shape[0]
 
     def __iter__(self):
 
@@ -353,16 +453,29 @@ class IntervalSet(object):
 
     def __eq__(self, other):
 
-        for interval_this, interval_other in zip(self.argsort(), other.argsort()):
+        # compare the sorted sets (only up to the length of the shortest one)
 
-            if not self[interval_this] == other[interval_other]:
-                return False
+        n_intervals = min(len(self), len(other))
 
-        return True
+        idx_this = self.argsort()[:n_intervals]
+        idx_other = other.argsort()[:n_intervals]
+
+        return bool(np.all(self._starts[idx_this] == other._starts[idx_other]) and
+                    np.all(self._stops[idx_this] == other._stops[idx_other]))
 
     def pop(self, index):
 
-        return self._intervals.pop(index)
+        interval = self[index]
+
+        interval_list = self._interval_list
+
+        self._set_arrays(np.delete(self._starts, index), np.delete(self._stops, index))
+
+        interval_list.pop(index)
+
+        self._interval_list = interval_list
+
+        return interval
 
     def sort(self):
         """
@@ -377,7 +490,9 @@ class IntervalSet(object):
 
         else:
 
-            return self.new(np.atleast_1d(itemgetter(*self.argsort())(self._intervals)))
+            idx = self.argsort()
+
+            return self._new_from_arrays(self._starts[idx], self._stops[idx])
 
     def argsort(self):
         """
@@ -386,10 +501,9 @@ class IntervalSet(object):
         :return:
         """
 
-        # Gather all tstarts
-        tstarts = map(lambda x: x.start, self._intervals)
+        # a stable sort, so that intervals with the same start keep their order
 
-        return map(lambda x: x[0], sorted(enumerate(tstarts), key=itemgetter(1)))
+        return np.argsort(self._starts, kind='mergesort').tolist()
 
     def is_contiguous(self, relative_tolerance=1e-5):
         """
@@ -399,10 +513,7 @@ class IntervalSet(object):
         :return: True or False
         """
 
-        starts = map(attrgetter("start"), self._intervals)
-        stops = map(attrgetter("stop"), self._intervals)
-
-        return np.allclose(starts[1:], stops[:-1], rtol=relative_tolerance)
+        return np.allclose(self._starts[1:], self._stops[:-1], rtol=relative_tolerance)
 
     @property
     def is_sorted(self):
@@ -411,7 +522,7 @@ class IntervalSet(object):
         :return: True or False
         """
 
-        return np.all(self.argsort() == np.arange(len(self)))
+        return bool(np.all(self._starts[1:] >= self._starts[:-1]))
 
     def containing_bin(self, value):
         """
@@ -439,12 +550,11 @@ class IntervalSet(object):
         :return:
         """
 
-        # loop only once because every call unpacks the array
         # we need to round for the comparison because we may have read from
         # strings which are rounded to six decimals
 
-        starts = np.round(self.starts,decimals=6)
-        stops = np.round(self.stops,decimals=6)
+        starts = np.round(self._starts, decimals=6)
+        stops = np.round(self._stops, decimals=6)
 
         start = np.round(start,decimals=6)
         stop = np.round(stop, decimals=6)
@@ -469,10 +579,7 @@ class IntervalSet(object):
 
         else:
 
-            return self.new(np.asarray(self._intervals)[condition])
-
-
-
+            return self._new_from_arrays(self._starts[condition], self._stops[condition])
 
     @property
     def starts(self):
@@ -482,27 +589,27 @@ class IntervalSet(object):
         :return: list of start times
         """
 
-        return [interval.start for interval in self._intervals]
+        return self._starts.tolist()
 
     @property
     def stops(self):
         """
         Return the stops of the set
 
-        :return:
+        :return: list of stop times
         """
 
-        return [interval.stop for interval in self._intervals]
+        return self._stops.tolist()
 
     @property
     def mid_points(self):
 
-        return np.array([interval.mid_point for interval in self._intervals])
+        return (self._starts + self._stops) / 2.0
 
     @property
     def widths(self):
 
-        return np.array([interval._get_width() for interval in self._intervals])
+        return self._stops - self._starts
 
     @property
     def absolute_start(self):
@@ -511,7 +618,7 @@ class IntervalSet(object):
         :return:
         """
 
-        return min(self.starts)
+        return self._starts.min()
 
     @property
     def absolute_stop(self):
@@ -520,7 +627,7 @@ class IntervalSet(object):
         :return:
         """
 
-        return max(self.stops)
+        return self._stops.max()
 
     @property
     def edges(self):
@@ -531,8 +638,7 @@ class IntervalSet(object):
 
         if self.is_contiguous() and self.is_sorted:
 
-            edges = [interval.start for interval in itemgetter(*self.argsort())(self._intervals)]
-            edges.append([interval.stop for interval in itemgetter(*self.argsort())(self._intervals)][-1])
+            edges = np.append(self._starts, self._stops[-1])
 
         else:
 
@@ -560,4 +666,4 @@ class IntervalSet(object):
         :return:
         """
 
-        return np.vstack((self.starts, self.stops)).T
+        return np.vstack((self._starts, self._stops)).T
@@ -91,6 +91,117 @@ def dic(bayes_analysis):
     return -2 * elpd_dic, pdic
 
 
+def integrated_autocorrelation_time(chain, c=5.0):
+    """
+    Estimate the integrated autocorrelation time of each parameter of the chain of an ensemble sampler.
+    The autocorrelation function is computed with a FFT and averaged over the walkers, then summed up to
+    the smallest window M such that M >= c * tau (Sokal's automatic windowing, as in emcee 3).
+
+    :param chain: (n_walkers, n_steps, n_dim) array of samples
+    :param c: the constant of the automatic windowing
+    :return: (n_dim,) array of autocorrelation times (in steps)
+    """
+
+    chain = np.asarray(chain, dtype=float)
+
+    n_steps = chain.shape[1]
+
+    # zero padding to twice the length (rounded to a power of 2) avoids the circular correlation
+
+    n_fft = 2 ** int(np.ceil(np.log2(2 * n_steps)))
+
+    deviations = chain - chain.mean(axis=1, keepdims=True)
+
+    transform = np.fft.rfft(deviations, n=n_fft, axis=1)
+
+    acf = np.fft.irfft(transform * np.conjugate(transform), n=n_fft, axis=1)[:, :n_steps, :]
+
+    # normalize each walker to 1 at lag 0 (a walker which never moved has no correlation)
+
+    variance = acf[:, :1, :]
+
+    acf = np.where(variance > 0, acf / np.where(variance > 0, variance, 1.0), 0.0)
+
+    acf = acf.mean(axis=0)
+
+    # (n_steps, n_dim) estimates of tau for each window
+
+    taus = 2.0 * np.cumsum(acf, axis=0) - 1.0
+
+    # the first window larger than c times the estimate (or the whole chain)
+
+    too_small = np.arange(n_steps)[:, np.newaxis] < c * taus
+
+    windows = np.where(np.all(too_small, axis=0), n_steps - 1, np.argmin(too_small, axis=0))
+
+    return taus[windows, np.arange(taus.shape[1])]
+
+
+def effective_sample_size(chain, c=5.0):
+    """
+    The effective number of independent samples of each parameter of the chain of an ensemble sampler
+
+    :param chain: (n_walkers, n_steps, n_dim) array of samples
+    :param c: the constant of the automatic windowing (see integrated_autocorrelation_time)
+    :return: (n_dim,) array of effective sample sizes
+    """
+
+    n_walkers, n_steps = chain.shape[:2]
+
+    return n_walkers * n_steps / integrated_autocorrelation_time(chain, c)
+
+
+def split_r_hat(chain):
+    """
+    The split-R_hat statistic of Gelman et al. (Bayesian Data Analysis, 3rd ed.) for each parameter. The chain of
+    each walker is split in two halves, and the variance between the halves is compared with the variance within
+    them. Values close to 1 indicate that the chains are stationary and mixed.
+
+    :param chain: (n_walkers, n_steps, n_dim) array of samples, with n_steps >= 4
+    :return: (n_dim,) array of R_hat values
+    """
+
+    chain = np.asarray(chain, dtype=float)
+
+    n = chain.shape[1] // 2
+
+    assert n >= 2, "The chain must have at least 4 steps to compute R_hat"
+
+    # (2 * n_walkers, n, n_dim)
+
+    halves = np.concatenate([chain[:, :n, :], chain[:, -n:, :]], axis=0)
+
+    within = halves.var(axis=1, ddof=1).mean(axis=0)
+
+    between = n * halves.mean(axis=1).var(axis=0, ddof=1)
+
+    pooled = (n - 1.0) / n * within + between / n
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        return np.sqrt(pooled / within)
+
+
+def correlation_matrix(covariance):
+    """
+    The correlation matrix corresponding to a covariance matrix. The elements involving a parameter with a
+    non-positive variance (which might happen if a fit or the numerical differentiation failed) are nan.
+
+    :param covariance: (n_parameters, n_parameters) covariance matrix
+    :return: (n_parameters, n_parameters) correlation matrix
+    """
+
+    covariance = np.asarray(covariance, dtype=float)
+
+    variances = np.diag(covariance)
+
+    products = np.outer(variances, variances)
+
+    valid = products > 0
+
+    return np.where(valid, covariance / np.sqrt(np.where(valid, products, 1.0)), np.nan)
+
+
 def sqrt_sum_of_squares(arg):
     """
     :param arg: and array of number to be squared and summed
@@ -2,6 +2,7 @@ from threeML.utils.interval import Interval, IntervalSet
 from threeML.io.rich_display import display
 
 import collections
+import numpy as np
 import pandas as pd
 
 
@@ -118,10 +119,7 @@ class TimeIntervalSet(IntervalSet):
         :return: new TimeIntervalSet instance
         """
 
-        new_set = self.new()
-        new_set.extend([time_interval + number for time_interval in self._intervals])
-
-        return new_set
+        return self._new_from_arrays(self._starts + number, self._stops + number)
 
     def __sub__(self, number):
         """
@@ -131,28 +129,16 @@ class TimeIntervalSet(IntervalSet):
         :return: new TimeIntervalSet instance
         """
 
-        new_set = self.new([time_interval - number for time_interval in self._intervals])
-
-        return new_set
+        return self._new_from_arrays(self._starts - number, self._stops - number)
 
     def _create_pandas(self):
 
         time_interval_dict = collections.OrderedDict()
 
-        time_interval_dict['Start'] = []
-        time_interval_dict['Stop'] = []
-        time_interval_dict['Duration'] = []
-        time_interval_dict['Midpoint'] = []
-
-
-
-        for i, interval in enumerate(self._intervals):
-
-
-            time_interval_dict['Start'].append(interval.start)
-            time_interval_dict['Stop'].append(interval.stop)
-            time_interval_dict['Duration'].append(interval.duration)
-            time_interval_dict['Midpoint'].append(interval.half_time)
+        time_interval_dict['Start'] = self.starts
+        time_interval_dict['Stop'] = self.stops
+        time_interval_dict['Duration'] = self.widths
+        time_interval_dict['Midpoint'] = self.mid_points
 
         df = pd.DataFrame(data=time_interval_dict)
 
@@ -175,4 +161,217 @@ class TimeIntervalSet(IntervalSet):
         return self._create_pandas().to_string()
 
 
+class GoodTimeIntervals(object):
+    """
+    A set of good time intervals (GTIs) stored as sorted arrays of edges, so that
+    times and intervals can be checked against all of the GTIs at once with a binary search.
+
+    Overlapping or touching GTIs are merged. All the GTIs are closed intervals.
+
+    """
+
+    def __init__(self, starts, stops):
+        """
+
+        :param starts: the start times of the GTIs
+        :param stops: the stop times of the GTIs
+        """
+
+        starts = np.atleast_1d(np.asarray(starts, dtype=float))
+        stops = np.atleast_1d(np.asarray(stops, dtype=float))
+
+        assert starts.shape == stops.shape, "GTI starts (%d) and stops (%d) have different shapes" % (starts.shape[0],
+                                                                                                       stops.shape[0])
+
+        assert np.all(starts <= stops), "The GTIs must have start <= stop"
+
+        idx = np.argsort(starts, kind='mergesort')
+
+        starts = starts[idx]
+        stops = stops[idx]
+
+        # merge the overlapping GTIs: a new GTI begins wherever the start is after all
+        # the stops which came before
+
+        if starts.shape[0] > 0:
+
+            previous_stops = np.maximum.accumulate(stops)
+
+            new_gti = np.ones(starts.shape[0], dtype=bool)
+            new_gti[1:] = starts[1:] > previous_stops[:-1]
+
+            first = np.flatnonzero(new_gti)
+            last = np.append(first[1:], starts.shape[0]) - 1
+
+            starts = starts[first]
+            stops = previous_stops[last]
+
+        self._starts = starts
+        self._stops = stops
+
+    @classmethod
+    def from_time_interval_set(cls, time_interval_set):
+        """
+        Build the GTIs from a TimeIntervalSet
+
+        :param time_interval_set: a TimeIntervalSet
+        :return: a GoodTimeIntervals instance
+        """
+
+        return cls(time_interval_set.start_times, time_interval_set.stop_times)
+
+    def to_time_interval_set(self):
+        """
+
+        :return: the GTIs as a TimeIntervalSet
+        """
+
+        return TimeIntervalSet.from_starts_and_stops(self._starts, self._stops)
+
+    @property
+    def starts(self):
+
+        return self._starts
+
+    @property
+    def stops(self):
+
+        return self._stops
+
+    @property
+    def total_duration(self):
+
+        return np.sum(self._stops - self._starts)
+
+    def __len__(self):
+
+        return self._starts.shape[0]
+
+    def __add__(self, number):
+        """
+        Return new GTIs shifted to the right by number
+
+        :param number: a float
+        :return: a new GoodTimeIntervals instance
+        """
+
+        return GoodTimeIntervals(self._starts + number, self._stops + number)
+
+    def __sub__(self, number):
+        """
+        Return new GTIs shifted to the left by number
+
+        :param number: a float
+        :return: a new GoodTimeIntervals instance
+        """
+
+        return GoodTimeIntervals(self._starts - number, self._stops - number)
+
+    def _gti_index(self, times):
+
+        # index of the last GTI starting at or before each time (-1 if none)
+
+        return np.searchsorted(self._starts, times, side='right') - 1
+
+    def contains(self, times):
+        """
+        Check which of the times fall within a GTI
+
+        :param times: a time or an array of times
+        :return: a boolean (for a single time) or an array of booleans
+        """
+
+        times_ = np.asarray(times, dtype=float)
+
+        if len(self) == 0:
+
+            result = np.zeros(times_.shape, dtype=bool)
+
+        else:
+
+            idx = self._gti_index(times_)
+
+            result = (idx >= 0) & (times_ <= self._stops[np.maximum(idx, 0)])
+
+        if times_.ndim == 0:
+
+            return bool(result)
+
+        return result
+
+    def contains_intervals(self, starts, stops):
+        """
+        Check which intervals are completely contained in a GTI
+
+        :param starts: array of interval starts
+        :param stops: array of interval stops
+        :return: array of booleans
+        """
+
+        starts = np.asarray(starts, dtype=float)
+        stops = np.asarray(stops, dtype=float)
+
+        if len(self) == 0:
+
+            return np.zeros(starts.shape, dtype=bool)
+
+        idx = self._gti_index(starts)
+
+        return (idx >= 0) & (stops <= self._stops[np.maximum(idx, 0)])
+
+    def integral(self, cumulative_function, starts, stops):
+        """
+        Integrate a quantity over the parts of the intervals which fall within the GTIs.
+
+        :param cumulative_function: a vectorized function returning the integral of the quantity from an
+        arbitrary origin up to each of the given times (for example, the live time accumulated up to each time)
+        :param starts: array of interval starts
+        :param stops: array of interval stops
+        :return: array with the integral over each interval
+        """
+
+        starts = np.asarray(starts, dtype=float)
+        stops = np.asarray(stops, dtype=float)
+
+        if len(self) == 0:
+
+            return np.zeros(starts.shape)
+
+        # integral over each GTI and over all the GTIs before each one
+
+        cumulative_at_starts = cumulative_function(self._starts)
+
+        per_gti = cumulative_function(self._stops) - cumulative_at_starts
+
+        before_gti = np.zeros(len(self))
+
+        np.cumsum(per_gti[:-1], out=before_gti[1:])
+
+        def integral_up_to(times):
+
+            idx = self._gti_index(times)
+
+            safe_idx = np.maximum(idx, 0)
+
+            # the GTI containing each time is only partially covered
+
+            partial = cumulative_function(np.minimum(times, self._stops[safe_idx])) - cumulative_at_starts[safe_idx]
+
+            return np.where(idx >= 0, before_gti[safe_idx] + partial, 0.)
+
+        return integral_up_to(stops) - integral_up_to(starts)
+
+    def duration_within(self, starts, stops):
+        """
+        The time covered by the GTIs within each interval
+
+        :param starts: array of interval starts
+        :param stops: array of interval stops
+        :return: array of durations
+        """
+
+        return self.integral(lambda times: np.asarray(times, dtype=float), starts, stops)
+
+    def __repr__(self):
 
+        return self.to_time_interval_set().__repr__()
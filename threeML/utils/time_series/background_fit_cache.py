@@ -0,0 +1,291 @@
+import glob
+import hashlib
+import os
+
+import numpy as np
+
+from threeML.config.config import threeML_config
+from threeML.exceptions.custom_exceptions import custom_warnings
+from threeML.io.file_utils import if_directory_not_existing_then_make
+from threeML.io.package_data import get_path_of_user_dir
+
+# Two selections are considered similar enough to warm start a fit if the time they do not have in common
+# is less than this fraction of the total time they cover
+
+_WARM_START_TOLERANCE = 0.1
+
+
+def hash_arrays(*items):
+    """
+    Compute a hash of a set of arrays (and/or strings and numbers)
+
+    :param items: arrays, strings or numbers
+    :return: the hex digest of the hash
+    """
+
+    sha = hashlib.sha1()
+
+    for item in items:
+
+        if isinstance(item, np.ndarray):
+
+            array = np.ascontiguousarray(item)
+
+            sha.update(str(array.dtype))
+            sha.update(str(array.shape))
+            sha.update(array.data)
+
+        else:
+
+            sha.update(repr(item))
+
+        # separator, so that the concatenation of two items cannot be confused with another item
+
+        sha.update('|')
+
+    return sha.hexdigest()
+
+
+class BackgroundFitCache(object):
+
+    def __init__(self, cache_directory, max_size):
+        """
+        A cache of background polynomial fits stored in a directory. Each fit is stored in a .npz file named after
+        the group (the data, the order and the fit method) and the key (the group and the polynomial selections)
+        of the fit. When the total size of the cache exceeds max_size, the least recently used fits are removed.
+
+        :param cache_directory: the directory where the fits are stored
+        :param max_size: the maximum size of the cache in bytes
+        """
+
+        self._cache_directory = cache_directory
+
+        self._max_size = max_size
+
+    @property
+    def cache_directory(self):
+
+        return self._cache_directory
+
+    def _file_name(self, group, key):
+
+        return os.path.join(self._cache_directory, "%s_%s.npz" % (group, key))
+
+    def get(self, group, key):
+        """
+        Get a fit from the cache
+
+        :param group: the group of the fit
+        :param key: the key of the fit
+        :return: a dictionary with the fit, or None if the fit is not in the cache
+        """
+
+        file_name = self._file_name(group, key)
+
+        if not os.path.exists(file_name):
+
+            return None
+
+        try:
+
+            fit = self._read(file_name)
+
+            # mark as recently used
+
+            os.utime(file_name, None)
+
+        except Exception:
+
+            # a corrupted entry is simply ignored (and will be overwritten)
+
+            return None
+
+        return fit
+
+    def get_warm_start(self, group, starts, stops):
+        """
+        Look for a fit of the same group whose polynomial selections are similar to the given ones
+
+        :param group: the group of the fit
+        :param starts: the starts of the polynomial selections
+        :param stops: the stops of the polynomial selections
+        :return: a dictionary with the fit, or None if there is no similar fit in the cache
+        """
+
+        best_fit = None
+        best_difference = _WARM_START_TOLERANCE
+
+        for file_name in glob.glob(os.path.join(self._cache_directory, "%s_*.npz" % group)):
+
+            try:
+
+                fit = self._read(file_name)
+
+            except Exception:
+
+                continue
+
+            difference = _selection_difference(starts, stops, fit['starts'], fit['stops'])
+
+            if difference < best_difference:
+
+                best_fit = fit
+                best_difference = difference
+
+        return best_fit
+
+    def put(self, group, key, coefficients, covariances, grade, bin_type, fit_method, starts, stops):
+        """
+        Store a fit in the cache
+
+        :param group: the group of the fit
+        :param key: the key of the fit
+        :param coefficients: (n_channels, grade + 1) array of coefficients
+        :param covariances: (n_channels, grade + 1, grade + 1) array of covariance matrices
+        :param grade: the grade of the polynomials
+        :param bin_type: the bin type of the fit
+        :param fit_method: the fit method
+        :param starts: the starts of the polynomial selections
+        :param stops: the stops of the polynomial selections
+        :return: none
+        """
+
+        try:
+
+            if_directory_not_existing_then_make(self._cache_directory)
+
+            file_name = self._file_name(group, key)
+
+            # write to a temporary file first, so that a concurrent reader never sees a partial file
+
+            temporary_file_name = "%s.%d.tmp" % (file_name, os.getpid())
+
+            with open(temporary_file_name, 'wb') as f:
+
+                np.savez(f,
+                         coefficients=coefficients,
+                         covariances=covariances,
+                         grade=grade,
+                         bin_type=bin_type,
+                         fit_method=fit_method,
+                         starts=starts,
+                         stops=stops)
+
+            os.rename(temporary_file_name, file_name)
+
+            self._evict()
+
+        except (IOError, OSError) as e:
+
+            custom_warnings.warn("Could not store the background fit in the cache %s: %s" % (self._cache_directory, e))
+
+    def clear(self):
+        """
+        Remove all the fits from the cache
+
+        :return: none
+        """
+
+        for file_name in glob.glob(os.path.join(self._cache_directory, "*.npz")):
+
+            os.remove(file_name)
+
+    def _evict(self):
+
+        entries = []
+
+        for file_name in glob.glob(os.path.join(self._cache_directory, "*.npz")):
+
+            stat = os.stat(file_name)
+
+            entries.append((stat.st_mtime, stat.st_size, file_name))
+
+        total_size = sum(entry[1] for entry in entries)
+
+        # remove the least recently used first
+
+        for _, size, file_name in sorted(entries):
+
+            if total_size <= self._max_size:
+
+                break
+
+            try:
+
+                os.remove(file_name)
+
+            except OSError:
+
+                continue
+
+            total_size -= size
+
+    @staticmethod
+    def _read(file_name):
+
+        with np.load(file_name) as data:
+
+            fit = {'coefficients': data['coefficients'],
+                   'covariances': data['covariances'],
+                   'grade': int(data['grade']),
+                   'bin type': str(data['bin_type']),
+                   'fit method': str(data['fit_method']),
+                   'starts': data['starts'],
+                   'stops': data['stops']}
+
+        return fit
+
+
+def _selection_difference(starts1, stops1, starts2, stops2):
+    """
+    The fraction of the time covered by either of two sets of (non-overlapping) intervals
+    which is not covered by both
+
+    :return: a number between 0 and 1
+    """
+
+    edges = np.unique(np.concatenate([starts1, stops1, starts2, stops2]).astype(float))
+
+    if edges.shape[0] < 2:
+
+        return 1.
+
+    # check which elementary segments are covered by each set
+
+    mid_points = 0.5 * (edges[1:] + edges[:-1])
+    widths = np.diff(edges)
+
+    def covered(starts, stops):
+
+        starts = np.asarray(starts)
+        stops = np.asarray(stops)
+
+        return np.any((mid_points[:, np.newaxis] >= starts) & (mid_points[:, np.newaxis] <= stops), axis=1)
+
+    in_first = covered(starts1, stops1)
+    in_second = covered(starts2, stops2)
+
+    union = widths[in_first | in_second].sum()
+
+    if union == 0:
+
+        return 1.
+
+    return widths[in_first ^ in_second].sum() / union
+
+
+def get_background_fit_cache(cache_directory=None):
+    """
+    The background fit cache, with the maximum size from the configuration
+
+    :param cache_directory: the directory of the cache (default: ~/.threeML/.cache/background_fits)
+    :return: a BackgroundFitCache instance
+    """
+
+    if cache_directory is None:
+
+        cache_directory = os.path.join(get_path_of_user_dir(), '.cache', 'background_fits')
+
+    max_size = threeML_config['event list']['background cache size in MB'] * 1024 ** 2
+
+    return BackgroundFitCache(cache_directory, max_size)
@@ -1,11 +1,10 @@
 import numpy as np
 
 from threeML.config.config import threeML_config
-from threeML.io.plotting.light_curve_plots import binned_light_curve_plot
-from threeML.io.progress_bar import progress_bar
+from threeML.utils.binner import TemporalBinner
 from threeML.utils.spectrum.binned_spectrum_set import BinnedSpectrumSet
 from threeML.utils.time_interval import TimeIntervalSet
-from threeML.utils.time_series.polynomial import polyfit
+from threeML.utils.time_series.polynomial import polyfit, batch_polyfit, PolynomialSet
 from threeML.utils.time_series.time_series import TimeSeries
 
 
@@ -41,89 +40,164 @@ class BinnedSpectrumSeries(TimeSeries):
 
         self._binned_spectrum_set = binned_spectrum_set
 
+        self._temporal_binner = None
+
+        # the bins sorted in time and the cumulative counts and exposure over them, so that
+        # the bins contained in any interval are found with a binary search. The edges are rounded
+        # as in TimeIntervalSet.containing_interval because selections may be read from strings
+
+        time_intervals = binned_spectrum_set.time_intervals
+
+        self._bin_order = np.argsort(time_intervals.start_times, kind='mergesort')
+
+        self._sorted_bin_starts = np.round(np.asarray(time_intervals.start_times)[self._bin_order], decimals=6)
+        self._sorted_bin_stops = np.round(np.asarray(time_intervals.stop_times)[self._bin_order], decimals=6)
+
+        # the spectrum set builds these arrays from its list of spectra at each access, so keep them
+
+        self._counts_per_bin = binned_spectrum_set.counts_per_bin
+        self._exposure_per_bin = binned_spectrum_set.exposure_per_bin
+
+        n_bins = self._counts_per_bin.shape[0]
+
+        self._cumulative_counts = np.zeros((n_bins + 1, self._counts_per_bin.shape[1]))
+        np.cumsum(self._counts_per_bin[self._bin_order], axis=0, out=self._cumulative_counts[1:])
+
+        self._cumulative_exposure = np.zeros(n_bins + 1)
+        np.cumsum(self._exposure_per_bin[self._bin_order], out=self._cumulative_exposure[1:])
+
+    def _data_fingerprint(self):
+        """
+        the arrays identifying the data in the background fit cache
+        :return:
+        """
+
+        return [self._sorted_bin_starts, self._sorted_bin_stops, self._cumulative_counts, self._cumulative_exposure]
+
+    def _contained_bin_slices(self, starts, stops):
+        """
+        the range of (time sorted) bins which are completely contained in each of the intervals
+
+        :param starts: array of start times
+        :param stops: array of stop times
+        :return: (lows, highs) such that the bins lows[i]:highs[i] are within the interval i
+        """
+
+        starts = np.round(np.atleast_1d(np.asarray(starts, dtype=float)), decimals=6)
+        stops = np.round(np.atleast_1d(np.asarray(stops, dtype=float)), decimals=6)
+
+        lows = np.searchsorted(self._sorted_bin_starts, starts, side='left')
+        highs = np.searchsorted(self._sorted_bin_stops, stops, side='right')
+
+        return lows, np.maximum(highs, lows)
+
     @property
     def bins(self):
         """
-        the time bins of the spectrum set
+        the time bins of the spectrum set, or the blocks of native bins
+        if they have been created with bin_by_bayesian_blocks
         :return: TimeIntervalSet
         """
 
+        if self._temporal_binner is not None:
 
+            return self._temporal_binner
 
         return self._binned_spectrum_set.time_intervals
 
-    def view_lightcurve(self, start=-10, stop=20., dt=1., use_binner=False):
-        # type: (float, float, float, bool) -> None
-
+    def bin_by_bayesian_blocks(self, start, stop, p0, use_background=False):
         """
-        :param start:
-        :param stop:
-        :param dt:
-        :param use_binner:
+        group the native time bins between start and stop in Bayesian blocks, using
+        the total counts (all channels) of each bin
 
+        :param start: start of the interval to bin
+        :param stop: stop of the interval to bin
+        :param p0: the false positive probability
+        :param use_background: find the blocks with respect to the background polynomials
+        :return:
         """
 
-        # git a set of bins containing the intervals
-
-        bins = self._binned_spectrum_set.time_intervals.containing_interval( start, stop) # type: TimeIntervalSet
-
-        cnts = []
-        width = []
+        mask = self._select_bins(start, stop)
 
-        for bin in bins:
+        time_intervals = self._binned_spectrum_set.time_intervals
 
-            cnts.append(self.counts_over_interval(bin.start_time, bin.stop_time) )
-            width.append(bin.duration)
+        starts = np.asarray(time_intervals.start_times)[mask]
+        stops = np.asarray(time_intervals.stop_times)[mask]
 
+        edges = np.append(starts, stops[-1])
 
-        # now we want to get the estimated background from the polynomial fit
+        counts = self._counts_per_bin[mask].sum(axis=1)
 
-        if self.poly_fit_exists:
+        if use_background:
 
-            bkg = []
-            for j, tb in enumerate(bins):
-                tmpbkg = 0.
-                for poly in self.polynomials:
-                    tmpbkg += poly.integral(tb.start_time, tb.stop_time)
+            integral_background = lambda t: self.get_total_poly_count(starts[0], t)
 
-                bkg.append(tmpbkg / width[j])
+            self._temporal_binner = TemporalBinner.bin_by_binned_bayesian_blocks(
+                edges, counts, p0, bkg_integral_distribution=integral_background)
 
         else:
 
-            bkg = None
+            self._temporal_binner = TemporalBinner.bin_by_binned_bayesian_blocks(edges, counts, p0)
 
-        # pass all this to the light curve plotter
+    def view_lightcurve(self, start=-10, stop=20., dt=1., use_binner=False, mask=None):
+        # type: (float, float, float, bool) -> None
 
-        if self.time_intervals is not None:
+        """
+        :param start:
+        :param stop:
+        :param dt:
+        :param use_binner:
+        :param mask: (optional) boolean mask of the channels to plot
 
-            selection = self.time_intervals.bin_stack
+        """
 
-        else:
+        # git a set of bins containing the intervals
 
-            selection = None
+        bins = self._binned_spectrum_set.time_intervals.containing_interval( start, stop) # type: TimeIntervalSet
 
-        if self.poly_intervals is not None:
+        light_curve = self.light_curve(bins.start_times, bins.stop_times, mask)
 
-            bkg_selection = self.poly_intervals.bin_stack
+        # plot the light curve. The rates of binned data are per unit of time (the duration of the
+        # bins), not per unit of exposure
 
-        else:
+        return self._plot_light_curve(light_curve, use_exposure=False)
 
-            bkg_selection = None
+    def counts_over_intervals(self, starts, stops):
+        """
+        return the number of counts in each of the given intervals (summed over the bins
+        completely contained in each interval)
+        :param starts: array of start times
+        :param stops: array of stop times
+        :return: array of counts
+        """
 
+        return self.count_per_channel_over_intervals(starts, stops).sum(axis=1)
 
-        # plot the light curve
+    def count_per_channel_over_intervals(self, starts, stops):
+        """
+        return the number of counts per channel in each of the given intervals (summed over the bins
+        completely contained in each interval)
+        :param starts: array of start times
+        :param stops: array of stop times
+        :return: (n_intervals, n_channels) array of counts
+        """
 
-        fig = binned_light_curve_plot(time_bins=bins.bin_stack,
-                                cnts=np.array(cnts),
-                                width=np.array(width),
-                                bkg=bkg,
-                                selection=selection,
-                                bkg_selections=bkg_selection)
+        lows, highs = self._contained_bin_slices(starts, stops)
 
+        return self._cumulative_counts[highs] - self._cumulative_counts[lows]
 
+    def exposure_over_intervals(self, starts, stops):
+        """
+        return the exposure in each of the given intervals (summed over the bins
+        completely contained in each interval)
+        :param starts: array of start times
+        :param stops: array of stop times
+        :return: array of exposures
+        """
 
-        return fig
+        lows, highs = self._contained_bin_slices(starts, stops)
 
+        return self._cumulative_exposure[highs] - self._cumulative_exposure[lows]
 
     def counts_over_interval(self, start, stop):
         """
@@ -133,22 +207,7 @@ class BinnedSpectrumSeries(TimeSeries):
         :return:
         """
 
-        # this will be a boolean list and the sum will be the
-        # number of events
-
-        bins = self._select_bins(start, stop)
-
-        total_counts = 0
-
-        for idx in np.where(bins)[0]:
-
-            # sum over channels because we just want the total counts
-
-            total_counts += self._binned_spectrum_set[idx].counts.sum()
-
-
-        return total_counts
-
+        return self.counts_over_intervals([start], [stop])[0]
 
     def count_per_channel_over_interval(self, start, stop):
         """
@@ -158,74 +217,85 @@ class BinnedSpectrumSeries(TimeSeries):
         :return:
         """
 
-        # this will be a boolean list and the sum will be the
-        # number of events
-
-        bins = self._select_bins(start, stop)
-
-        total_counts = np.zeros(self._n_channels)
-
-        for idx in np.where(bins)[0]:
-
-            # don't sum over channels because we want the spectrum
-            total_counts += self._binned_spectrum_set[idx].counts
-
-        return total_counts
-
+        return self.count_per_channel_over_intervals([start], [stop])[0]
 
     def _select_bins(self, start, stop):
         """
-        return an index of the selected bins
+        return a mask of the selected bins
         :param start: start time
         :param stop: stop time
-        :return: int indices
+        :return: boolean mask
         """
 
-        return self._binned_spectrum_set.time_intervals.containing_interval(start,stop,as_mask=True)
+        return self._select_bins_over_intervals([start], [stop])
 
-    def _adjust_to_true_intervals(self, time_intervals):
+    def _select_bins_over_intervals(self, starts, stops):
         """
+        return a mask of the bins completely contained in any of the intervals
 
-        adjusts time selections to those of the Binned spectrum set
+        :param starts: array of start times
+        :param stops: array of stop times
+        :return: boolean mask (in the order of the bins of the spectrum set)
+        """
 
+        lows, highs = self._contained_bin_slices(starts, stops)
 
-        :param time_intervals: a time interval set
-        :return: an adjusted time interval set
-        """
+        # mark the edges of each range and integrate, so that the bins covered by at least
+        # one range have a positive value
 
-        # get all the starts and stops from these time intervals
+        n_bins = self._bin_order.shape[0]
 
-        true_starts = np.array(self._binned_spectrum_set.time_intervals.start_times)
-        true_stops = np.array(self._binned_spectrum_set.time_intervals.stop_times)
+        coverage = np.zeros(n_bins + 1, dtype=int)
 
-        new_starts = []
-        new_stops = []
+        np.add.at(coverage, lows, 1)
+        np.add.at(coverage, highs, -1)
 
-        # now go thru all the intervals
-        for interval in time_intervals:
+        sorted_mask = np.cumsum(coverage[:-1]) > 0
 
-            # find where the suggest intervals hits the true interval
+        # back to the original order of the bins
 
-            # searchsorted is fast, but is not returing what we want
-            # we want the actaul values of the bins closest to the input
+        mask = np.zeros(n_bins, dtype=bool)
 
-            #idx = np.searchsorted(true_starts, interval.start_time,side)
+        mask[self._bin_order] = sorted_mask
 
-            idx = (np.abs(true_starts - interval.start_time)).argmin()
+        return mask
 
+    def _nearest_edges(self, sorted_edges, times):
+        """
+        find the edges closest to each of the given times
 
-            new_start = true_starts[idx]
+        :param sorted_edges: sorted array of edges
+        :param times: array of times
+        :return: array of the closest edges
+        """
+
+        idx = np.searchsorted(sorted_edges, times)
+
+        # compare the edges on the left and on the right of each time. In case of a tie the
+        # earliest edge is kept
+
+        left = sorted_edges[np.clip(idx - 1, 0, sorted_edges.shape[0] - 1)]
+        right = sorted_edges[np.clip(idx, 0, sorted_edges.shape[0] - 1)]
+
+        return np.where(np.abs(times - left) <= np.abs(right - times), left, right)
+
+    def _adjust_to_true_intervals(self, time_intervals):
+        """
 
-            #idx = np.searchsorted(true_stops, interval.stop_time)
+        adjusts time selections to those of the Binned spectrum set
 
-            idx = (np.abs(true_stops - interval.stop_time)).argmin()
 
+        :param time_intervals: a time interval set
+        :return: an adjusted time interval set
+        """
 
-            new_stop = true_stops[idx]
+        # we want the actual values of the bin edges closest to the input
 
-            new_starts.append(new_start)
+        true_starts = np.sort(self._binned_spectrum_set.time_intervals.start_times)
+        true_stops = np.sort(self._binned_spectrum_set.time_intervals.stop_times)
 
-            new_stops.append(new_stop)
+        new_starts = self._nearest_edges(true_starts, np.asarray(time_intervals.start_times, dtype=float))
+        new_stops = self._nearest_edges(true_stops, np.asarray(time_intervals.stop_times, dtype=float))
 
         # alright, now we can make appropriate time intervals
 
@@ -257,28 +327,18 @@ class BinnedSpectrumSeries(TimeSeries):
         # now lets get all the counts, exposure and midpoints for the
         # selection
 
-        selected_counts = []
-        selected_exposure = []
-        selected_midpoints = []
-
-        for selection in poly_intervals:
-
-            # get the mask of these bins
+        starts = np.asarray(poly_intervals.start_times, dtype=float)
+        stops = np.asarray(poly_intervals.stop_times, dtype=float)
 
-            mask = self._select_bins(selection.start_time,selection.stop_time)
+        # the counts will be (time, channel) here,
+        # so the mask is selecting time.
+        # a sum along axis=0 is a sum in time, while axis=1 is a sum in energy
 
-            # the counts will be (time, channel) here,
-            # so the mask is selecting time.
-            # a sum along axis=0 is a sum in time, while axis=1 is a sum in energy
+        mask = self._select_bins_over_intervals(starts, stops)
 
-            selected_counts.extend(self._binned_spectrum_set.counts_per_bin[mask])
-
-            selected_exposure.extend(self._binned_spectrum_set.exposure_per_bin[mask])
-            selected_midpoints.extend(self._binned_spectrum_set.time_intervals.mid_points[mask])
-
-        selected_counts = np.array(selected_counts)
-        selected_midpoints = np.array(selected_midpoints)
-        selected_exposure = np.array(selected_exposure)
+        selected_counts = self._counts_per_bin[mask]
+        selected_exposure = self._exposure_per_bin[mask]
+        selected_midpoints = np.asarray(self._binned_spectrum_set.time_intervals.mid_points)[mask]
 
         # Now we will find the the best poly order unless the use specified one
         # The total cnts (over channels) is binned
@@ -296,23 +356,37 @@ class BinnedSpectrumSeries(TimeSeries):
 
             self._optimal_polynomial_grade = self._user_poly_order
 
-        polynomials = []
+        grade = self._optimal_polynomial_grade
 
-        # now fit the light curve of each channel
-        # and save the estimated polynomial
+        if self._batch_fit:
+
+            # fit all the channels at once
+
+            self._fit_method_info['fit method'] = 'batched Newton'
+
+            coefficients, covariances, _ = batch_polyfit(selected_midpoints, selected_counts.T, grade,
+                                                         selected_exposure)
 
-        with progress_bar(self._n_channels, title="Fitting background") as p:
-            for counts in selected_counts.T:
+            self._polynomials = PolynomialSet.from_arrays(coefficients, covariances)
 
-                polynomial, _ = polyfit(selected_midpoints,
-                                        counts,
-                                        self._optimal_polynomial_grade,
-                                        selected_exposure)
+            return
 
-                polynomials.append(polynomial)
-                p.increase()
+        def worker(channel_data):
 
-        self._polynomials = polynomials
+            counts, initial_guess = channel_data
+
+            polynomial, _ = polyfit(selected_midpoints,
+                                    counts,
+                                    grade,
+                                    selected_exposure,
+                                    initial_guess=initial_guess)
+
+            return polynomial
+
+        # now fit the light curve of each channel
+        # and save the estimated polynomial
+
+        self._polynomials = self._fit_channels(worker, zip(list(selected_counts.T), self._get_warm_start(grade)))
 
     def set_active_time_intervals(self, *args):
         """
@@ -339,26 +413,19 @@ class BinnedSpectrumSeries(TimeSeries):
         time_intervals = self._adjust_to_true_intervals(time_intervals)
 
 
-        # start out with no time bins selection
-        all_idx = np.zeros(len(self._binned_spectrum_set.time_intervals),dtype=bool)
-
-        # now we need to sum up the counts and total time
+        starts = np.asarray(time_intervals.start_times, dtype=float)
+        stops = np.asarray(time_intervals.stop_times, dtype=float)
 
-        total_time = 0
+        # since we are sure that the interval bounds are aligned with the true ones,
+        # we do not care if the selection is inner or outer. The adjusted intervals
+        # can overlap, so the bins are selected only once
 
-        for interval in time_intervals:
+        all_idx = self._select_bins_over_intervals(starts, stops)
 
-            # the select bins method is called.
-            # since we are sure that the interval bounds
-            # are aligned with the true ones, we do not care if
-            # it is inner or outer
-
-            all_idx = np.logical_or(all_idx,self._select_bins(interval.start_time,interval.stop_time))
-
-            total_time += interval.duration
+        total_time = np.sum(stops - starts)
 
         # sum along the time axis
-        self._counts = self._binned_spectrum_set.counts_per_bin[all_idx].sum(axis=0)
+        self._counts = self._counts_per_bin[all_idx].sum(axis=0)
 
 
         # the selected time intervals
@@ -366,34 +433,14 @@ class BinnedSpectrumSeries(TimeSeries):
         self._time_intervals = time_intervals
 
 
-        tmp_counts = []
-        tmp_err = []  # Temporary list to hold the err counts per chan
-
         if self._poly_fit_exists:
 
-            if not self._poly_fit_exists:
-                raise RuntimeError('A polynomial fit to the channels does not exist!')
-
-            for chan in range(self._n_channels):
-
-                total_counts = 0
-                counts_err = 0
-
-                for tmin, tmax in zip(self._time_intervals.start_times, self._time_intervals.stop_times):
-                    # Now integrate the appropriate background polynomial
-                    total_counts += self._polynomials[chan].integral(tmin, tmax)
-                    counts_err += (self._polynomials[chan].integral_error(tmin, tmax)) ** 2
-
-                tmp_counts.append(total_counts)
+            # integrate the background polynomials of all channels over the intervals
 
-                tmp_err.append(np.sqrt(counts_err))
+            self._poly_counts, self._poly_count_err = self._poly_counts_over_time_intervals(self._time_intervals)
 
-            self._poly_counts = np.array(tmp_counts)
 
-            self._poly_count_err = np.array(tmp_err)
-
-
-        self._exposure = self._binned_spectrum_set.exposure_per_bin[all_idx].sum()
+        self._exposure = self._exposure_per_bin[all_idx].sum()
 
         self._active_dead_time = total_time - self._exposure
 
@@ -408,9 +455,4 @@ class BinnedSpectrumSeries(TimeSeries):
         :return:
         """
 
-
-        mask = self._select_bins(start, stop)
-
-
-
-        return self._binned_spectrum_set.exposure_per_bin[mask].sum()
\ No newline at end of file
+        return self.exposure_over_intervals([start], [stop])[0]
@@ -0,0 +1,337 @@
+import numpy as np
+
+
+class ChannelEventIndex(object):
+    def __init__(self, arrival_times, measurement, n_channels, first_channel=0):
+        """
+        An index of an event list which is built once and allows for fast interval and
+        channel queries. The events are stored twice: once sorted in time and once sorted
+        by (channel, time) together with the offsets of each channel in the latter array.
+
+        Counting the events of a channel in an interval is then a difference of two
+        binary searches instead of a boolean scan of the full event list.
+
+        Events with a measurement outside of the channel range are kept in the time index
+        (so they are counted in the total counts) but not in the channel index.
+
+        :param arrival_times: the arrival times of the events
+        :param measurement: the pha channel of the events
+        :param n_channels: the number of channels
+        :param first_channel: the number of the first channel
+        """
+
+        arrival_times = np.asarray(arrival_times)
+        measurement = np.asarray(measurement)
+
+        assert arrival_times.shape[0] == measurement.shape[0], "Arrival time (%d) and energies (%d) have different " \
+                                                               "shapes" % (arrival_times.shape[0],
+                                                                           measurement.shape[0])
+
+        self._n_channels = int(n_channels)
+        self._first_channel = first_channel
+
+        # most event lists are already sorted in time, so we
+        # avoid the copy in that case
+
+        if arrival_times.shape[0] > 1 and np.any(arrival_times[1:] < arrival_times[:-1]):
+
+            time_order = np.argsort(arrival_times, kind='mergesort')
+
+            self._sorted_times = arrival_times[time_order]
+            sorted_measurement = measurement[time_order]
+
+            self._time_order = time_order
+
+        else:
+
+            self._sorted_times = arrival_times
+            sorted_measurement = measurement
+
+            self._time_order = None
+
+        # now build the channel index. A stable sort of the channels
+        # of the time sorted events gives the (channel, time) order
+
+        channel_idx = sorted_measurement - first_channel
+
+        in_range = np.logical_and(channel_idx >= 0, channel_idx < self._n_channels)
+
+        if not np.issubdtype(channel_idx.dtype, np.integer):
+
+            # non-integer measurements do not belong to any channel
+
+            in_range = np.logical_and(in_range, channel_idx == np.floor(channel_idx))
+
+        channel_idx = channel_idx[in_range].astype(np.int64)
+
+        channel_order = np.argsort(channel_idx, kind='mergesort')
+
+        self._channel_times = self._sorted_times[in_range][channel_order]
+
+        counts_per_channel = np.bincount(channel_idx, minlength=self._n_channels)
+
+        self._channel_offsets = np.zeros(self._n_channels + 1, dtype=np.int64)
+        self._channel_offsets[1:] = np.cumsum(counts_per_channel)
+
+    @property
+    def n_channels(self):
+
+        return self._n_channels
+
+    @property
+    def sorted_times(self):
+        """
+        the arrival times of all events sorted in time
+        :return:
+        """
+
+        return self._sorted_times
+
+    @property
+    def time_order(self):
+        """
+        the indices which sort the original events in time or None
+        if the events were already sorted
+        :return:
+        """
+
+        return self._time_order
+
+    @property
+    def channel_offsets(self):
+        """
+        the offsets of each channel in the channel sorted event array.
+        The events of channel i are between offsets[i] and offsets[i+1]
+        :return:
+        """
+
+        return self._channel_offsets
+
+    def _channel_slice(self, channel_index):
+
+        return self._channel_times[self._channel_offsets[channel_index]:self._channel_offsets[channel_index + 1]]
+
+    def time_slice(self, start, stop):
+        """
+        the indices (in the time sorted array) bounding the events within [start, stop).
+        The intervals are half-open (as the bins of np.histogram), so that an event on the
+        edge between two contiguous intervals is counted only once
+
+        :param start: start time
+        :param stop: stop time
+        :return: (low, high) such that sorted_times[low:high] are the selected events
+        """
+
+        low = np.searchsorted(self._sorted_times, start, side='left')
+        high = np.searchsorted(self._sorted_times, stop, side='left')
+
+        return low, high
+
+    def time_slices(self, starts, stops):
+        """
+        vectorized version of time_slice for arrays of intervals
+
+        :param starts: array of start times
+        :param stops: array of stop times
+        :return: (lows, highs) arrays of indices in the time sorted array
+        """
+
+        starts = np.atleast_1d(np.asarray(starts, dtype=float))
+        stops = np.atleast_1d(np.asarray(stops, dtype=float))
+
+        return (np.searchsorted(self._sorted_times, starts, side='left'),
+                np.searchsorted(self._sorted_times, stops, side='left'))
+
+    def cumulative_sum(self, values):
+        """
+        the cumulative sum of a per-event quantity taken in time order, with a leading zero.
+        The sum of the quantity over the events sorted_times[low:high] is then
+        cumulative[high] - cumulative[low]
+
+        :param values: an array with one entry per event (in the original order)
+        :return: array of length n_events + 1
+        """
+
+        values = np.asarray(values, dtype=float)
+
+        if self._time_order is not None:
+
+            values = values[self._time_order]
+
+        cumulative = np.zeros(values.shape[0] + 1)
+
+        np.cumsum(values, out=cumulative[1:])
+
+        return cumulative
+
+    def events_over_interval(self, start, stop):
+        """
+        the time sorted arrival times within [start, stop)
+
+        :param start: start time
+        :param stop: stop time
+        :return: array of arrival times
+        """
+
+        low, high = self.time_slice(start, stop)
+
+        return self._sorted_times[low:high]
+
+    def counts_over_interval(self, start, stop):
+        """
+        the total number of events (all channels) within [start, stop)
+
+        :param start: start time
+        :param stop: stop time
+        :return: number of events
+        """
+
+        low, high = self.time_slice(start, stop)
+
+        return int(high - low)
+
+    def counts_over_intervals(self, starts, stops):
+        """
+        the total number of events (all channels) in each of the intervals [starts, stops)
+
+        :param starts: array of start times
+        :param stops: array of stop times
+        :return: array of number of events
+        """
+
+        lows, highs = self.time_slices(starts, stops)
+
+        return highs - lows
+
+    def count_per_channel_over_interval(self, start, stop):
+        """
+        the number of events in each channel within [start, stop)
+
+        :param start: start time
+        :param stop: stop time
+        :return: array of counts per channel
+        """
+
+        return self.count_per_channel_over_intervals([start], [stop])[0]
+
+    def count_per_channel_over_intervals(self, starts, stops):
+        """
+        the number of events in each channel for each of the intervals [starts, stops)
+
+        :param starts: array of start times
+        :param stops: array of stop times
+        :return: (n_intervals, n_channels) array of counts
+        """
+
+        starts = np.atleast_1d(np.asarray(starts, dtype=float))
+        stops = np.atleast_1d(np.asarray(stops, dtype=float))
+
+        assert starts.shape == stops.shape, "starts and stops must have the same length"
+
+        counts = np.zeros((starts.shape[0], self._n_channels), dtype=np.int64)
+
+        searchsorted = np.searchsorted
+
+        for i in range(self._n_channels):
+
+            channel_times = self._channel_slice(i)
+
+            if channel_times.shape[0] == 0:
+
+                continue
+
+            counts[:, i] = searchsorted(channel_times, stops, side='left') - searchsorted(channel_times, starts,
+                                                                                           side='left')
+
+        return counts
+
+    def channel_events(self, channel_index, starts=None, stops=None):
+        """
+        the time sorted arrival times of one channel, optionally restricted to a set of
+        non-overlapping intervals [starts, stops)
+
+        :param channel_index: the index of the channel (i.e., channel - first_channel)
+        :param starts: optional start times of the intervals
+        :param stops: optional stop times of the intervals
+        :return: array of arrival times
+        """
+
+        channel_times = self._channel_slice(channel_index)
+
+        if starts is None:
+
+            return channel_times
+
+        return self._restrict_to_intervals(channel_times, starts, stops)
+
+    def events_in_channels(self, channel_mask, start, stop):
+        """
+        the time sorted arrival times within [start, stop) of the channels selected by the mask
+
+        :param channel_mask: boolean mask of length n_channels
+        :param start: start time
+        :param stop: stop time
+        :return: array of arrival times
+        """
+
+        channel_mask = np.asarray(channel_mask, dtype=bool)
+
+        assert channel_mask.shape[0] == self._n_channels, "the channel mask must have one entry per channel"
+
+        selected = [self.channel_events(i, [start], [stop]) for i in np.where(channel_mask)[0]]
+
+        if not selected:
+
+            return np.array([], dtype=self._sorted_times.dtype)
+
+        return np.sort(np.concatenate(selected), kind='mergesort')
+
+    def events_over_intervals(self, starts, stops):
+        """
+        the time sorted arrival times of all events within a set of non-overlapping intervals [starts, stops)
+
+        :param starts: start times of the intervals
+        :param stops: stop times of the intervals
+        :return: array of arrival times
+        """
+
+        return self._restrict_to_intervals(self._sorted_times, starts, stops)
+
+    @staticmethod
+    def _restrict_to_intervals(sorted_times, starts, stops):
+
+        # the intervals are half-open, as in time_slice
+
+        starts = np.atleast_1d(np.asarray(starts, dtype=float))
+        stops = np.atleast_1d(np.asarray(stops, dtype=float))
+
+        if starts.shape[0] == 0:
+
+            return sorted_times[:0]
+
+        lows = np.searchsorted(sorted_times, starts, side='left')
+        highs = np.searchsorted(sorted_times, stops, side='left')
+
+        # merge overlapping index ranges so that no event is selected twice
+
+        order = np.argsort(lows, kind='mergesort')
+
+        slices = []
+
+        current_low, current_high = lows[order[0]], highs[order[0]]
+
+        for low, high in zip(lows[order[1:]], highs[order[1:]]):
+
+            if low <= current_high:
+
+                current_high = max(current_high, high)
+
+            else:
+
+                slices.append(sorted_times[current_low:current_high])
+
+                current_low, current_high = low, high
+
+        slices.append(sorted_times[current_low:current_high])
+
+        return np.concatenate(slices)
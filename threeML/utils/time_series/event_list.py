@@ -11,13 +11,13 @@ from pandas import HDFStore
 from threeML.config.config import threeML_config
 from threeML.exceptions.custom_exceptions import custom_warnings
 from threeML.io.file_utils import sanitize_filename
-from threeML.io.progress_bar import progress_bar
 from threeML.io.rich_display import display
 from threeML.utils.binner import TemporalBinner
 from threeML.utils.time_interval import TimeIntervalSet
-from threeML.utils.time_series.polynomial import polyfit, unbinned_polyfit
+from threeML.utils.time_series.event_index import ChannelEventIndex
+from threeML.utils.time_series.polynomial import polyfit, unbinned_polyfit, batch_polyfit, batch_unbinned_polyfit, \
+    PolynomialSet
 from threeML.utils.time_series.time_series import TimeSeries
-from threeML.io.plotting.light_curve_plots import binned_light_curve_plot
 
 
 class ReducingNumberOfThreads(Warning):
@@ -90,6 +90,11 @@ class EventList(TimeSeries):
             0], "Arrival time (%d) and energies (%d) have different shapes" % (self._arrival_times.shape[0],
                                                                                self._measurement.shape[0])
 
+        # build the (channel, time) index once so that all interval
+        # and channel queries are binary searches
+
+        self._event_index = ChannelEventIndex(self._arrival_times, self._measurement, n_channels, first_channel)
+
     @property
     def n_events(self):
 
@@ -104,6 +109,14 @@ class EventList(TimeSeries):
     def measurement(self):
         return self._measurement
 
+    def _data_fingerprint(self):
+        """
+        the arrays identifying the data in the background fit cache
+        :return:
+        """
+
+        return [self._arrival_times, self._measurement, self._start_time, self._stop_time]
+
     @property
     def bins(self):
 
@@ -129,21 +142,13 @@ class EventList(TimeSeries):
 
         if mask is not None:
 
-            # create phas to check
-            phas = np.arange(self._first_channel, self._n_channels)[mask]
+            # collect the events of the selected channels from the index
 
-            this_mask = np.zeros_like(self._arrival_times, dtype=np.bool)
-
-            for channel in phas:
-                this_mask = np.logical_or(this_mask, self._measurement == channel)
-
-            events = self._arrival_times[this_mask]
+            events = self._event_index.events_in_channels(mask, start, stop)
 
         else:
 
-            events = copy.copy(self._arrival_times)
-
-        events = events[np.logical_and(events <= stop, events >= start)]
+            events = copy.copy(self._event_index.events_over_interval(start, stop))
 
         tmp_bkg_getter = lambda a, b: self.get_total_poly_count(a, b, mask)
         tmp_err_getter = lambda a, b: self.get_total_poly_error(a, b, mask)
@@ -166,7 +171,7 @@ class EventList(TimeSeries):
         :return:
         """
 
-        events = self._arrival_times[np.logical_and(self._arrival_times >= start, self._arrival_times <= stop)]
+        events = self._event_index.events_over_interval(start, stop)
 
         self._temporal_binner = TemporalBinner.bin_by_constant(events, dt)
 
@@ -185,7 +190,7 @@ class EventList(TimeSeries):
 
     def bin_by_bayesian_blocks(self, start, stop, p0, use_background=False):
 
-        events = self._arrival_times[np.logical_and(self._arrival_times >= start, self._arrival_times <= stop)]
+        events = self._event_index.events_over_interval(start, stop)
 
         #self._temporal_binner = TemporalBinner(events)
 
@@ -200,13 +205,14 @@ class EventList(TimeSeries):
 
             self._temporal_binner = TemporalBinner.bin_by_bayesian_blocks(events, p0)
 
-    def view_lightcurve(self, start=-10, stop=20., dt=1., use_binner=False):
+    def view_lightcurve(self, start=-10, stop=20., dt=1., use_binner=False, mask=None):
         # type: (float, float, float, bool) -> None
         """
         :param start:
         :param stop:
         :param dt:
         :param use_binner:
+        :param mask: (optional) boolean mask of the channels to plot
 
         """
 
@@ -215,20 +221,18 @@ class EventList(TimeSeries):
             # we will use the binner object to bin the
             # light curve and ignore the normal linear binning
 
-            bins = self.bins.time_edges
+            bins = np.asarray(self.bins.time_edges)
 
             # perhaps we want to look a little before or after the binner
             if start < bins[0]:
-                pre_bins = np.arange(start, bins[0], dt).tolist()[:-1]
+                pre_bins = np.arange(start, bins[0], dt)[:-1]
 
-                pre_bins.extend(bins)
-
-                bins = pre_bins
+                bins = np.append(pre_bins, bins)
 
             if stop > bins[-1]:
                 post_bins = np.arange(bins[-1], stop, dt)
 
-                bins.extend(post_bins[1:])
+                bins = np.append(bins, post_bins[1:])
 
         else:
 
@@ -236,81 +240,11 @@ class EventList(TimeSeries):
 
             bins = np.arange(start, stop + dt, dt)
 
-        cnts, bins = np.histogram(self.arrival_times, bins=bins)
-        time_bins = np.array([[bins[i], bins[i + 1]] for i in range(len(bins) - 1)])
-
-        #width = np.diff(bins)
-        width = []
-
-        # now we want to get the estimated background from the polynomial fit
-
-        if self.poly_fit_exists:
-
-            # we will store the bkg rate for each time bin
-
-            bkg = []
-
-            for j, tb in enumerate(time_bins):
-
-                # zero out the bkg
-                tmpbkg = 0.
-
-                # we will use the exposure for the width
-
-                this_width = self.exposure_over_interval(tb[0], tb[1])
-
-                # sum up the counts over this interval
-
-                for poly in self.polynomials:
-
-                    tmpbkg += poly.integral(tb[0], tb[1])
-
-                # capture the exposure
-
-                width.append(this_width)
-
-                # capture the bkg *rate*
-
-                bkg.append(tmpbkg / this_width)
-
-        else:
-
-            bkg = None
-
-            for j, tb in enumerate(time_bins):
-
-                this_width = self.exposure_over_interval(tb[0], tb[1])
-
-                width.append(this_width)
-
-        width = np.array(width)
+        light_curve = self.light_curve(bins[:-1], bins[1:], mask)
 
         # pass all this to the light curve plotter
 
-        if self.time_intervals is not None:
-
-            selection = self.time_intervals.bin_stack
-
-        else:
-
-            selection = None
-
-        if self.poly_intervals is not None:
-
-            bkg_selection = self.poly_intervals.bin_stack
-
-        else:
-
-            bkg_selection = None
-
-        return binned_light_curve_plot(
-            time_bins=time_bins,
-            cnts=cnts,
-            width=width,
-            bkg=bkg,
-            selection=selection,
-            bkg_selections=bkg_selection,
-        )
+        return self._plot_light_curve(light_curve)
 
     def counts_over_interval(self, start, stop):
         """
@@ -320,35 +254,58 @@ class EventList(TimeSeries):
         :return:
         """
 
-        # this will be a boolean list and the sum will be the
-        # number of events
-
-        return self._select_events(start, stop).sum()
+        return self._event_index.counts_over_interval(start, stop)
 
     def count_per_channel_over_interval(self, start, stop):
+        """
+        return the number of counts per channel in the selected interval
+        :param start: start of interval
+        :param stop:  stop of interval
+        :return:
+        """
 
-        channels = range(self._first_channel, self._n_channels + self._first_channel)
+        return self._event_index.count_per_channel_over_interval(start, stop).astype(float)
 
-        counts_per_channel = np.zeros(len(channels))
+    def counts_over_intervals(self, starts, stops):
+        """
+        return the number of counts in each of the given intervals
+        :param starts: array of start times
+        :param stops: array of stop times
+        :return: array of counts
+        """
 
-        selection = self._select_events(start, stop)
+        return self._event_index.counts_over_intervals(starts, stops).astype(float)
 
-        for i, channel in enumerate(channels):
-            channel_mask = self._measurement[selection] == channel
+    def count_per_channel_over_intervals(self, starts, stops):
+        """
+        return the number of counts per channel in each of the given intervals
+        :param starts: array of start times
+        :param stops: array of stop times
+        :return: (n_intervals, n_channels) array of counts
+        """
 
-            counts_per_channel[i] += channel_mask.sum()
+        return self._event_index.count_per_channel_over_intervals(starts, stops).astype(float)
 
-        return counts_per_channel
+    def _count_per_channel_over_time_intervals(self, time_intervals):
+        """
+        return the number of counts per channel summed over a set of non-overlapping
+        time intervals
+        :param time_intervals: a TimeIntervalSet
+        :return:
+        """
+
+        return self._event_index.count_per_channel_over_intervals(time_intervals.start_times,
+                                                                  time_intervals.stop_times).sum(axis=0)
 
     def _select_events(self, start, stop):
         """
-        return an index of the selected events
+        return an index of the events selected in [start, stop)
         :param start: start time
         :param stop: stop time
         :return:
         """
 
-        return np.logical_and(start <= self._arrival_times, self._arrival_times <= stop)
+        return np.logical_and(start <= self._arrival_times, self._arrival_times < stop)
 
     def _fit_polynomials(self):
         """
@@ -366,30 +323,13 @@ class EventList(TimeSeries):
         self._fit_method_info['bin type'] = 'Binned'
         self._fit_method_info['fit method'] = threeML_config['event list']['binned fit method']
 
-        # Select all the events that are in the background regions
-        # and make a mask
-
-        all_bkg_masks = []
-
-        for selection in self._poly_intervals:
-            all_bkg_masks.append(
-                np.logical_and(self._arrival_times >= selection.start_time, self._arrival_times <= selection.stop_time))
-        poly_mask = all_bkg_masks[0]
-
-        # If there are multiple masks:
-        if len(all_bkg_masks) > 1:
-            for mask in all_bkg_masks[1:]:
-                poly_mask = np.logical_or(poly_mask, mask)
+        t_start = self._poly_intervals.start_times
+        t_stop = self._poly_intervals.stop_times
 
         # Select the all the events in the poly selections
-        # We only need to do this once
-
-        total_poly_events = self._arrival_times[poly_mask]
+        # from the index. We only need to do this once
 
-        # For the channel energies we will need to down select again.
-        # We can go ahead and do this to avoid repeated computations
-
-        total_poly_energies = self._measurement[poly_mask]
+        total_poly_events = self._event_index.events_over_intervals(t_start, t_stop)
 
         # This calculation removes the unselected portion of the light curve
         # so that we are not fitting zero counts. It will be used in the channel calculations
@@ -401,17 +341,11 @@ class EventList(TimeSeries):
         cnts, bins = np.histogram(total_poly_events, bins=these_bins)
 
         # Find the mean time of the bins and calculate the exposure in each bin
-        mean_time = []
-        exposure_per_bin = []
-        for i in xrange(len(bins) - 1):
-            m = np.mean((bins[i], bins[i + 1]))
-            mean_time.append(m)
-
-            exposure_per_bin.append(self.exposure_over_interval(bins[i], bins[i + 1]))
+        # (all bins at once from the cumulative exposure tables)
 
-        mean_time = np.array(mean_time)
+        mean_time = 0.5 * (bins[:-1] + bins[1:])
 
-        exposure_per_bin = np.array(exposure_per_bin)
+        exposure_per_bin = self.exposure_over_intervals(bins[:-1], bins[1:])
 
         # Remove bins with zero counts
         all_non_zero_mask = []
@@ -440,35 +374,49 @@ class EventList(TimeSeries):
 
             self._optimal_polynomial_grade = self._user_poly_order
 
-        channels = range(self._first_channel, self._n_channels + self._first_channel)
+        # bin the background events of each channel. This is cheap, so it is
+        # done here and only the binned counts are passed to the fitting
+
+        channel_counts = []
+
+        for channel_index in range(self._n_channels):
+
+            current_events = self._event_index.channel_events(channel_index, t_start, t_stop)
+
+            cnts, _ = np.histogram(current_events, bins=these_bins)
+
+            channel_counts.append(cnts[non_zero_mask])
 
-        polynomials = []
+        # Put data to fit in an x vector and y vector
 
-        with progress_bar(self._n_channels, title="Fitting %s background" % self._instrument) as p:
-            for channel in channels:
-                channel_mask = total_poly_energies == channel
+        x = mean_time[non_zero_mask]
+        exposure = exposure_per_bin[non_zero_mask]
+        grade = self._optimal_polynomial_grade
 
-                # Mask background events and current channel
-                # poly_chan_mask = np.logical_and(poly_mask, channel_mask)
-                # Select the masked events
+        if self._batch_fit:
 
-                current_events = total_poly_events[channel_mask]
+            # fit all the channels at once
 
-                # now bin the selected channel counts
+            self._fit_method_info['fit method'] = 'batched Newton'
 
-                cnts, bins = np.histogram(current_events, bins=these_bins)
+            coefficients, covariances, _ = batch_polyfit(x, np.array(channel_counts), grade, exposure)
 
-                # Put data to fit in an x vector and y vector
+            self._polynomials = PolynomialSet.from_arrays(coefficients, covariances)
 
-                polynomial, _ = polyfit(mean_time[non_zero_mask], cnts[non_zero_mask], self._optimal_polynomial_grade,
-                                        exposure_per_bin[non_zero_mask])
+            return
 
-                polynomials.append(polynomial)
-                p.increase()
+        def worker(channel_data):
+
+            counts, initial_guess = channel_data
+
+            polynomial, _ = polyfit(x, counts, grade, exposure, initial_guess=initial_guess)
+
+            return polynomial
 
         # We are now ready to return the polynomials
 
-        self._polynomials = polynomials
+        self._polynomials = self._fit_channels(worker, zip(channel_counts, self._get_warm_start(grade)),
+                                               title="Fitting %s background" % self._instrument)
 
     def _unbinned_fit_polynomials(self):
 
@@ -478,11 +426,6 @@ class EventList(TimeSeries):
         self._fit_method_info['bin type'] = 'Unbinned'
         self._fit_method_info['fit method'] = threeML_config['event list']['unbinned fit method']
 
-        # Select all the events that are in the background regions
-        # and make a mask
-
-        all_bkg_masks = []
-
         total_duration = 0.
 
         poly_exposure = 0
@@ -492,24 +435,13 @@ class EventList(TimeSeries):
 
             poly_exposure += self.exposure_over_interval(selection.start_time, selection.stop_time)
 
-            all_bkg_masks.append(
-                np.logical_and(self._arrival_times >= selection.start_time, self._arrival_times <= selection.stop_time))
-        poly_mask = all_bkg_masks[0]
-
-        # If there are multiple masks:
-        if len(all_bkg_masks) > 1:
-            for mask in all_bkg_masks[1:]:
-                poly_mask = np.logical_or(poly_mask, mask)
+        t_start = self._poly_intervals.start_times
+        t_stop = self._poly_intervals.stop_times
 
         # Select the all the events in the poly selections
-        # We only need to do this once
-
-        total_poly_events = self._arrival_times[poly_mask]
-
-        # For the channel energies we will need to down select again.
-        # We can go ahead and do this to avoid repeated computations
+        # from the index. We only need to do this once
 
-        total_poly_energies = self._measurement[poly_mask]
+        total_poly_events = self._event_index.events_over_intervals(t_start, t_stop)
 
         # Now we will find the the best poly order unless the use specified one
         # The total cnts (over channels) is binned to .1 sec intervals
@@ -526,34 +458,39 @@ class EventList(TimeSeries):
 
             self._optimal_polynomial_grade = self._user_poly_order
 
-        channels = range(self._first_channel, self._n_channels + self._first_channel)
+        # Select the background events of each channel
 
-        # Check whether we are parallelizing or not
+        channel_events = [self._event_index.channel_events(channel_index, t_start, t_stop)
+                          for channel_index in range(self._n_channels)]
 
-        t_start = self._poly_intervals.start_times
-        t_stop = self._poly_intervals.stop_times
+        grade = self._optimal_polynomial_grade
+
+        if self._batch_fit:
 
-        polynomials = []
+            # fit all the channels at once
 
-        with progress_bar(self._n_channels, title="Fitting %s background" % self._instrument) as p:
-            for channel in channels:
-                channel_mask = total_poly_energies == channel
+            self._fit_method_info['fit method'] = 'batched Newton'
 
-                # Mask background events and current channel
-                # poly_chan_mask = np.logical_and(poly_mask, channel_mask)
-                # Select the masked events
+            coefficients, covariances, _ = batch_unbinned_polyfit(channel_events, grade, t_start, t_stop,
+                                                                  poly_exposure)
 
-                current_events = total_poly_events[channel_mask]
+            self._polynomials = PolynomialSet.from_arrays(coefficients, covariances)
 
-                polynomial, _ = unbinned_polyfit(current_events, self._optimal_polynomial_grade, t_start, t_stop,
-                                                 poly_exposure)
+            return
 
-                polynomials.append(polynomial)
-                p.increase()
+        def worker(channel_data):
+
+            events, initial_guess = channel_data
+
+            polynomial, _ = unbinned_polyfit(events, grade, t_start, t_stop, poly_exposure,
+                                             initial_guess=initial_guess)
+
+            return polynomial
 
         # We are now ready to return the polynomials
 
-        self._polynomials = polynomials
+        self._polynomials = self._fit_channels(worker, zip(channel_events, self._get_warm_start(grade)),
+                                               title="Fitting %s background" % self._instrument)
 
 
 class EventListWithDeadTime(EventList):
@@ -608,10 +545,42 @@ class EventListWithDeadTime(EventList):
                 0], "Arrival time (%d) and Dead Time (%d) have different shapes" % (self._arrival_times.shape[0],
                                                                                     self._dead_time.shape[0])
 
+            # cumulative dead time in time order. The dead time over any interval
+            # is then the difference of two entries of this table
+
+            self._cumulative_dead_time = self._event_index.cumulative_sum(self._dead_time)
+
         else:
 
             self._dead_time = None
 
+            self._cumulative_dead_time = None
+
+    def _dead_time_over_intervals(self, starts, stops):
+        """
+        the summed dead time of the events in each of the intervals
+
+        :param starts: array of start times
+        :param stops: array of stop times
+        :return: array of dead times
+        """
+
+        if self._cumulative_dead_time is None:
+
+            return np.zeros(np.atleast_1d(starts).shape[0])
+
+        lows, highs = self._event_index.time_slices(starts, stops)
+
+        return self._cumulative_dead_time[highs] - self._cumulative_dead_time[lows]
+
+    def _data_fingerprint(self):
+        """
+        the arrays identifying the data in the background fit cache
+        :return:
+        """
+
+        return super(EventListWithDeadTime, self)._data_fingerprint() + [self._dead_time]
+
     def exposure_over_interval(self, start, stop):
         """
         calculate the exposure over the given interval
@@ -621,17 +590,21 @@ class EventListWithDeadTime(EventList):
         :return:
         """
 
-        mask = self._select_events(start, stop)
-
-        if self._dead_time is not None:
+        return self.exposure_over_intervals([start], [stop])[0]
 
-            interval_deadtime = (self._dead_time[mask]).sum()
+    def exposure_over_intervals(self, starts, stops):
+        """
+        calculate the exposure over each of the given intervals
 
-        else:
+        :param starts: array of start times
+        :param stops:  array of stop times
+        :return: array of exposures
+        """
 
-            interval_deadtime = 0
+        starts = np.atleast_1d(np.asarray(starts, dtype=float))
+        stops = np.atleast_1d(np.asarray(stops, dtype=float))
 
-        return (stop - start) - interval_deadtime
+        return (stops - starts) - self._dead_time_over_intervals(starts, stops)
 
     def set_active_time_intervals(self, *args):
         '''Set the time interval(s) to be used during the analysis.
@@ -645,64 +618,21 @@ class EventListWithDeadTime(EventList):
 
         self._time_selection_exists = True
 
-        interval_masks = []
-
         time_intervals = TimeIntervalSet.from_strings(*args)
 
         time_intervals.merge_intersecting_intervals(in_place=True)
 
-        for interval in time_intervals:
-            tmin = interval.start_time
-            tmax = interval.stop_time
-
-            mask = self._select_events(tmin, tmax)
-
-            interval_masks.append(mask)
-
         self._time_intervals = time_intervals
 
-        time_mask = interval_masks[0]
-        if len(interval_masks) > 1:
-            for mask in interval_masks[1:]:
-                time_mask = np.logical_or(time_mask, mask)
-
-        tmp_counts = []    # Temporary list to hold the total counts per chan
-
-        for chan in range(self._first_channel, self._n_channels + self._first_channel):
-
-            channel_mask = self._measurement == chan
-            counts_mask = np.logical_and(channel_mask, time_mask)
-            total_counts = len(self._arrival_times[counts_mask])
-
-            tmp_counts.append(total_counts)
+        # the intervals are merged, so we can simply sum the counts of each one
 
-        self._counts = np.array(tmp_counts)
-
-        tmp_counts = []
-        tmp_err = []    # Temporary list to hold the err counts per chan
+        self._counts = self._count_per_channel_over_time_intervals(self._time_intervals)
 
         if self._poly_fit_exists:
 
-            if not self._poly_fit_exists:
-                raise RuntimeError('A polynomial fit to the channels does not exist!')
-
-            for chan in range(self._n_channels):
-
-                total_counts = 0
-                counts_err = 0
-
-                for tmin, tmax in zip(self._time_intervals.start_times, self._time_intervals.stop_times):
-                    # Now integrate the appropriate background polynomial
-                    total_counts += self._polynomials[chan].integral(tmin, tmax)
-                    counts_err += (self._polynomials[chan].integral_error(tmin, tmax))**2
-
-                tmp_counts.append(total_counts)
-
-                tmp_err.append(np.sqrt(counts_err))
-
-            self._poly_counts = np.array(tmp_counts)
+            # integrate the background polynomials of all channels over the intervals
 
-            self._poly_count_err = np.array(tmp_err)
+            self._poly_counts, self._poly_count_err = self._poly_counts_over_time_intervals(self._time_intervals)
 
         # Dead time correction
 
@@ -710,12 +640,8 @@ class EventListWithDeadTime(EventList):
         for interval in self._time_intervals:
             exposure += interval.duration
 
-        if self._dead_time is not None:
-
-            total_dead_time = self._dead_time[time_mask].sum()
-        else:
-
-            total_dead_time = 0.
+        total_dead_time = self._dead_time_over_intervals(self._time_intervals.start_times,
+                                                         self._time_intervals.stop_times).sum()
 
         self._exposure = exposure - total_dead_time
 
@@ -776,10 +702,53 @@ class EventListWithDeadTimeFraction(EventList):
                 0], "Arrival time (%d) and Dead Time (%d) have different shapes" % (self._arrival_times.shape[0],
                                                                                     self._dead_time_fraction.shape[0])
 
+            # cumulative dead time fraction in time order. The mean fraction over any
+            # interval is then the difference of two entries over the number of events
+
+            self._cumulative_dead_time_fraction = self._event_index.cumulative_sum(self._dead_time_fraction)
+
         else:
 
             self._dead_time_fraction = None
 
+            self._cumulative_dead_time_fraction = None
+
+    def _dead_time_over_intervals(self, starts, stops):
+        """
+        the dead time in each of the intervals, i.e. the duration times the mean
+        dead time fraction of the events in the interval
+
+        :param starts: array of start times
+        :param stops: array of stop times
+        :return: array of dead times
+        """
+
+        starts = np.atleast_1d(np.asarray(starts, dtype=float))
+        stops = np.atleast_1d(np.asarray(stops, dtype=float))
+
+        if self._cumulative_dead_time_fraction is None:
+
+            return np.zeros(starts.shape[0])
+
+        lows, highs = self._event_index.time_slices(starts, stops)
+
+        # as for the mean of an empty selection, intervals without events have an undefined dead time
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+
+            mean_fraction = (self._cumulative_dead_time_fraction[highs] -
+                             self._cumulative_dead_time_fraction[lows]) / (highs - lows)
+
+        return mean_fraction * (stops - starts)
+
+    def _data_fingerprint(self):
+        """
+        the arrays identifying the data in the background fit cache
+        :return:
+        """
+
+        return super(EventListWithDeadTimeFraction, self)._data_fingerprint() + [self._dead_time_fraction]
+
     def exposure_over_interval(self, start, stop):
         """
         calculate the exposure over the given interval
@@ -789,19 +758,21 @@ class EventListWithDeadTimeFraction(EventList):
         :return:
         """
 
-        mask = self._select_events(start, stop)
-
-        interval = stop - start
-
-        if self._dead_time_fraction is not None:
+        return self.exposure_over_intervals([start], [stop])[0]
 
-            interval_deadtime = (self._dead_time_fraction[mask]).mean() * interval
+    def exposure_over_intervals(self, starts, stops):
+        """
+        calculate the exposure over each of the given intervals
 
-        else:
+        :param starts: array of start times
+        :param stops:  array of stop times
+        :return: array of exposures
+        """
 
-            interval_deadtime = 0
+        starts = np.atleast_1d(np.asarray(starts, dtype=float))
+        stops = np.atleast_1d(np.asarray(stops, dtype=float))
 
-        return interval - interval_deadtime
+        return (stops - starts) - self._dead_time_over_intervals(starts, stops)
 
     def set_active_time_intervals(self, *args):
         '''Set the time interval(s) to be used during the analysis.
@@ -815,72 +786,30 @@ class EventListWithDeadTimeFraction(EventList):
 
         self._time_selection_exists = True
 
-        interval_masks = []
-
         time_intervals = TimeIntervalSet.from_strings(*args)
 
         time_intervals.merge_intersecting_intervals(in_place=True)
 
-        for interval in time_intervals:
-            tmin = interval.start_time
-            tmax = interval.stop_time
-
-            mask = self._select_events(tmin, tmax)
-
-            interval_masks.append(mask)
-
         self._time_intervals = time_intervals
 
-        time_mask = interval_masks[0]
-        if len(interval_masks) > 1:
-            for mask in interval_masks[1:]:
-                time_mask = np.logical_or(time_mask, mask)
-
-        tmp_counts = []    # Temporary list to hold the total counts per chan
-
-        for chan in range(self._first_channel, self._n_channels + self._first_channel):
-            channel_mask = self._measurement == chan
-            counts_mask = np.logical_and(channel_mask, time_mask)
-            total_counts = len(self._arrival_times[counts_mask])
-
-            tmp_counts.append(total_counts)
+        # the intervals are merged, so we can simply sum the counts of each one
 
-        self._counts = np.array(tmp_counts)
-
-        tmp_counts = []
-        tmp_err = []    # Temporary list to hold the err counts per chan
+        self._counts = self._count_per_channel_over_time_intervals(self._time_intervals)
 
         if self._poly_fit_exists:
 
-            if not self._poly_fit_exists:
-                raise RuntimeError('A polynomial fit to the channels does not exist!')
-
-            for chan in range(self._n_channels):
-
-                total_counts = 0
-                counts_err = 0
+            # integrate the background polynomials of all channels over the intervals
 
-                for tmin, tmax in zip(self._time_intervals.start_times, self._time_intervals.stop_times):
-                    # Now integrate the appropriate background polynomial
-                    total_counts += self._polynomials[chan].integral(tmin, tmax)
-                    counts_err += (self._polynomials[chan].integral_error(tmin, tmax))**2
-
-                tmp_counts.append(total_counts)
-
-                tmp_err.append(np.sqrt(counts_err))
-
-            self._poly_counts = np.array(tmp_counts)
-
-            self._poly_count_err = np.array(tmp_err)
+            self._poly_counts, self._poly_count_err = self._poly_counts_over_time_intervals(self._time_intervals)
 
         # Dead time correction
 
         exposure = 0.
-        total_dead_time = 0.
-        for interval, imask in zip(self._time_intervals, interval_masks):
+        for interval in self._time_intervals:
             exposure += interval.duration
-            if self._dead_time_fraction is not None:
-                total_dead_time += interval.duration * self._dead_time_fraction[imask].mean()
+
+        total_dead_time = self._dead_time_over_intervals(self._time_intervals.start_times,
+                                                         self._time_intervals.stop_times).sum()
 
         self._exposure = exposure - total_dead_time
 
@@ -906,7 +835,8 @@ class EventListWithLiveTime(EventList):
                  mission=None,
                  instrument=None,
                  verbose=True,
-                 edges=None
+                 edges=None,
+                 gti=None
     ):
         """
         An EventList where the exposure is calculated via and array of livetimes per interval.
@@ -930,6 +860,8 @@ class EventListWithLiveTime(EventList):
         :param verbose:
         :param  ra:
         :param  dec:
+        :param gti: (optional) a GoodTimeIntervals instance. If given, only the live time within the GTIs is counted
+        in the exposure
         """
 
         assert len(live_time) == len(
@@ -943,86 +875,105 @@ class EventListWithLiveTime(EventList):
         super(EventListWithLiveTime, self).__init__(arrival_times, measurement, n_channels, start_time, stop_time,
                                                     quality, first_channel, ra, dec, mission, instrument, verbose)
 
-        self._live_time = np.asarray(live_time)
-        self._live_time_starts = np.asarray(live_time_starts)
-        self._live_time_stops = np.asarray(live_time_stops)
+        # sort the live time bins so that they can be searched
 
-    def exposure_over_interval(self, start, stop):
-        """
+        live_time_order = np.argsort(live_time_starts, kind='mergesort')
 
-        :param start: start time of interval
-        :param stop: stop time of interval
-        :return: exposure
-        """
+        self._live_time = np.asarray(live_time, dtype=float)[live_time_order]
+        self._live_time_starts = np.asarray(live_time_starts, dtype=float)[live_time_order]
+        self._live_time_stops = np.asarray(live_time_stops, dtype=float)[live_time_order]
 
-        # First see if the interval is completely contained inside a
-        # livetime interval. In this case we only compute that.
+        # protect against zero-width bins
 
-        # Note that this is explicitly on the open boundary of the
-        # intervals because the closed boundary is covered in the
-        # next step
+        self._live_time_widths = self._live_time_stops - self._live_time_starts
 
-        inside_idx = np.logical_and(self._live_time_starts < start, stop < self._live_time_stops)
+        self._live_time_widths[self._live_time_widths <= 0] = np.inf
 
-        # see if it contains elements
+        # cumulative live time of all bins preceding each bin, so that the live time
+        # over any interval is the difference of two interpolations in this table
 
-        if self._live_time[inside_idx]:
+        self._cumulative_live_time = np.zeros(self._live_time.shape[0])
 
-            # we want to take a fraction of the live time covered
+        np.cumsum(self._live_time[:-1], out=self._cumulative_live_time[1:])
 
-            dt = self._live_time_stops[inside_idx] - self._live_time_starts[inside_idx]
+        self._gti = gti
 
-            fraction = (stop - start) / dt
+    def _integrated_live_time(self, times):
+        """
+        the live time accumulated from the beginning of the live time table up to each of
+        the given times. The live time is assumed to be uniformly distributed within
+        each live time bin, so this is a piecewise linear function of time
 
-            total_livetime = self._live_time[inside_idx] * fraction
+        :param times: array of times
+        :return: array of integrated live times
+        """
 
-        else:
+        times = np.atleast_1d(np.asarray(times, dtype=float))
 
-            # First we get the live time of bins that are fully contained in the given interval
-            # We now go for the closed interval because it is possible to have overlap with other intervals
-            # when a closed interval exists... but not when there is only an open interval
+        # find the last bin starting before each time
 
-            full_inclusion_idx = np.logical_and(start <= self._live_time_starts, stop >= self._live_time_stops)
+        idx = np.searchsorted(self._live_time_starts, times, side='right') - 1
 
-            full_inclusion_livetime = self._live_time[full_inclusion_idx].sum()
+        before_first_bin = idx < 0
 
-            # Now we get the fractional parts on the left and right
+        idx[before_first_bin] = 0
 
-            # Get the fractional part of the left bin
+        # and the fraction of that bin which is covered
 
-            left_remainder_idx = np.logical_and(start <= self._live_time_stops, self._live_time_starts <= start)
+        fraction = np.clip((times - self._live_time_starts[idx]) / self._live_time_widths[idx], 0., 1.)
 
-            dt = self._live_time_stops[left_remainder_idx] - self._live_time_starts[left_remainder_idx]
+        integrated = self._cumulative_live_time[idx] + self._live_time[idx] * fraction
 
-            # we want the distance to the stop of this bin
+        integrated[before_first_bin] = 0.
 
-            distance_from_next_bin = self._live_time_stops[left_remainder_idx] - start
+        return integrated
 
-            fraction = distance_from_next_bin / dt
+    def _data_fingerprint(self):
+        """
+        the arrays identifying the data in the background fit cache
+        :return:
+        """
 
-            left_fractional_livetime = self._live_time[left_remainder_idx] * fraction
+        fingerprint = super(EventListWithLiveTime, self)._data_fingerprint() + [self._live_time,
+                                                                              self._live_time_starts,
+                                                                              self._live_time_stops]
 
-            # Get the fractional part of the right bin
+        if self._gti is not None:
 
-            right_remainder_idx = np.logical_and(self._live_time_starts <= stop, stop <= self._live_time_stops)
+            fingerprint += [self._gti.starts, self._gti.stops]
 
-            dt = self._live_time_stops[right_remainder_idx] - self._live_time_starts[right_remainder_idx]
+        return fingerprint
 
-            # we want the distance from the last full bin
+    def exposure_over_interval(self, start, stop):
+        """
 
-            distance_from_next_bin = stop - self._live_time_starts[right_remainder_idx]
+        :param start: start time of interval
+        :param stop: stop time of interval
+        :return: exposure
+        """
 
-            fraction = distance_from_next_bin / dt
+        return self.exposure_over_intervals([start], [stop])[0]
 
-            right_fractional_livetime = self._live_time[right_remainder_idx] * fraction
+    def exposure_over_intervals(self, starts, stops):
+        """
+        the live time over each of the given intervals, including the fractional
+        parts of the live time bins at the edges of the intervals. If GTIs were given,
+        only the parts of the intervals within the GTIs are counted
 
-            # sum up all the live time
+        :param starts: array of start times
+        :param stops: array of stop times
+        :return: array of exposures
+        """
+
+        if self._live_time.shape[0] == 0:
+
+            return np.zeros(np.atleast_1d(starts).shape[0])
 
-            total_livetime = full_inclusion_livetime + left_fractional_livetime + right_fractional_livetime
+        if self._gti is not None:
 
-        # the sum at the end converts all the arrays to floats
+            return self._gti.integral(self._integrated_live_time, np.atleast_1d(starts), np.atleast_1d(stops))
 
-        return total_livetime.sum()
+        return self._integrated_live_time(stops) - self._integrated_live_time(starts)
 
     def set_active_time_intervals(self, *args):
         '''Set the time interval(s) to be used during the analysis.
@@ -1036,71 +987,30 @@ class EventListWithLiveTime(EventList):
 
         self._time_selection_exists = True
 
-        interval_masks = []
-
         time_intervals = TimeIntervalSet.from_strings(*args)
 
         time_intervals.merge_intersecting_intervals(in_place=True)
 
-        for interval in time_intervals:
-            tmin = interval.start_time
-            tmax = interval.stop_time
-            mask = self._select_events(tmin, tmax)
-
-            interval_masks.append(mask)
-
         self._time_intervals = time_intervals
 
-        time_mask = interval_masks[0]
-        if len(interval_masks) > 1:
-            for mask in interval_masks[1:]:
-                time_mask = np.logical_or(time_mask, mask)
+        # the intervals are merged, so we can simply sum the counts of each one
 
-        tmp_counts = []    # Temporary list to hold the total counts per chan
-
-        for chan in range(self._first_channel, self._n_channels + self._first_channel):
-            channel_mask = self._measurement == chan
-            counts_mask = np.logical_and(channel_mask, time_mask)
-            total_counts = len(self._arrival_times[counts_mask])
-
-            tmp_counts.append(total_counts)
-
-        self._counts = np.array(tmp_counts)
-
-        tmp_counts = []
-        tmp_err = []    # Temporary list to hold the err counts per chan
+        self._counts = self._count_per_channel_over_time_intervals(self._time_intervals)
 
         if self._poly_fit_exists:
 
-            if not self._poly_fit_exists:
-                raise RuntimeError('A polynomial fit to the channels does not exist!')
-
-            # for chan in range(self._first_channel, self._n_channels + self._first_channel):
-            for chan in range(self._n_channels):
-
-                total_counts = 0
-                counts_err = 0
+            # integrate the background polynomials of all channels over the intervals
 
-                for tmin, tmax in zip(self._time_intervals.start_times, self._time_intervals.stop_times):
-                    # Now integrate the appropriate background polynomial
-                    total_counts += self._polynomials[chan].integral(tmin, tmax)
-                    counts_err += (self._polynomials[chan].integral_error(tmin, tmax))**2
-
-                tmp_counts.append(total_counts)
-
-                tmp_err.append(np.sqrt(counts_err))
-
-            self._poly_counts = np.array(tmp_counts)
-
-            self._poly_count_err = np.array(tmp_err)
+            self._poly_counts, self._poly_count_err = self._poly_counts_over_time_intervals(self._time_intervals)
 
         # Live time correction
 
-        exposure = 0.
+        exposure = self.exposure_over_intervals(self._time_intervals.start_times,
+                                                self._time_intervals.stop_times).sum()
+
         total_real_time = 0.
         for interval in self._time_intervals:
             total_real_time += interval.duration
-            exposure += self.exposure_over_interval(interval.start_time, interval.stop_time)
 
         # In this case the exposure is the total live time
 
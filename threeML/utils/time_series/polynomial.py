@@ -171,6 +171,147 @@ class Polynomial(object):
         return np.sqrt(err2)
 
 
+class PolynomialSet(object):
+    def __init__(self, polynomials):
+        """
+        A container for the polynomials of all the channels of a time series. The coefficients
+        and covariance matrices are stored as stacked arrays (padded with zeros up to the largest
+        degree), so that values, integrals and integral errors of all the channels over arrays
+        of times or intervals are computed with array operations instead of a loop over the
+        polynomials.
+
+        The set behaves like the list of polynomials it was built from.
+
+        :param polynomials: a list of Polynomial
+        """
+
+        self._polynomials = list(polynomials)
+
+        self._n_polynomials = len(self._polynomials)
+
+        self._degree = max([poly.degree for poly in self._polynomials] + [0])
+
+        n_coefficients = self._degree + 1
+
+        self._coefficients = np.zeros((self._n_polynomials, n_coefficients))
+
+        self._covariance_matrices = np.zeros((self._n_polynomials, n_coefficients, n_coefficients))
+
+        for i, poly in enumerate(self._polynomials):
+
+            this_n_coefficients = poly.degree + 1
+
+            self._coefficients[i, :this_n_coefficients] = poly.coefficients
+
+            self._covariance_matrices[i, :this_n_coefficients, :this_n_coefficients] = poly.covariance_matrix
+
+        self._i_plus_1 = np.arange(1, n_coefficients + 1, dtype=float)
+
+    @classmethod
+    def from_arrays(cls, coefficients, covariance_matrices):
+        """
+        build the set from stacked coefficients and covariance matrices, as returned
+        by batch_polyfit and batch_unbinned_polyfit
+
+        :param coefficients: (n_polynomials, degree + 1) array
+        :param covariance_matrices: (n_polynomials, degree + 1, degree + 1) array
+        :return: a PolynomialSet
+        """
+
+        return cls(map(Polynomial.from_previous_fit, coefficients, covariance_matrices))
+
+    def __len__(self):
+
+        return self._n_polynomials
+
+    def __iter__(self):
+
+        return iter(self._polynomials)
+
+    def __getitem__(self, item):
+
+        return self._polynomials[item]
+
+    @property
+    def degree(self):
+        """
+        the largest degree of the polynomials
+        :return:
+        """
+
+        return self._degree
+
+    @property
+    def coefficients(self):
+        """
+        the (n_polynomials, degree + 1) array of coefficients
+        :return:
+        """
+
+        return self._coefficients
+
+    @property
+    def covariance_matrices(self):
+        """
+        the (n_polynomials, degree + 1, degree + 1) array of covariance matrices
+        :return:
+        """
+
+        return self._covariance_matrices
+
+    def __call__(self, x):
+        """
+        evaluate all the polynomials
+
+        :param x: array of times
+        :return: (n_times, n_polynomials) array
+        """
+
+        x = np.atleast_1d(np.asarray(x, dtype=float))[:, np.newaxis]
+
+        result = np.zeros((x.shape[0], self._n_polynomials))
+
+        for coefficient in self._coefficients.T[::-1]:
+
+            result = result * x + coefficient
+
+        return result
+
+    def _integral_basis(self, xmin, xmax):
+
+        xmin, xmax = np.broadcast_arrays(np.atleast_1d(np.asarray(xmin, dtype=float)),
+                                         np.atleast_1d(np.asarray(xmax, dtype=float)))
+
+        return (np.power(xmax[:, np.newaxis], self._i_plus_1) -
+                np.power(xmin[:, np.newaxis], self._i_plus_1)) / self._i_plus_1
+
+    def integral(self, xmin, xmax):
+        """
+        the integral of all the polynomials over each of the intervals [xmin, xmax]
+
+        :param xmin: array of start times
+        :param xmax: array of stop times
+        :return: (n_intervals, n_polynomials) array
+        """
+
+        return self._integral_basis(xmin, xmax).dot(self._coefficients.T)
+
+    def integral_error(self, xmin, xmax):
+        """
+        the error on the integral of all the polynomials over each of the intervals [xmin, xmax]
+
+        :param xmin: array of start times
+        :param xmax: array of stop times
+        :return: (n_intervals, n_polynomials) array
+        """
+
+        c = self._integral_basis(xmin, xmax)
+
+        err2 = np.einsum('ik,nkl,il->in', c, self._covariance_matrices, c)
+
+        return np.sqrt(err2)
+
+
 class PolyLogLikelihood(object):
 
     def __init__(self, model, exposure):
@@ -409,8 +550,13 @@ class PolyUnbinnedLogLikelihood(PolyLogLikelihood):
 
 
 
-def polyfit(x, y, grade, exposure):
-    """ function to fit a polynomial to event data. not a member to allow parallel computation """
+def polyfit(x, y, grade, exposure, initial_guess=None):
+    """
+    function to fit a polynomial to event data. not a member to allow parallel computation
+
+    :param initial_guess: (optional) the coefficients to start the fit from (for example a previous fit of
+    similar data). If None, the starting point is computed from the data
+    """
 
     # Check that we have enough counts to perform the fit, otherwise
     # return a "zero polynomial"
@@ -425,12 +571,18 @@ def polyfit(x, y, grade, exposure):
     # (note that polyfit returns the coefficient starting from the maximum grade,
     # thus we need to reverse the order)
 
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
+    if initial_guess is not None and len(initial_guess) == grade + 1:
+
+        initial_guess = np.array(initial_guess, dtype=float)
 
-        initial_guess = np.polyfit(x, y, grade)
+    else:
 
-    initial_guess = initial_guess[::-1]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+
+            initial_guess = np.polyfit(x, y, grade)
+
+        initial_guess = initial_guess[::-1]
 
     polynomial = Polynomial(initial_guess)
 
@@ -485,18 +637,26 @@ def polyfit(x, y, grade, exposure):
     return final_polynomial, min_log_likelihood
 
 
-def unbinned_polyfit(events, grade, t_start, t_stop, exposure, initial_amplitude=1):
+def unbinned_polyfit(events, grade, t_start, t_stop, exposure, initial_amplitude=1, initial_guess=None):
     """
     function to fit a polynomial to event data. not a member to allow parallel computation
 
+    :param initial_guess: (optional) the coefficients to start the fit from (for example a previous fit of
+    similar data). If None, the amplitude is first searched on a grid
     """
 
+    if initial_guess is not None and len(initial_guess) != grade + 1:
+
+        initial_guess = None
+
     # first do a simple amplitude fit
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
 
         search_grid = np.logspace(-2, 4, 10)
 
+        warm_start = initial_guess
+
         initial_guess = np.zeros(grade + 1)
 
         polynomial = Polynomial(initial_guess)
@@ -515,13 +675,19 @@ def unbinned_polyfit(events, grade, t_start, t_stop, exposure, initial_amplitude
                                                    t_stop,
                                                    exposure)
 
-        like_grid = []
-        for amp in search_grid:
+        if warm_start is not None:
+
+            initial_guess = np.array(warm_start, dtype=float)
+
+        else:
 
-            initial_guess[0] = amp
-            like_grid.append(log_likelihood(initial_guess))
+            like_grid = []
+            for amp in search_grid:
 
-        initial_guess[0] = search_grid[np.argmin(like_grid)]
+                initial_guess[0] = amp
+                like_grid.append(log_likelihood(initial_guess))
+
+            initial_guess[0] = search_grid[np.argmin(like_grid)]
 
         # Improve the solution
         dof = len(events) - (grade + 1)
@@ -556,3 +722,515 @@ def unbinned_polyfit(events, grade, t_start, t_stop, exposure, initial_amplitude
 
 
     return final_polynomial, min_log_likelihood
+
+
+class BatchPolyLogLikelihood(object):
+    """
+    Poisson likelihood of the polynomials of many channels at once. The coefficients are
+    a (n_channels, grade + 1) array and the statistic, its gradient and its Hessian are
+    evaluated for all channels with array operations, so that all the fits can be performed
+    together with a batched Newton method (see batch_polyfit and batch_unbinned_polyfit).
+
+    Internally the times are divided by a scale (the largest absolute time) so that the
+    powers of the time stay of order unity, which keeps the Hessian well conditioned. The
+    coefficients used by this class are the ones of the scaled polynomial.
+    """
+
+    def __init__(self, n_channels, grade, scale):
+
+        self._n_channels = n_channels
+        self._n_parameters = grade + 1
+        self._scale = float(scale)
+
+    @property
+    def n_channels(self):
+
+        return self._n_channels
+
+    @property
+    def n_parameters(self):
+
+        return self._n_parameters
+
+    def to_coefficients(self, scaled_coefficients, scaled_covariances):
+        """
+        convert coefficients and covariance matrices of the scaled polynomials to the ones of the polynomials
+        in the original time units
+
+        :param scaled_coefficients: (n_channels, grade + 1) array
+        :param scaled_covariances: (n_channels, grade + 1, grade + 1) array
+        :return: coefficients, covariances
+        """
+
+        factors = 1. / np.power(self._scale, np.arange(self._n_parameters))
+
+        coefficients = scaled_coefficients * factors
+
+        covariances = scaled_covariances * np.outer(factors, factors)
+
+        return coefficients, covariances
+
+    def initial_guess(self):
+
+        raise NotImplementedError('must be built in subclass')
+
+    def __call__(self, coefficients):
+
+        raise NotImplementedError('must be built in subclass')
+
+    def gradient_and_hessian(self, coefficients):
+
+        raise NotImplementedError('must be built in subclass')
+
+
+class BatchPolyBinnedLogLikelihood(BatchPolyLogLikelihood):
+    """
+    Implements the Cash statistic (as PolyBinnedLogLikelihood) for the light curves of
+    all channels, which share the same bins and exposure.
+    """
+
+    def __init__(self, x, counts, grade, exposure):
+        """
+
+        :param x: the bin centers (n_bins)
+        :param counts: the counts of each channel (n_channels, n_bins)
+        :param grade: the polynomial grade
+        :param exposure: the exposure of each bin (n_bins)
+        """
+
+        x = np.asarray(x, dtype=float)
+
+        self._counts = np.atleast_2d(np.asarray(counts, dtype=float))
+
+        exposure = np.ones_like(x) * exposure
+
+        scale = np.max(np.abs(x)) if x.shape[0] > 0 else 1.
+
+        if scale == 0:
+
+            scale = 1.
+
+        super(BatchPolyBinnedLogLikelihood, self).__init__(self._counts.shape[0], grade, scale)
+
+        # design matrix: the model counts are coefficients.dot(design.T)
+
+        self._design = exposure[:, np.newaxis] * np.power(x[:, np.newaxis] / self._scale,
+                                                          np.arange(self._n_parameters))
+
+        self._non_zero_mask = self._counts > 0
+
+        self._total_exposure = exposure.sum()
+
+    def initial_guess(self):
+        """
+        a constant rate reproducing the total counts of each channel
+        :return:
+        """
+
+        initial = np.zeros((self._n_channels, self._n_parameters))
+
+        initial[:, 0] = self._counts.sum(axis=1) / self._total_exposure
+
+        return initial
+
+    def __call__(self, coefficients):
+        """
+        the Cash statistic of each channel. Channels where the model is not
+        positive in every bin get an infinite statistic
+
+        :param coefficients: (n_channels, grade + 1) array
+        :return: array of statistics
+        """
+
+        M = coefficients.dot(self._design.T)
+
+        valid = np.all(M > 0, axis=1)
+
+        # D_i * log(M_i) is zero whenever D_i = 0
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+
+            d_times_logM = np.where(self._non_zero_mask, self._counts * np.log(M), 0.)
+
+        log_likelihood = np.sum(M - d_times_logM, axis=1)
+
+        log_likelihood[~valid] = np.inf
+
+        return log_likelihood
+
+    def gradient_and_hessian(self, coefficients):
+        """
+        the analytic gradient and Hessian of the Cash statistic of each channel
+
+        :param coefficients: (n_channels, grade + 1) array
+        :return: gradient (n_channels, grade + 1) and Hessian (n_channels, grade + 1, grade + 1)
+        """
+
+        M = coefficients.dot(self._design.T)
+
+        ratio = self._counts / M
+
+        gradient = (1. - ratio).dot(self._design)
+
+        hessian = np.einsum('ci,ik,il->ckl', ratio / M, self._design, self._design)
+
+        return gradient, hessian
+
+
+class BatchPolyUnbinnedLogLikelihood(BatchPolyLogLikelihood):
+    """
+    Implements the unbinned Poisson likelihood (as PolyUnbinnedLogLikelihood) for the events
+    of all channels, which share the same time intervals and exposure.
+    """
+
+    def __init__(self, events, grade, t_start, t_stop, exposure):
+        """
+
+        :param events: a list with the arrival times of the events of each channel
+        :param grade: the polynomial grade
+        :param t_start: the start times of the fitted intervals
+        :param t_stop: the stop times of the fitted intervals
+        :param exposure: the exposure of the fitted intervals
+        """
+
+        t_start = np.atleast_1d(np.asarray(t_start, dtype=float))
+        t_stop = np.atleast_1d(np.asarray(t_stop, dtype=float))
+
+        scale = max(np.max(np.abs(t_start)), np.max(np.abs(t_stop)))
+
+        if scale == 0:
+
+            scale = 1.
+
+        super(BatchPolyUnbinnedLogLikelihood, self).__init__(len(events), grade, scale)
+
+        self._n_events = np.array([len(channel_events) for channel_events in events])
+
+        # all the events in one array, with the channel each one belongs to
+
+        self._channel_of_event = np.repeat(np.arange(self._n_channels), self._n_events)
+
+        all_events = np.concatenate([np.asarray(channel_events, dtype=float) for channel_events in events] +
+                                    [np.array([])])
+
+        self._powers = np.power(all_events[:, np.newaxis] / self._scale, np.arange(self._n_parameters))
+
+        # the integral of each power of time over the intervals
+
+        i_plus_1 = np.arange(1, self._n_parameters + 1)
+
+        self._integrals = self._scale * np.sum((np.power(t_stop[:, np.newaxis] / self._scale, i_plus_1) -
+                                                np.power(t_start[:, np.newaxis] / self._scale, i_plus_1)) / i_plus_1,
+                                               axis=0)
+
+        self._log_exposure = np.log(exposure)
+
+    def _per_channel_sum(self, values):
+
+        return np.bincount(self._channel_of_event, weights=values, minlength=self._n_channels)
+
+    def _model_at_events(self, coefficients):
+
+        return np.sum(coefficients[self._channel_of_event] * self._powers, axis=1)
+
+    def initial_guess(self):
+        """
+        a constant rate reproducing the number of events of each channel
+        :return:
+        """
+
+        initial = np.zeros((self._n_channels, self._n_parameters))
+
+        initial[:, 0] = self._n_events / self._integrals[0]
+
+        return initial
+
+    def __call__(self, coefficients):
+        """
+        minus the log-likelihood of each channel. Channels where the model is not
+        positive at every event get an infinite statistic
+
+        :param coefficients: (n_channels, grade + 1) array
+        :return: array of statistics
+        """
+
+        M = self._model_at_events(coefficients)
+
+        valid = self._per_channel_sum((M <= 0).astype(float)) == 0
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+
+            logM = np.log(M) + self._log_exposure
+
+        logM[M <= 0] = 0.
+
+        log_likelihood = -coefficients.dot(self._integrals) + self._per_channel_sum(logM)
+
+        minus_log_likelihood = -log_likelihood
+
+        minus_log_likelihood[~valid] = np.inf
+
+        return minus_log_likelihood
+
+    def gradient_and_hessian(self, coefficients):
+        """
+        the analytic gradient and Hessian of minus the log-likelihood of each channel
+
+        :param coefficients: (n_channels, grade + 1) array
+        :return: gradient (n_channels, grade + 1) and Hessian (n_channels, grade + 1, grade + 1)
+        """
+
+        M = self._model_at_events(coefficients)
+
+        weighted_powers = self._powers / M[:, np.newaxis]
+
+        gradient = np.zeros((self._n_channels, self._n_parameters))
+
+        hessian = np.zeros((self._n_channels, self._n_parameters, self._n_parameters))
+
+        for k in range(self._n_parameters):
+
+            gradient[:, k] = self._integrals[k] - self._per_channel_sum(weighted_powers[:, k])
+
+            for l in range(k, self._n_parameters):
+
+                hessian[:, k, l] = self._per_channel_sum(weighted_powers[:, k] * weighted_powers[:, l])
+                hessian[:, l, k] = hessian[:, k, l]
+
+        return gradient, hessian
+
+
+def _newton_step(gradient, hessian, active, ridge):
+    """
+    The Newton step of each channel and its Newton decrement. The inactive channels get a
+    dummy step
+
+    :return: steps, decrements
+    """
+
+    n_parameters = hessian.shape[-1]
+
+    diagonal = np.einsum('ckk->ck', hessian)
+
+    regularized = hessian + ridge * (diagonal.max(axis=1)[:, np.newaxis, np.newaxis] + 1e-300)
+
+    regularized[~active] = np.eye(n_parameters)
+
+    step = np.linalg.solve(regularized, gradient[..., np.newaxis])[..., 0]
+
+    return step, np.sum(gradient * step, axis=1)
+
+
+def _batch_newton(log_likelihood, fit_mask, max_iterations=100, tolerance=1e-8):
+    """
+    Minimize the statistic of all the channels selected by the mask at the same time with a Newton
+    method. Each channel takes its own step, which is halved until the statistic decreases enough
+    (and the model stays positive), and stops when its Newton decrement is below the tolerance.
+
+    :param log_likelihood: a BatchPolyLogLikelihood
+    :param fit_mask: boolean mask of the channels to fit
+    :param max_iterations: maximum number of Newton iterations
+    :param tolerance: tolerance on the decrease of the statistic
+    :return: scaled coefficients, Hessian at the minimum, statistic at the minimum
+    """
+
+    coefficients = log_likelihood.initial_guess()
+
+    statistic = log_likelihood(coefficients)
+
+    n_parameters = log_likelihood.n_parameters
+
+    # a tiny ridge protects the solution of the Newton system when
+    # the data cannot constrain all the coefficients
+
+    ridge = 1e-10 * np.eye(n_parameters)
+
+    active = np.array(fit_mask, dtype=bool)
+
+    for _ in range(max_iterations):
+
+        if not np.any(active):
+
+            break
+
+        gradient, hessian = log_likelihood.gradient_and_hessian(coefficients)
+
+        step, decrement = _newton_step(gradient, hessian, active, ridge)
+
+        # channels which are already at the minimum
+
+        active = np.logical_and(active, decrement > 2 * tolerance)
+
+        # backtracking line search
+
+        step_size = np.where(active, 1., 0.)
+
+        searching = active.copy()
+
+        for _ in range(50):
+
+            if not np.any(searching):
+
+                break
+
+            trial = coefficients - step_size[:, np.newaxis] * step
+
+            trial_statistic = log_likelihood(trial)
+
+            accepted = np.logical_and(searching,
+                                      trial_statistic <= statistic - 1e-4 * step_size * decrement)
+
+            coefficients[accepted] = trial[accepted]
+
+            statistic[accepted] = trial_statistic[accepted]
+
+            searching = np.logical_and(searching, ~accepted)
+
+            step_size[searching] *= 0.5
+
+        # channels which cannot decrease the statistic any further are done
+
+        active = np.logical_and(active, ~searching)
+
+    gradient, hessian = log_likelihood.gradient_and_hessian(coefficients)
+
+    if np.any(active):
+
+        # the channels still active after the last iteration might have converged with their last step
+
+        _, decrement = _newton_step(gradient, hessian, active, ridge)
+
+        not_converged = np.logical_and(active, decrement > 2 * tolerance)
+
+        if np.any(not_converged):
+
+            custom_warnings.warn("The batched polynomial fit did not converge for %d channels" % not_converged.sum())
+
+    return coefficients, hessian, statistic
+
+
+def _batch_fit(log_likelihood, fit_mask):
+
+    n_channels = log_likelihood.n_channels
+    n_parameters = log_likelihood.n_parameters
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        scaled_coefficients, hessian, statistic = _batch_newton(log_likelihood, fit_mask)
+
+    scaled_covariances = np.zeros((n_channels, n_parameters, n_parameters))
+
+    for channel in np.where(fit_mask)[0]:
+
+        try:
+
+            scaled_covariances[channel] = np.linalg.inv(hessian[channel])
+
+        except np.linalg.LinAlgError:
+
+            custom_warnings.warn("Cannot invert Hessian matrix of channel %d, looks like the matrix is singluar"
+                                 % channel, CannotComputeCovariance)
+
+            scaled_covariances[channel] = np.nan
+
+    # channels without data have a zero polynomial, as in polyfit and unbinned_polyfit
+
+    scaled_coefficients[~fit_mask] = 0.
+
+    statistic[~fit_mask] = 0.
+
+    coefficients, covariances = log_likelihood.to_coefficients(scaled_coefficients, scaled_covariances)
+
+    return coefficients, covariances, statistic
+
+
+def _batch_fit_with_reduced_grade(log_likelihood_builder, grade, fit_mask, reduced_mask):
+    """
+    Fit the channels of fit_mask with a polynomial of the given grade, except the ones of
+    reduced_mask which are fitted with a constant, as polyfit and unbinned_polyfit do for the
+    channels with too few degrees of freedom. The higher coefficients of the constants are zero.
+
+    :param log_likelihood_builder: a function returning the BatchPolyLogLikelihood for a grade
+    :param grade: the polynomial grade
+    :param fit_mask: boolean mask of the channels to fit
+    :param reduced_mask: boolean mask of the channels to fit with a constant
+    :return: coefficients, covariances, statistic (as _batch_fit)
+    """
+
+    if grade == 0 or not np.any(reduced_mask):
+
+        return _batch_fit(log_likelihood_builder(grade), fit_mask)
+
+    coefficients, covariances, statistic = _batch_fit(log_likelihood_builder(grade),
+                                                      np.logical_and(fit_mask, ~reduced_mask))
+
+    constant_coefficients, constant_covariances, constant_statistic = _batch_fit(log_likelihood_builder(0),
+                                                                                 reduced_mask)
+
+    coefficients[reduced_mask] = 0.
+    coefficients[reduced_mask, 0] = constant_coefficients[reduced_mask, 0]
+
+    covariances[reduced_mask] = 0.
+    covariances[reduced_mask, 0, 0] = constant_covariances[reduced_mask, 0, 0]
+
+    statistic[reduced_mask] = constant_statistic[reduced_mask]
+
+    return coefficients, covariances, statistic
+
+
+def batch_polyfit(x, counts, grade, exposure):
+    """
+    fit a polynomial to the binned light curves of all channels at once with a batched Newton method
+    for the Cash statistic. This is an alternative to calling polyfit for each channel.
+
+    :param x: the bin centers (n_bins)
+    :param counts: the counts of each channel (n_channels, n_bins)
+    :param grade: the polynomial grade
+    :param exposure: the exposure of each bin (n_bins)
+    :return: coefficients (n_channels, grade + 1), covariance matrices (n_channels, grade + 1, grade + 1)
+    and the minimum of the statistic of each channel. Each pair of coefficients and covariance can be
+    passed to Polynomial.from_previous_fit
+    """
+
+    counts = np.atleast_2d(np.asarray(counts, dtype=float))
+
+    fit_mask = counts.sum(axis=1) > 0
+
+    # as in polyfit, the channels with too few non-empty bins for this grade are fitted with a constant
+
+    n_non_zero = np.sum(counts > 0, axis=1)
+
+    reduced_mask = np.logical_and(fit_mask, n_non_zero - (grade + 1) < 2)
+
+    return _batch_fit_with_reduced_grade(lambda this_grade: BatchPolyBinnedLogLikelihood(x, counts, this_grade,
+                                                                                         exposure),
+                                         grade, fit_mask, reduced_mask)
+
+
+def batch_unbinned_polyfit(events, grade, t_start, t_stop, exposure):
+    """
+    fit a polynomial to the events of all channels at once with a batched Newton method for the
+    unbinned Poisson likelihood. This is an alternative to calling unbinned_polyfit for each channel.
+
+    :param events: a list with the arrival times of the events of each channel
+    :param grade: the polynomial grade
+    :param t_start: the start times of the fitted intervals
+    :param t_stop: the stop times of the fitted intervals
+    :param exposure: the exposure of the fitted intervals
+    :return: coefficients (n_channels, grade + 1), covariance matrices (n_channels, grade + 1, grade + 1)
+    and the minimum of the statistic of each channel. Each pair of coefficients and covariance can be
+    passed to Polynomial.from_previous_fit
+    """
+
+    n_events = np.array([len(channel_events) for channel_events in events])
+
+    fit_mask = n_events > 0
+
+    # as in unbinned_polyfit, the channels with too few events for this grade are fitted with a constant
+
+    reduced_mask = np.logical_and(fit_mask, n_events - (grade + 1) < 1)
+
+    return _batch_fit_with_reduced_grade(lambda this_grade: BatchPolyUnbinnedLogLikelihood(events, this_grade,
+                                                                                           t_start, t_stop,
+                                                                                           exposure),
+                                         grade, fit_mask, reduced_mask)
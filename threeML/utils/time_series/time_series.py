@@ -7,11 +7,16 @@ import numpy as np
 import pandas as pd
 from pandas import HDFStore
 
+from threeML.config.config import threeML_config
 from threeML.exceptions.custom_exceptions import custom_warnings
 from threeML.io.file_utils import sanitize_filename
+from threeML.io.plotting.light_curve_plots import binned_light_curve_plot
+from threeML.io.progress_bar import progress_bar
+from threeML.parallel.parallel_client import ParallelClient
 from threeML.utils.spectrum.binned_spectrum import Quality
 from threeML.utils.time_interval import TimeIntervalSet
-from threeML.utils.time_series.polynomial import polyfit, unbinned_polyfit, Polynomial
+from threeML.utils.time_series.background_fit_cache import get_background_fit_cache, hash_arrays
+from threeML.utils.time_series.polynomial import polyfit, unbinned_polyfit, Polynomial, PolynomialSet
 
 
 class ReducingNumberOfThreads(Warning):
@@ -110,6 +115,10 @@ class TimeSeries(object):
         self._user_poly_order = -1
         self._time_selection_exists = False
         self._poly_fit_exists = False
+        self._batch_fit = False
+
+        self._data_hash = None
+        self._warm_start_fit = None
 
         self._fit_method_info = {"bin type": None, 'fit method': None}
 
@@ -180,17 +189,23 @@ class TimeSeries(object):
 
         Get the total poly counts
 
-        :param start:
-        :param stop:
-        :return:
+        :param start: start time or array of start times
+        :param stop: stop time or array of stop times
+        :param mask: optional boolean mask of the channels to sum
+        :return: the counts (or array of counts if arrays of times are given)
         """
-        if mask is None:
-            mask = np.ones_like(self._polynomials, dtype=np.bool)
 
-        total_counts = 0
+        counts = self._polynomials.integral(start, stop)
+
+        if mask is not None:
 
-        for p in np.asarray(self._polynomials)[mask]:
-            total_counts += p.integral(start, stop)
+            counts = counts[:, np.asarray(mask, dtype=bool)]
+
+        total_counts = counts.sum(axis=1)
+
+        if np.ndim(start) == 0 and np.ndim(stop) == 0:
+
+            return total_counts[0]
 
         return total_counts
 
@@ -199,19 +214,39 @@ class TimeSeries(object):
 
         Get the total poly error
 
-        :param start:
-        :param stop:
-        :return:
+        :param start: start time or array of start times
+        :param stop: stop time or array of stop times
+        :param mask: optional boolean mask of the channels to sum
+        :return: the error (or array of errors if arrays of times are given)
         """
-        if mask is None:
-            mask = np.ones_like(self._polynomials, dtype=np.bool)
 
-        total_counts = 0
+        errors = self._polynomials.integral_error(start, stop)
+
+        if mask is not None:
+
+            errors = errors[:, np.asarray(mask, dtype=bool)]
+
+        total_error = np.sqrt((errors ** 2).sum(axis=1))
+
+        if np.ndim(start) == 0 and np.ndim(stop) == 0:
+
+            return total_error[0]
+
+        return total_error
+
+    def _poly_counts_over_time_intervals(self, time_intervals):
+        """
+        the background counts of each channel and their errors, summed over a set of time intervals
+
+        :param time_intervals: a TimeIntervalSet
+        :return: counts, errors
+        """
 
-        for p in np.asarray(self._polynomials)[mask]:
-            total_counts += p.integral_error(start, stop) ** 2
+        counts = self._polynomials.integral(time_intervals.start_times, time_intervals.stop_times)
 
-        return np.sqrt(total_counts)
+        errors = self._polynomials.integral_error(time_intervals.start_times, time_intervals.stop_times)
+
+        return counts.sum(axis=0), np.sqrt((errors ** 2).sum(axis=0))
 
     @property
     def bins(self):
@@ -238,7 +273,8 @@ class TimeSeries(object):
 
             if self._time_selection_exists:
 
-                self.set_polynomial_fit_interval(*self._poly_intervals.to_string().split(','), unbinned=self._unbinned)
+                self.set_polynomial_fit_interval(*self._poly_intervals.to_string().split(','), unbinned=self._unbinned,
+                                                 batch=self._batch_fit)
 
             else:
 
@@ -276,6 +312,18 @@ class TimeSeries(object):
 
         raise RuntimeError("Must be implemented in sub class")
 
+    def exposure_over_intervals(self, starts, stops):
+        """
+        calculate the exposure over each of the given intervals. Subclasses
+        can override this with a vectorized version
+
+        :param starts: array of start times
+        :param stops: array of stop times
+        :return: array of exposures
+        """
+
+        return np.array([self.exposure_over_interval(start, stop) for start, stop in zip(starts, stops)])
+
     def counts_over_interval(self, start, stop):
         """
         return the number of counts in the selected interval
@@ -299,6 +347,145 @@ class TimeSeries(object):
 
         raise RuntimeError("Must be implemented in sub class")
 
+    def counts_over_intervals(self, starts, stops):
+        """
+        return the number of counts in each of the given intervals. Subclasses
+        can override this with a vectorized version
+
+        :param starts: array of start times
+        :param stops: array of stop times
+        :return: array of counts
+        """
+
+        return np.array([self.counts_over_interval(start, stop) for start, stop in zip(starts, stops)], dtype=float)
+
+    def count_per_channel_over_intervals(self, starts, stops):
+        """
+        return the number of counts per channel in each of the given intervals. Subclasses
+        can override this with a vectorized version
+
+        :param starts: array of start times
+        :param stops: array of stop times
+        :return: (n_intervals, n_channels) array of counts
+        """
+
+        counts = np.zeros((len(starts), self._n_channels))
+
+        for i, (start, stop) in enumerate(zip(starts, stops)):
+
+            counts[i] = self.count_per_channel_over_interval(start, stop)
+
+        return counts
+
+    def light_curve(self, starts, stops, mask=None):
+        """
+        Compute the light curve over arbitrary time bins: the counts, the exposure, the rate and
+        (if a background fit exists) the background rate and its error in each bin.
+
+        :param starts: array of the start times of the bins
+        :param stops: array of the stop times of the bins
+        :param mask: (optional) boolean mask of the channels to use. By default all the counts are used
+        :return: a pandas DataFrame with one row per bin
+        """
+
+        starts = np.atleast_1d(np.asarray(starts, dtype=float))
+        stops = np.atleast_1d(np.asarray(stops, dtype=float))
+
+        assert starts.shape == stops.shape, "starts and stops must have the same length"
+
+        if mask is None:
+
+            counts = self.counts_over_intervals(starts, stops)
+
+        else:
+
+            mask = np.asarray(mask, dtype=bool)
+
+            assert mask.shape[0] == self._n_channels, "the channel mask must have one entry per channel"
+
+            counts = self.count_per_channel_over_intervals(starts, stops)[:, mask].sum(axis=1)
+
+        exposure = self.exposure_over_intervals(starts, stops)
+
+        light_curve = collections.OrderedDict()
+
+        light_curve['start'] = starts
+        light_curve['stop'] = stops
+        light_curve['counts'] = np.asarray(counts, dtype=float)
+        light_curve['exposure'] = exposure
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+
+            light_curve['rate'] = light_curve['counts'] / exposure
+
+            if self._poly_fit_exists:
+
+                # the background *rate* in each bin, summed over the selected channels
+
+                light_curve['background rate'] = self.get_total_poly_count(starts, stops, mask) / exposure
+                light_curve['background rate error'] = self.get_total_poly_error(starts, stops, mask) / exposure
+
+            else:
+
+                light_curve['background rate'] = np.nan * np.ones_like(exposure)
+                light_curve['background rate error'] = np.nan * np.ones_like(exposure)
+
+        return pd.DataFrame(light_curve)
+
+    def _plot_light_curve(self, light_curve, use_exposure=True):
+        """
+        plot a light curve computed with light_curve, together with the
+        active and the background selections
+
+        :param light_curve: a DataFrame returned by light_curve
+        :param use_exposure: if True the rates are computed with the exposure of the bins,
+        otherwise with their duration
+        :return: the figure
+        """
+
+        time_bins = np.vstack((light_curve['start'].values, light_curve['stop'].values)).T
+
+        if use_exposure:
+
+            width = light_curve['exposure'].values
+
+        else:
+
+            width = light_curve['stop'].values - light_curve['start'].values
+
+        if self._poly_fit_exists:
+
+            # the background rate of the light curve is per unit of exposure
+
+            bkg = light_curve['background rate'].values * light_curve['exposure'].values / width
+
+        else:
+
+            bkg = None
+
+        if self.time_intervals is not None:
+
+            selection = self.time_intervals.bin_stack
+
+        else:
+
+            selection = None
+
+        if self.poly_intervals is not None:
+
+            bkg_selection = self.poly_intervals.bin_stack
+
+        else:
+
+            bkg_selection = None
+
+        return binned_light_curve_plot(time_bins=time_bins,
+                                       cnts=light_curve['counts'].values,
+                                       width=width,
+                                       bkg=bkg,
+                                       selection=selection,
+                                       bkg_selections=bkg_selection)
+
     def set_polynomial_fit_interval(self, *time_intervals, **options):
         """Set the time interval to fit the background.
         Multiple intervals can be input as separate arguments
@@ -307,7 +494,10 @@ class TimeSeries(object):
         set_polynomial_fit_interval("-10.0-0.0","10.-15.")
 
         :param time_intervals: intervals to fit on
-        :param options:
+        :param options: unbinned (True or False) to select the unbinned or binned fit, batch (True or False) to fit
+        all channels at once with the batched Newton fitter instead of one scipy minimization per channel,
+        use_cache (True or False) to reuse a fit of the same data and selections from the background fit cache
+        and to store the fit in it (the default is in the configuration, where the cache is switched off)
 
         """
 
@@ -325,6 +515,24 @@ class TimeSeries(object):
 
             unbinned = True
 
+        if 'batch' in options:
+            batch = options.pop('batch')
+            assert type(batch) == bool, 'batch option must be True or False'
+
+        else:
+
+            batch = False
+
+        self._batch_fit = batch
+
+        if 'use_cache' in options:
+            use_cache = options.pop('use_cache')
+            assert type(use_cache) == bool, 'use_cache option must be True or False'
+
+        else:
+
+            use_cache = threeML_config['event list']['use background cache']
+
         # we create some time intervals
 
         poly_intervals = TimeIntervalSet.from_strings(*time_intervals)
@@ -382,18 +590,58 @@ class TimeSeries(object):
 
         self._poly_intervals = poly_intervals
 
-        # Fit the events with the given intervals
-        if unbinned:
+        self._unbinned = unbinned  # keep track!
+
+        # look for the same fit in the cache. If it is not there, a fit of
+        # similar selections (if any) is used as the starting point
+
+        cache = None
+        cached_fit = None
+        self._warm_start_fit = None
+
+        if use_cache:
+
+            cache_group, cache_key = self._get_background_cache_keys()
+
+            if cache_group is not None:
+
+                cache = get_background_fit_cache()
+
+                cached_fit = cache.get(cache_group, cache_key)
 
-            self._unbinned = True  # keep track!
+                if cached_fit is None:
 
-            self._unbinned_fit_polynomials()
+                    self._warm_start_fit = cache.get_warm_start(cache_group,
+                                                                self._poly_intervals.start_times,
+                                                                self._poly_intervals.stop_times)
+
+        if cached_fit is not None:
+
+            self._restore_cached_fit(cached_fit)
 
         else:
 
-            self._unbinned = False
+            # Fit the events with the given intervals
+            if unbinned:
+
+                self._unbinned_fit_polynomials()
+
+            else:
+
+                self._fit_polynomials()
 
-            self._fit_polynomials()
+            if cache is not None:
+
+                cache.put(cache_group, cache_key,
+                          self._polynomials.coefficients,
+                          self._polynomials.covariance_matrices,
+                          self._optimal_polynomial_grade,
+                          self._fit_method_info['bin type'],
+                          self._fit_method_info['fit method'],
+                          np.asarray(self._poly_intervals.start_times),
+                          np.asarray(self._poly_intervals.stop_times))
+
+        self._warm_start_fit = None
 
         # we have a fit now
 
@@ -409,6 +657,91 @@ class TimeSeries(object):
         if self._time_selection_exists:
             self.set_active_time_intervals(*self._time_intervals.to_string().split(','))
 
+    def _data_fingerprint(self):
+        """
+        The arrays which identify the data of this time series, used to look for the background fits of
+        the same data in the background fit cache. Subclasses which return None are not cached
+
+        :return: list of arrays or None
+        """
+
+        return None
+
+    def _get_background_cache_keys(self):
+        """
+        The keys of the current background fit in the background fit cache. The group identifies the data, the
+        order and the fit method, the key identifies also the polynomial selections
+
+        :return: (group, key), or (None, None) if this time series cannot be cached
+        """
+
+        if self._data_hash is None:
+
+            fingerprint = self._data_fingerprint()
+
+            if fingerprint is None:
+
+                return None, None
+
+            self._data_hash = hash_arrays(self.__class__.__name__, self._n_channels, *fingerprint)
+
+        if self._unbinned:
+
+            fit_configuration = (threeML_config['event list']['unbinned fit method'],
+                                 sorted(threeML_config['event list']['unbinned fit options'].items()))
+
+        else:
+
+            fit_configuration = (threeML_config['event list']['binned fit method'],
+                                 sorted(threeML_config['event list']['binned fit options'].items()))
+
+        group = hash_arrays(self._data_hash, self._user_poly_order, self._unbinned, self._batch_fit, fit_configuration)
+
+        key = hash_arrays(group,
+                          np.asarray(self._poly_intervals.start_times, dtype=float),
+                          np.asarray(self._poly_intervals.stop_times, dtype=float))
+
+        return group, key
+
+    def _restore_cached_fit(self, cached_fit):
+        """
+        Use a fit from the background fit cache
+
+        :param cached_fit: the dictionary returned by the cache
+        :return: none
+        """
+
+        self._polynomials = PolynomialSet.from_arrays(cached_fit['coefficients'], cached_fit['covariances'])
+
+        self._optimal_polynomial_grade = cached_fit['grade']
+
+        self._fit_method_info['bin type'] = cached_fit['bin type']
+        self._fit_method_info['fit method'] = cached_fit['fit method']
+
+        # the selections might have been adjusted to the data before the fit
+
+        self._poly_intervals = TimeIntervalSet.from_starts_and_stops(cached_fit['starts'], cached_fit['stops'])
+
+        self._poly_fit_exists = True
+
+        if self._verbose:
+            print("Using the cached background fit")
+
+    def _get_warm_start(self, grade):
+        """
+        The coefficients of a cached fit of similar selections, to be used as the starting point of the fit
+        of each channel
+
+        :param grade: the grade of the polynomials which are going to be fit
+        :return: a list with the starting coefficients (or None) for each channel
+        """
+
+        if self._warm_start_fit is not None and self._warm_start_fit['grade'] == grade:
+
+            return list(self._warm_start_fit['coefficients'])
+
+        return [None] * self._n_channels
+
     def get_information_dict(self, use_poly=False, extract=False):
         """
         Return a PHAContainer that can be read by different builders
@@ -621,6 +954,40 @@ class TimeSeries(object):
 
         return best_grade
 
+    def _fit_channels(self, worker, channel_data, title="Fitting background"):
+        """
+        Apply the polynomial fitting function to the data of each channel. The channels are independent,
+        so if parallel computation is active they are distributed among the engines of the parallel client.
+
+        The worker only receives the data of one channel (and not the time series) so that
+        only what is needed for the fit is sent to the engines.
+
+        :param worker: a function taking the data of one channel and returning a Polynomial
+        :param channel_data: a list with the data of each channel
+        :param title: the title of the progress bar
+        :return: a PolynomialSet with the polynomials, in channel order
+        """
+
+        if threeML_config['parallel']['use-parallel']:
+
+            client = ParallelClient()
+
+            polynomials = client.execute_with_progress_bar(worker, channel_data)
+
+        else:
+
+            polynomials = []
+
+            with progress_bar(len(channel_data), title=title) as p:
+
+                for this_channel_data in channel_data:
+
+                    polynomials.append(worker(this_channel_data))
+
+                    p.increase()
+
+        return PolynomialSet(polynomials)
+
     def _fit_polynomials(self):
 
         raise NotImplementedError('this must be implemented in a subclass')
@@ -705,7 +1072,7 @@ class TimeSeries(object):
 
             covariance = store['covariance']
 
-            self._polynomials = []
+            polynomials = []
 
             # create new polynomials
 
@@ -720,7 +1087,9 @@ class TimeSeries(object):
 
                 cov = covariance.loc[i]
 
-                self._polynomials.append(Polynomial.from_previous_fit(coeff, cov))
+                polynomials.append(Polynomial.from_previous_fit(coeff, cov))
+
+            self._polynomials = PolynomialSet(polynomials)
 
             metadata = store.get_storer('coefficients').attrs.metadata
 
@@ -760,6 +1129,6 @@ class TimeSeries(object):
         if self._time_selection_exists:
             self.set_active_time_intervals(*self._time_intervals.to_string().split(','))
 
-    def view_lightcurve(self, start=-10, stop=20., dt=1., use_binner=False):
+    def view_lightcurve(self, start=-10, stop=20., dt=1., use_binner=False, mask=None):
 
         raise NotImplementedError('must be implemented in subclass')